@@ -0,0 +1,9 @@
+# Замеры производительности: python -m benchmarks.<скрипт> из корня репозитория.
+# Каждый прогон — на временной SQLite-базе и во временном рабочем каталоге: рабочая mun_bot.db
+# и bot.log не трогаются; другую базу можно задать через DATABASE_URL
+import os
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp(prefix="mun_bot_bench_")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(_tmp_dir, 'bench.db')}")
+os.chdir(_tmp_dir)
@@ -0,0 +1,99 @@
+# Рассылка через фейковый Bot API с лимитами как у Telegram: 30 сообщений в секунду на бота,
+# одно в секунду в чат, задержка ответа 80 мс, 2% временных 5xx и 3% заблокировавших бота.
+#   python -m benchmarks.bench_broadcast [sequential|naive|broadcaster] [получателей]
+# sequential — прежний цикл send_message по одному, naive — 8 параллельных отправок без темпа,
+# broadcaster — broadcast.broadcaster с настройками BROADCAST_* из config.py
+import asyncio
+import collections
+import logging
+import random
+import sys
+import time
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError, TelegramForbiddenError
+
+from broadcast import broadcaster
+from tests.helpers import fake_bot
+
+LIMIT = 30
+LATENCY = 0.08
+
+
+class FakeTelegram:
+    def __init__(self, recipients: int):
+        rng = random.Random(1)
+        self.blocked = set(rng.sample(range(1, recipients + 1), recipients * 3 // 100))
+        self.flaky = set(rng.sample(range(1, recipients + 1), recipients * 2 // 100))
+        self.window = collections.deque()
+        self.chat_last = {}
+        self.errors = collections.Counter()
+        self.delivered = []
+
+    async def __call__(self, method):
+        await asyncio.sleep(LATENCY)
+        now = time.monotonic()
+        chat_id = method.chat_id
+        while self.window and self.window[0] <= now - 1:
+            self.window.popleft()
+        if len(self.window) >= LIMIT or now - self.chat_last.get(chat_id, -9) < 1:
+            self.errors["429"] += 1
+            raise TelegramRetryAfter(method, "Too Many Requests", 1)
+        if chat_id in self.flaky:
+            self.flaky.discard(chat_id)
+            self.errors["5xx"] += 1
+            raise TelegramServerError(method, "Bad Gateway")
+        if chat_id in self.blocked:
+            self.errors["403"] += 1
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+        self.window.append(now)
+        self.chat_last[chat_id] = now
+        self.delivered.append(now)
+
+    def peak_per_second(self) -> int:
+        return max((sum(1 for t in self.delivered if start <= t < start + 1) for start in self.delivered), default=0)
+
+
+async def main(mode: str, recipients: int):
+    logging.disable(logging.CRITICAL)
+    api = FakeTelegram(recipients)
+    bot = fake_bot(api)
+    users = list(range(1, recipients + 1))
+    sent = failed = 0
+    start = time.monotonic()
+
+    if mode == "sequential":
+        for chat_id in users:
+            try:
+                await bot.send_message(chat_id, "hi")
+                sent += 1
+            except Exception:
+                failed += 1
+    elif mode == "naive":
+        semaphore = asyncio.Semaphore(8)
+
+        async def send(chat_id: int):
+            nonlocal sent, failed
+            async with semaphore:
+                try:
+                    await bot.send_message(chat_id, "hi")
+                    sent += 1
+                except Exception:
+                    failed += 1
+
+        await asyncio.gather(*(send(chat_id) for chat_id in users))
+    else:
+        result = await broadcaster.run(users, lambda chat_id: bot.send_message(chat_id, "hi"))
+        sent, failed = result.sent, result.failed
+
+    elapsed = time.monotonic() - start
+    print(
+        f"{mode:12s} доставлено {sent}/{recipients}, не доставлено {failed} за {elapsed:.1f} с "
+        f"({sent / elapsed:.1f} сообщ./с), пик за секунду {api.peak_per_second()}, ошибки API {dict(api.errors)}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        sys.argv[1] if len(sys.argv) > 1 else "broadcaster",
+        int(sys.argv[2]) if len(sys.argv) > 2 else 300,
+    ))
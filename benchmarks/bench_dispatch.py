@@ -0,0 +1,58 @@
+# Кнопки главного меню: прежняя цепочка хендлеров F.text == "..." на каждую кнопку
+# против одного фильтра F.text.in_(MAIN_MENU) с поиском в dict.
+# Отдельные Dispatcher без middleware и БД — меряется только проход апдейта по фильтрам
+import asyncio
+import logging
+import time
+
+from aiogram import Dispatcher, Router, F
+
+from bot import MAIN_MENU
+from tests.helpers import fake_bot, message_update
+
+UPDATES = 5000
+
+
+async def noop(message):
+    pass
+
+
+def chain_dispatcher() -> Dispatcher:
+    router = Router()
+    for text in MAIN_MENU:
+        router.message(F.text == text)(noop)
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+    return dispatcher
+
+
+def dict_dispatcher() -> Dispatcher:
+    router = Router()
+    router.message(F.text.in_(MAIN_MENU))(noop)
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+    return dispatcher
+
+
+async def measure(dispatcher: Dispatcher, text: str) -> float:
+    bot = fake_bot()
+    updates = [message_update(1, text) for _ in range(UPDATES)]
+    for update in updates[:200]:
+        await dispatcher.feed_update(bot, update)
+    start = time.perf_counter()
+    for update in updates:
+        await dispatcher.feed_update(bot, update)
+    return (time.perf_counter() - start) / UPDATES * 1e6
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    texts = list(MAIN_MENU)
+    cases = (("первая кнопка", texts[0]), ("последняя кнопка", texts[-1]), ("не кнопка", "привет"))
+    chain, lookup = chain_dispatcher(), dict_dispatcher()
+    for label, text in cases:
+        print(f"{label:18s} цепочка {await measure(chain, text):6.1f} мкс  dict {await measure(lookup, text):6.1f} мкс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+# Списки и выгрузки на 100 000 строк: ORM-объекты против Row-кортежей из queries.py.
+# Лучшее время из трёх прогонов и пик памяти (tracemalloc; сам замер памяти замедляет прогон,
+# поэтому время и память меряются отдельными проходами)
+import asyncio
+import logging
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from sqlalchemy import select, insert
+
+import queries
+from database import init_db, enable_wal, close_db, engine, AsyncSessionLocal, User, Conference
+
+ROWS = 100_000
+ROUNDS = 3
+
+
+async def fill():
+    async with engine.begin() as conn:
+        await conn.execute(insert(User), [
+            dict(telegram_id=10_000_000 + i, full_name=f"User {i}", username=f"u{i}", role="Участник")
+            for i in range(ROWS)
+        ])
+        await conn.execute(insert(Conference), [
+            dict(
+                name=f"Conf {i}", city="Бишкек", date=date(2027, 1, 1) + timedelta(days=i % 300), fee=100,
+                description="x" * 80, organizer_id=1 + i, is_active=True,
+            )
+            for i in range(ROWS)
+        ])
+
+
+async def fetch(stmt, orm: bool):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        rows = result.scalars().all() if orm else result.all()
+        # Как хендлер: читаем поле каждой строки
+        return sum(len(row.full_name if hasattr(row, "full_name") else row.name) for row in rows), len(rows)
+
+
+async def measure(label: str, make_stmt, orm: bool):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        _, count = await fetch(make_stmt(), orm)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    await fetch(make_stmt(), orm)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:42s} {best * 1000:7.0f} мс  пик {peak / 2**20:6.1f} МиБ  строк {count}")
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    await init_db()
+    await enable_wal()
+    await fill()
+    await measure("конференции: select(Conference)", lambda: select(Conference).where(Conference.is_active == True), orm=True)
+    await measure("конференции: queries.active_conferences()", queries.active_conferences, orm=False)
+    await measure("пользователи: select(User)", lambda: select(User), orm=True)
+    await measure("пользователи: queries.users_export()", queries.users_export, orm=False)
+    await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
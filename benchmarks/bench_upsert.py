@@ -0,0 +1,89 @@
+# get_or_create_user: прежний SELECT + INSERT/UPDATE + отдельные коммиты против одного UPSERT.
+# Три случая: пользователь не изменился, сменил имя, новый пользователь. Вывод — медиана мкс на вызов
+import asyncio
+import logging
+import statistics
+import time
+
+from sqlalchemy import select
+
+from config import TECH_SPECIALIST_ID, CHIEF_ADMIN_IDS
+from database import init_db, enable_wal, close_db, AsyncSessionLocal, User, Role, get_or_create_user
+
+CALLS = 1500
+ROUNDS = 5
+
+
+# Версия до перехода на UPSERT — для сравнения
+async def select_then_insert(telegram_id: int, full_name: str | None = None, username: str | None = None) -> User:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        user = result.scalar_one_or_none()
+
+        if user is None:
+            user = User(
+                telegram_id=telegram_id,
+                username=username,
+                full_name=full_name or "Не указано",
+                role=Role.PARTICIPANT.value,
+                is_banned=False
+            )
+            session.add(user)
+            await session.commit()
+            await session.refresh(user)
+        else:
+            updated = False
+            if full_name and user.full_name != full_name:
+                user.full_name = full_name
+                updated = True
+            if username and user.username != username:
+                user.username = username
+                updated = True
+            if updated:
+                await session.commit()
+                await session.refresh(user)
+
+        if telegram_id in CHIEF_ADMIN_IDS and user.role != Role.CHIEF_ADMIN.value:
+            user.role = Role.CHIEF_ADMIN.value
+            await session.commit()
+
+        if telegram_id == TECH_SPECIALIST_ID and user.role != Role.CHIEF_TECH.value:
+            user.role = Role.CHIEF_TECH.value
+            await session.commit()
+
+        return user
+
+
+# У каждой реализации свой диапазон telegram_id, чтобы «новые» пользователи действительно были новыми
+next_new_id = {"select_then_insert": 10**6, "upsert": 2 * 10**6}
+
+
+async def measure(label: str, fn, case: str) -> float:
+    start = time.perf_counter()
+    for i in range(CALLS):
+        if case == "unchanged":
+            await fn(42, "Same Name")
+        elif case == "rename":
+            await fn(43, f"Name {i}")
+        else:
+            next_new_id[label] += 1
+            await fn(next_new_id[label], "New")
+    return (time.perf_counter() - start) / CALLS * 1e6
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    await init_db()
+    await enable_wal()
+    implementations = (("select_then_insert", select_then_insert), ("upsert", get_or_create_user))
+    for case in ("unchanged", "rename", "new"):
+        timings = {label: [] for label, _ in implementations}
+        for _ in range(ROUNDS):
+            for label, fn in implementations:
+                timings[label].append(await measure(label, fn, case))
+        print(f"{case:10s} " + "  ".join(f"{label} {statistics.median(t):6.0f} мкс" for label, t in timings.items()))
+    await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+# Нагрузочный прогон приёма апдейтов: N пользователей шлют /start, Bot API отвечает с задержкой.
+#   python -m benchmarks.bench_webhook webhook — aiohttp-сервер из webhook.py, клиент в отдельном процессе
+#   python -m benchmarks.bench_webhook polling — тот же поток апдейтов через getUpdates
+# Для webhook: время ответа 200 и время до ответа бота; для polling — только время до ответа
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from aiohttp import web, ClientSession, TCPConnector
+
+import webhook
+from bot import bot, dp
+from config import WEBHOOK_PATH
+from database import init_db, enable_wal, close_db, load_ban_registry
+from middlewares.db_session import DbSessionReleaseMiddleware
+from tests.helpers import FakeSession, message_update
+
+UPDATES = int(os.getenv("N", "2000"))
+API_DELAY = 0.02
+PORT = 8099
+SECRET = "bench-secret"
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * p) - 1, 0)] * 1000
+
+
+def replied(done: dict):
+    async def hook(method):
+        if type(method).__name__ == "SendMessage":
+            done[method.chat_id] = time.perf_counter()
+    return hook
+
+
+# Как у настоящей сессии бота в bot.py: соединение БД отдаётся перед запросом к Bot API
+def fake_api(hook) -> FakeSession:
+    session = FakeSession(hook, delay=API_DELAY)
+    session.middleware(DbSessionReleaseMiddleware())
+    return session
+
+
+async def wait_all(done: dict):
+    while len(done) < UPDATES:
+        await asyncio.sleep(0.01)
+
+
+# Клиент-«Telegram» в отдельном процессе, чтобы не делить цикл событий с ботом
+def webhook_client(payloads: list[tuple[int, str]], results: multiprocessing.Queue):
+    async def post_all():
+        url = f"http://127.0.0.1:{PORT}{WEBHOOK_PATH}"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET, "Content-Type": "application/json"}
+        latencies, sent = [], {}
+        async with ClientSession(connector=TCPConnector(limit=100)) as client:
+            async def post(chat_id: int, body: str):
+                start = sent[chat_id] = time.perf_counter()
+                async with client.post(url, data=body, headers=headers) as response:
+                    assert response.status == 200
+                latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(post(chat_id, body) for chat_id, body in payloads))
+            results.put((latencies, sent, time.perf_counter() - start))
+
+    asyncio.run(post_all())
+
+
+async def run_webhook():
+    done = {}
+    webhook.WEBHOOK_SECRET = SECRET
+    bot.session = fake_api(replied(done))
+    runner = web.AppRunner(webhook.build_webhook_app(dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    updates = [message_update(3_000_000 + i, "/start") for i in range(UPDATES)]
+    payloads = [(update.message.chat.id, update.model_dump_json(exclude_none=True)) for update in updates]
+    results = multiprocessing.Queue()
+    client = multiprocessing.Process(target=webhook_client, args=(payloads, results))
+    start = time.perf_counter()
+    client.start()
+    await wait_all(done)
+    total = time.perf_counter() - start
+    latencies, sent, acked = await asyncio.get_running_loop().run_in_executor(None, results.get)
+    client.join()
+    await runner.cleanup()
+
+    handled = [done[chat_id] - sent[chat_id] for chat_id in sent]
+    print(
+        f"webhook: ответ 200 p50 {percentile(latencies, .5):.1f} мс, p99 {percentile(latencies, .99):.1f} мс "
+        f"(все за {acked:.2f} с); ответ бота p50 {percentile(handled, .5):.0f} мс, p99 {percentile(handled, .99):.0f} мс; "
+        f"всего {total:.2f} с ({UPDATES / total:.0f} апд./с)"
+    )
+
+
+async def run_polling():
+    done, sent = {}, {}
+    pending = [message_update(4_000_000 + i, "/start") for i in range(UPDATES)]
+    start = time.perf_counter()
+
+    async def hook(method):
+        nonlocal pending
+        if type(method).__name__ != "GetUpdates":
+            return await replied(done)(method)
+        batch, pending = pending[:100], pending[100:]
+        for update in batch:
+            sent.setdefault(update.message.chat.id, start)
+        if not batch:
+            await asyncio.sleep(0.5)
+        return batch
+
+    bot.session = fake_api(hook)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+    await wait_all(done)
+    total = time.perf_counter() - start
+    await dp.stop_polling()
+    polling.cancel()
+
+    handled = [done[chat_id] - sent[chat_id] for chat_id in sent]
+    print(
+        f"polling: ответ бота p50 {percentile(handled, .5):.0f} мс, p99 {percentile(handled, .99):.0f} мс; "
+        f"всего {total:.2f} с ({UPDATES / total:.0f} апд./с)"
+    )
+
+
+async def main(mode: str):
+    logging.disable(logging.CRITICAL)
+    await init_db()
+    await enable_wal()
+    await load_ban_registry()
+    await (run_webhook() if mode == "webhook" else run_polling())
+    await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "webhook"))
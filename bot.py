@@ -2,31 +2,37 @@ import asyncio
 import logging
 import sys
 from datetime import datetime, timedelta
-from collections import defaultdict
-import time
 
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Router, types, F
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.dispatcher.flags import extract_flags_from_object
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import Message
 
-import sqlalchemy as sa
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
-
-from config import BOT_TOKEN, CHIEF_ADMIN_IDS, TECH_SPECIALIST_ID
+from config import BOT_TOKEN, CHIEF_ADMIN_IDS, TECH_SPECIALIST_ID, BAN_RECONCILE_INTERVAL, BOT_MODE, SHUTDOWN_TIMEOUT
 from keyboards import get_main_menu_keyboard
 from handlers.common import router as common_router
 from handlers.organizer import router as organizer_router
 from handlers.admin import router as admin_router
 from handlers.tech_support import router as tech_support_router
 from handlers.ban import router as ban_router
+from handlers.broadcasts import router as broadcasts_router
+import handlers.common as common_handlers
+import handlers.organizer as organizer_handlers
+import handlers.admin as admin_handlers
+import handlers.tech_support as tech_support_handlers
+import handlers.ban as ban_handlers
 
 from database import (
     init_db, enable_wal, get_bot_status, get_or_create_user,
-    AsyncSessionLocal, Conference, Application
+    AsyncSessionLocal, write_queue, load_ban_registry, close_db, mark_unreachable
 )
+from queries import conferences_on_date, reminder_recipients
+from scheduler import ScheduledDispatcher, update_scheduler
+from fsm_storage import fsm_storage
+from broadcast import broadcast_jobs, is_unreachable
 
 # ────────────────────────────────────────────────
 # Настройка логирования (терминал + файл)
@@ -51,58 +57,58 @@ logging.getLogger("aiohttp").setLevel(logging.DEBUG)
 
 default_properties = DefaultBotProperties(parse_mode="HTML")
 bot = Bot(token=BOT_TOKEN, default=default_properties)
-dp = Dispatcher()
+# Апдейты обрабатываются параллельно, но по очереди для каждого пользователя (scheduler.py);
+# состояния анкет переживают перезапуск (fsm_storage.py)
+dp = ScheduledDispatcher(storage=fsm_storage)
 
 
 # ────────────────────────────────────────────────
-# Антиспам (rate-limit 2 запроса в секунду)
+# Антиспам (token bucket, см. RATE_LIMIT_* в config.py)
 # ────────────────────────────────────────────────
 
-class SimpleRateLimitMiddleware:
-    def __init__(self, rate_limit: float = 0.5):
-        self.rate_limit = rate_limit
-        self.last_call = defaultdict(float)
+from middlewares.throttling import ThrottlingMiddleware
+
+# Первым из outer-middleware: отброшенный апдейт не открывает сессию БД и не ищет пользователя
+dp.update.outer_middleware(ThrottlingMiddleware())
+
+
+# ────────────────────────────────────────────────
+# Пауза бота — раньше сессии БД (outer-middleware выполняются в порядке регистрации)
+# ────────────────────────────────────────────────
 
-    async def __call__(self, handler, event, data):
-        user_id = None
-        if hasattr(event, 'from_user') and event.from_user:
-            user_id = event.from_user.id
-        elif hasattr(event, 'message') and event.message and event.message.from_user:
-            user_id = event.message.from_user.id
-        elif hasattr(event, 'callback_query') and event.callback_query and event.callback_query.from_user:
-            user_id = event.callback_query.from_user.id
+from middlewares.pause_middleware import PauseMiddleware
 
-        if not user_id:
-            return await handler(event, data)
+dp.update.outer_middleware(PauseMiddleware())
 
-        now = time.time()
-        last = self.last_call[user_id]
-        if now - last < self.rate_limit:
-            if hasattr(event, 'message') and event.message:
-                await event.message.answer("⏳ Не спамьте, подождите секунду...")
-            elif hasattr(event, 'callback_query') and event.callback_query:
-                await event.callback_query.answer("⏳ Не спамьте!", show_alert=True)
-            return
 
-        self.last_call[user_id] = now
-        return await handler(event, data)
+# ────────────────────────────────────────────────
+# Сессия БД и пользователь — один раз на апдейт
+# ────────────────────────────────────────────────
 
+from middlewares.db_session import DbSessionMiddleware, DbSessionReleaseMiddleware
 
-dp.update.middleware(SimpleRateLimitMiddleware(rate_limit=0.5))
+dp.update.outer_middleware(DbSessionMiddleware())
+bot.session.middleware(DbSessionReleaseMiddleware())
 
 
 # ────────────────────────────────────────────────
-# Глобальный middleware: бан + пауза бота
+# callback_data кнопок — разбор один раз на нажатие (см. callbacks.py)
 # ────────────────────────────────────────────────
 
+from middlewares.callback_data import CallbackDataMiddleware
 
+dp.callback_query.outer_middleware(CallbackDataMiddleware())
 
-# Подключаем роутеры
+
+# Подключаем роутеры; кнопки главного меню — первыми (см. MAIN_MENU ниже)
+menu_router = Router()
+dp.include_router(menu_router)
 dp.include_router(common_router)
 dp.include_router(organizer_router)
 dp.include_router(admin_router)
 dp.include_router(tech_support_router)
 dp.include_router(ban_router)
+dp.include_router(broadcasts_router)
 
 
 # ────────────────────────────────────────────────
@@ -114,6 +120,12 @@ from middlewares.ban_middleware import BanMiddleware
 dp.message.middleware(BanMiddleware())
 dp.callback_query.middleware(BanMiddleware())
 
+# Сброс нагрузки — после бана: заблокированному «бот занят» не отвечаем
+from middlewares.load_shedding import LoadSheddingMiddleware, load_shedder
+
+dp.message.middleware(LoadSheddingMiddleware())
+dp.callback_query.middleware(LoadSheddingMiddleware())
+
 # Универсальная функция главного меню с приветствием
 async def show_main_menu(message: types.Message | types.CallbackQuery):
     if isinstance(message, types.CallbackQuery):
@@ -146,7 +158,8 @@ async def show_main_menu(message: types.Message | types.CallbackQuery):
         welcome_text += "\n\n🛠 <b>Вы — Главный Тех Специалист</b>."
 
     status = await get_bot_status()
-    if status.is_paused and not (user.id in CHIEF_ADMIN_IDS or user.id == TECH_SPECIALIST_ID):
+    if status.is_paused:
+        # Сюда на паузе доходят только главные админы и Тех Специалист (см. PauseMiddleware)
         welcome_text += f"\n\n🛑 <b>Бот приостановлен</b>\nПричина: {status.pause_reason or 'Технические работы'}"
 
     await msg.answer(welcome_text, reply_markup=get_main_menu_keyboard(db_user.role))
@@ -161,69 +174,14 @@ async def cmd_start_or_main_menu(message: types.Message):
     await show_main_menu(message)
 
 
-@dp.message(F.text == "🔄 Обновить")
+# Кнопки главного меню: текст кнопки → обработчик, один фильтр F.text.in_ (поиск в dict)
+# вместо цепочки F.text == "..." на каждую кнопку. Хендлеры из handlers/* импортируются
+# один раз при старте; лишние аргументы отсекает CallableObject, как у обычных хендлеров aiogram.
+
 async def refresh_menu(message: types.Message):
     await show_main_menu(message)
 
 
-# Участник
-@dp.message(F.text == "🔍 Просмотр конференций")
-async def text_conferences(message: types.Message):
-    from handlers.common import cmd_conferences
-    await cmd_conferences(message)
-
-
-@dp.message(F.text == "📝 Подать заявку на участие")
-async def text_register(message: types.Message):
-    from handlers.common import cmd_register
-    await cmd_register(message)
-
-
-@dp.message(F.text == "➕ Создать конференцию")
-async def text_create_conference(message: types.Message, state: FSMContext):
-    from handlers.common import cmd_create_conference
-    await cmd_create_conference(message, state)
-
-
-@dp.message(F.text == "📞 Обращение к тех. специалисту")
-async def text_support_appeal(message: types.Message, state: FSMContext):
-    from handlers.common import start_support_appeal
-    await start_support_appeal(message, state)
-
-
-# Организатор
-@dp.message(F.text == "📋 Мои конференции")
-async def text_my_conferences(message: types.Message):
-    from handlers.organizer import my_conferences
-    await my_conferences(message)
-
-
-@dp.message(F.text == "📩 Заявки участников")
-async def text_applications(message: types.Message):
-    from handlers.organizer import current_applications
-    await current_applications(message)
-
-
-@dp.message(F.text == "🗃 Архив заявок")
-async def text_archive(message: types.Message):
-    from handlers.organizer import archive_applications
-    await archive_applications(message)
-
-
-# Глав Тех Специалист
-@dp.message(F.text == "📞 Очередь обращений участников")
-async def text_support_requests(message: types.Message):
-    from handlers.tech_support import list_support_requests
-    await list_support_requests(message)
-
-
-@dp.message(F.text == "🚫 Список забаненных пользователей")
-async def text_banned_list(message: types.Message):
-    from handlers.ban import banned_list
-    await banned_list(message)
-
-
-@dp.message(F.text == "⚠ Бан/разбан пользователей")
 async def text_ban_menu(message: types.Message):
     await message.answer(
         "Команды для бана/разбана:\n"
@@ -232,65 +190,64 @@ async def text_ban_menu(message: types.Message):
     )
 
 
-@dp.message(F.text == "🔑 Назначить роль другим пользователям")
-async def text_set_role_tech(message: types.Message):
+async def text_set_role(message: types.Message):
     await message.answer("Используйте команду /set_role @username роль")
 
 
-@dp.message(F.text == "📤 Экспорт данных бота")
-async def text_export_bot_data_tech(message: types.Message):
-    from handlers.admin import export_bot_data
-    await export_bot_data(message)
-
-
-@dp.message(F.text == "📊 Статистика")
-async def text_stats_tech(message: types.Message):
-    from handlers.admin import stats
-    await stats(message)
-
-
-@dp.message(F.text == "🗂 Все конференции")
-async def text_all_confs_tech(message: types.Message):
-    from handlers.admin import view_all_conferences
-    await view_all_conferences(message)
-
-
-@dp.message(F.text == "🗑 Удалить конференцию")
-async def text_delete_conf_tech(message: types.Message):
+async def text_delete_conf(message: types.Message):
     await message.answer("Используйте команду /delete_conf ID_конференции причина")
 
 
-# Админ
-@dp.message(F.text == "📩 Просмотр заявок на конференции")
-async def text_admin_requests(message: types.Message):
-    from handlers.admin import admin_conference_requests
-    await admin_conference_requests(message)
-
-
-@dp.message(F.text == "🗂 Все конференции")
-async def text_all_confs_admin(message: types.Message):
-    from handlers.admin import view_all_conferences
-    await view_all_conferences(message)
-
-
-@dp.message(F.text == "🗑 Удалить конференцию")
-async def text_delete_conf_admin(message: types.Message):
-    await message.answer("Используйте команду /delete_conf ID_конференции причина")
-
-
-# Главный Админ
-@dp.message(F.text == "📥 Посмотреть апелляции")
-async def text_view_appeals(message: types.Message):
-    from handlers.admin import view_appeals
-    await view_appeals(message)
-
-
-# Общие
-@dp.message(F.text == "❓ Помощь")
 async def text_help_button(message: types.Message):
     await cmd_help(message)
 
 
+MAIN_MENU = {
+    text: CallableObject(callback)
+    for text, callback in {
+        "🔄 Обновить": refresh_menu,
+        "❓ Помощь": text_help_button,
+        # Участник
+        "🔍 Просмотр конференций": common_handlers.cmd_conferences,
+        "📝 Подать заявку на участие": common_handlers.cmd_register,
+        "➕ Создать конференцию": common_handlers.cmd_create_conference,
+        "Создать конференцию": common_handlers.cmd_create_conference,
+        "📩 Обращение к тех. специалисту": common_handlers.start_support_appeal,
+        "📞 Обращение к тех. специалисту": common_handlers.start_support_appeal,
+        # Организатор
+        "📋 Мои конференции": organizer_handlers.my_conferences,
+        "📩 Заявки участников": organizer_handlers.current_applications,
+        "🗃 Архив заявок": organizer_handlers.archive_applications,
+        # Глав Тех Специалист
+        "📞 Очередь обращений участников": tech_support_handlers.list_support_requests,
+        "📢 Рассылка всем пользователям": tech_support_handlers.broadcast_button_help,
+        "🚫 Список забаненных пользователей": ban_handlers.banned_list,
+        "⚠ Бан/разбан пользователей": text_ban_menu,
+        "🔑 Назначить роль другим пользователям": text_set_role,
+        "📩 Обращения пользователей": admin_handlers.view_support_requests,
+        "📤 Экспорт обращений": admin_handlers.export_support_requests,
+        "📤 Экспорт данных бота": admin_handlers.export_bot_data,
+        "📊 Статистика": admin_handlers.stats,
+        # Админы
+        "🗂 Все конференции": admin_handlers.view_all_conferences,
+        "🗑 Удалить конференцию": text_delete_conf,
+        "📩 Просмотр заявок на конференции": admin_handlers.admin_conference_requests,
+        "📥 Посмотреть апелляции": admin_handlers.view_appeals,
+        "🛑 Приостановить бота": admin_handlers.pause_bot_handler,
+        "▶ Возобновить работу бота": admin_handlers.pause_bot_handler,
+    }.items()
+}
+
+
+@menu_router.message(F.text.in_(MAIN_MENU))
+async def main_menu_button(message: types.Message, **data):
+    button = MAIN_MENU[message.text]
+    # Флаги кнопок меню middleware не видит (хендлер у них общий) — проверяем здесь
+    if extract_flags_from_object(button.callback).get("deferrable") and await load_shedder.reject_if_busy(message):
+        return
+    await button.call(message, **data)
+
+
 @dp.message(Command("help"))
 async def cmd_help(message: Message):
     user = await get_or_create_user(message.from_user.id, message.from_user.full_name)
@@ -343,6 +300,7 @@ async def cmd_help(message: Message):
         help_text += "🗂 Все конференции — Список конференций\n"
         help_text += "🗑 Удалить конференцию — /delete_conf ID причина\n"
         help_text += "📢 Рассылка всем — /broadcast\n"
+        help_text += "⏸ Идущие рассылки — /broadcasts\n"
         help_text += "/stats — Статистика\n\n"
 
     await message.answer(help_text, parse_mode="HTML")
@@ -386,59 +344,79 @@ async def send_daily_reminders():
     today = datetime.now().date()
     tomorrow = today + timedelta(days=1)
 
+    # Списки читаем целиком и закрываем сессию до отправки: соединение пула не ждёт Telegram
     async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(Conference)
-            .where(sa.func.date(Conference.date) == tomorrow.strftime("%Y-%m-%d"))
-            .options(joinedload(Conference.applications).joinedload(Application.user))
-        )
-        conferences = result.scalars().unique().all()
-
-        for conf in conferences:
-            if not conf.is_active:
+        # Равенство по (is_active, date) — поиск по индексу, без func.date() на каждой строке
+        conferences = (await session.execute(conferences_on_date(tomorrow))).all()
+        recipients = (await session.execute(reminder_recipients(tomorrow))).all()
+
+    participants = {}
+    for row in recipients:
+        participants.setdefault(row.conference_id, []).append(row)
+
+    # Кому Telegram не даёт писать (заблокировали бота, удалили аккаунт) — в следующий раз пропустим
+    unreachable = []
+
+    for conf, confirmed in conferences:
+        # Участникам (с проверкой на бан)
+        for user in participants.get(conf.id, []):
+            if user.is_banned:
+                logging.warning(f"Пропуск напоминания для забаненного пользователя: {user.telegram_id}")
                 continue
-
-            confirmed_apps = [app for app in conf.applications if app.status in ["confirmed", "link_sent"]]
-
-            # Участникам (с проверкой на бан)
-            for app in confirmed_apps:
-                user = app.user
-                if user.is_banned:
-                    logging.warning(f"Пропуск напоминания для забаненного пользователя: {user.telegram_id}")
-                    continue
-                try:
-                    text = (
-                        f"Напоминание! 🎉\n\n"
-                        f"Завтра ({conf.date}) состоится конференция:\n"
-                        f"<b>{conf.name}</b>\n"
-                        f"Город: {conf.city or 'Онлайн'}\n"
-                        f"Оргвзнос: {conf.fee} руб.\n\n"
-                        f"Не забудьте подготовиться!\n"
-                        f"По вопросам — пишите в техподдержку."
-                    )
-                    await bot.send_message(user.telegram_id, text)
-                except Exception:
-                    pass
-
-            # Организатору
             try:
-                await bot.send_message(
-                    conf.organizer.telegram_id,
-                    f"Напоминание организатору!\n\n"
-                    f"Завтра ваша конференция <b>{conf.name}</b>\n"
-                    f"Участников подтверждено: {len(confirmed_apps)}"
+                text = (
+                    f"Напоминание! 🎉\n\n"
+                    f"Завтра ({conf.date.strftime('%d.%m.%Y')}) состоится конференция:\n"
+                    f"<b>{conf.name}</b>\n"
+                    f"Город: {conf.city or 'Онлайн'}\n"
+                    f"Оргвзнос: {conf.fee} руб.\n\n"
+                    f"Не забудьте подготовиться!\n"
+                    f"По вопросам — пишите в техподдержку."
                 )
-            except Exception:
-                pass
+                await bot.send_message(user.telegram_id, text)
+            except Exception as e:
+                if is_unreachable(e):
+                    unreachable.append(user.telegram_id)
+
+        # Организатору (недоступному — не пишем)
+        if conf.organizer.unreachable_at is not None:
+            continue
+        try:
+            await bot.send_message(
+                conf.organizer.telegram_id,
+                f"Напоминание организатору!\n\n"
+                f"Завтра ваша конференция <b>{conf.name}</b>\n"
+                f"Участников подтверждено: {confirmed}"
+            )
+        except Exception as e:
+            if is_unreachable(e):
+                unreachable.append(conf.organizer.telegram_id)
+
+    if unreachable:
+        logging.info(f"Напоминания: недоступных получателей {len(unreachable)}, отмечаем")
+        await mark_unreachable(unreachable)
 
 
 async def reminder_scheduler():
     while True:
         logging.info("Проверка напоминаний о конференциях...")
-        await send_daily_reminders()
+        try:
+            await send_daily_reminders()
+        except Exception as e:
+            logging.error(f"Ошибка рассылки напоминаний: {e}")
         await asyncio.sleep(3600)
 
 
+async def ban_reconcile_scheduler():
+    # Баны, выставленные в обход бота (правка БД, другой инстанс), подхватываются здесь
+    while True:
+        await asyncio.sleep(BAN_RECONCILE_INTERVAL)
+        try:
+            await load_ban_registry()
+        except Exception as e:
+            logging.error(f"Ошибка сверки списка банов: {e}")
+
+
 # ────────────────────────────────────────────────
 # Точка входа
 # ────────────────────────────────────────────────
@@ -447,20 +425,63 @@ async def main():
     logging.info("Инициализация базы данных...")
     await init_db()
     await enable_wal()
-    logging.info("База готова. Запуск бота...")
+    write_queue.start()
+    banned = await load_ban_registry()
+    forms = await fsm_storage.load()
+    fsm_storage.start()
+    logging.info(f"База готова (забанено пользователей: {banned}, незавершённых анкет: {forms}). Запуск бота...")
+
+    resumed = await broadcast_jobs.resume_all(bot)
+    if resumed:
+        logging.info(f"Продолжаем прерванные рассылки: {resumed}")
 
-    asyncio.create_task(reminder_scheduler())
+    background = [
+        asyncio.create_task(reminder_scheduler()),
+        asyncio.create_task(ban_reconcile_scheduler()),
+    ]
 
     try:
-        logging.info("Начинаем polling... Ожидаем сообщения от Telegram")
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            from webhook import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            # Если раньше был включён webhook, getUpdates с ним не работает
+            await bot.delete_webhook()
+            logging.info("Начинаем polling... Ожидаем сообщения от Telegram")
+            # Сессию не закрываем вместе с polling — она ещё нужна апдейтам, которые дорабатывают ниже
+            await dp.start_polling(bot, close_bot_session=False)
     except Exception as e:
         logging.error(f"КРИТИЧЕСКАЯ ОШИБКА: {e}")
         import traceback
         traceback.print_exc()
     finally:
-        await bot.session.close()
-        logging.info("Бот остановлен.")
+        await shutdown(background)
+
+
+async def shutdown(background: list[asyncio.Task]):
+    # Приём апдейтов к этому моменту остановлен (polling завершён / webhook-сервер закрыт).
+    # Порядок важен: сначала доработать апдейты, потом сбросить то, что они записали
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
+    sched = update_scheduler.stats()
+    logging.info(f"Остановка: дорабатываем апдейты (в работе {sched['active']}, ждут {sched['waiting']})")
+    if not await update_scheduler.drain(SHUTDOWN_TIMEOUT):
+        sched = update_scheduler.stats()
+        logging.warning(
+            f"За {SHUTDOWN_TIMEOUT:.0f} с не доработали апдейты: в работе {sched['active']}, ждут {sched['waiting']}"
+        )
+
+    # Рассылки останавливаются вместе с апдейтами; ждём, пока они запишут, кому уже отправили
+    if not await broadcast_jobs.wait_stopped(SHUTDOWN_TIMEOUT):
+        logging.warning("Рассылки не успели записать прогресс — часть получателей может получить сообщение повторно")
+
+    await fsm_storage.close()
+    await write_queue.stop()
+    await close_db()
+    await bot.session.close()
+    logging.info("Бот остановлен.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,565 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import suppress
+from datetime import datetime
+from typing import Awaitable, Callable, Iterable
+
+import sqlalchemy as sa
+from aiogram import Bot, types
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramNetworkError, TelegramServerError,
+)
+
+from config import (
+    BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_CHAT_INTERVAL,
+    BROADCAST_MAX_ATTEMPTS, BROADCAST_RETRY_BACKOFF, BROADCAST_PROGRESS_INTERVAL,
+)
+from database import AsyncSessionLocal, BroadcastJob, BroadcastRecipient, write_queue, mark_unreachable
+from keyboards import get_broadcast_job_keyboard
+from scheduler import update_scheduler
+from utils import DecayingAverage
+
+# Отправка одному получателю: получает chat_id, сама выбирает метод API (текст, фото, видео...)
+SendFunc = Callable[[int], Awaitable]
+# Итог по получателю: chat_id и один из SENT / FAILED / UNREACHABLE. Воркер берёт следующего
+# получателя, только когда итог обработан
+ResultFunc = Callable[[int, str], Awaitable]
+
+SENT = "sent"
+FAILED = "failed"
+UNREACHABLE = "unreachable"  # заблокировал бота, удалил аккаунт или чата нет — тоже «не доставлено»
+
+# Сбои, после которых повтор имеет смысл: сеть, 5xx Telegram, таймаут
+_TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)
+
+
+def is_unreachable(error: Exception) -> bool:
+    return isinstance(error, TelegramForbiddenError) or (
+        isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower()
+    )
+
+
+# Сверх стольких записей из таблицы интервалов чатов выбрасываются уже прошедшие
+_CHAT_TABLE_PRUNE_AT = 10000
+
+
+# Общий темп отправки бота: не чаще одного сообщения в interval секунд.
+# Без запаса на всплеск — Telegram считает лимит в скользящем окне, и всплеск сверх темпа
+# в первую же секунду даёт RetryAfter. Время отправки резервируется сразу,
+# поэтому воркеры не толкаются за один и тот же слот
+class _Pacer:
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0  # ближайшее свободное время отправки
+        self._hold_until = 0.0
+
+    async def wait(self):
+        while True:
+            now = time.monotonic()
+            at = max(now, self._next, self._hold_until)
+            self._next = at + self.interval
+            if at > now:
+                await asyncio.sleep(at - now)
+            # Пока ждали, Telegram мог ответить RetryAfter — тогда встаём в очередь заново
+            if self._hold_until <= time.monotonic():
+                return
+
+    def hold(self, seconds: float):
+        # RetryAfter относится ко всему боту: останавливаем все рассылки, а не одного воркера
+        self._hold_until = max(self._hold_until, time.monotonic() + seconds)
+        self._next = max(self._next, self._hold_until)
+
+
+# Итог одной рассылки
+class BroadcastResult:
+    __slots__ = ("total", "sent", "failed", "unreachable", "retries", "started_at", "finished_at")
+
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.failed = 0  # включая unreachable
+        self.unreachable = 0
+        self.retries = 0
+        self.started_at = time.monotonic()
+        self.finished_at: float | None = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.done
+
+    @property
+    def interrupted(self) -> bool:
+        # Остановка бота: часть получателей не обработана
+        return self.remaining > 0
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+
+# Рассылки: пул воркеров на каждую рассылку, общий для всех рассылок темп (BROADCAST_RATE)
+# и не чаще одного сообщения в chat_interval в один чат.
+# RetryAfter приостанавливает все рассылки на указанное время, сообщение повторяется без счёта попыток.
+# Сетевые сбои и 5xx повторяются до max_attempts раз с экспоненциальной паузой.
+# Заблокировавшие бота и прочие 4xx — сразу «не доставлено»; недоступных (is_unreachable)
+# вызывающий получает отдельным итогом UNREACHABLE, чтобы больше им не писать
+class Broadcaster:
+    def __init__(self, rate: float, workers: int, chat_interval: float, max_attempts: int, backoff: float):
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._pacer = _Pacer(rate)
+        self._chat_next: dict[int, float] = {}
+        self.active = 0
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+        self.retries = 0
+        self.flood_waits = 0
+
+    async def run(
+        self, recipients: Iterable[int], send: SendFunc,
+        on_result: ResultFunc | None = None, stop: asyncio.Event | None = None,
+    ) -> BroadcastResult:
+        # stop — пауза или отмена: воркеры доотправляют начатое и больше никого не берут.
+        # Так же ведут себя при остановке бота
+        queue = list(dict.fromkeys(recipients))  # один получатель — одно сообщение
+        queue.reverse()  # pop() с конца — по исходному порядку
+        result = BroadcastResult(len(queue))
+        self.active += 1
+        try:
+            await asyncio.gather(*(
+                self._worker(queue, send, result, on_result, stop)
+                for _ in range(min(self.workers, len(queue)))
+            ))
+        finally:
+            self.active -= 1
+            result.finished_at = time.monotonic()
+        return result
+
+    @staticmethod
+    def _stopped(stop: asyncio.Event | None) -> bool:
+        return update_scheduler.closing or (stop is not None and stop.is_set())
+
+    async def _worker(self, queue: list[int], send: SendFunc, result: BroadcastResult,
+                      on_result: ResultFunc | None, stop: asyncio.Event | None):
+        while queue and not self._stopped(stop):
+            chat_id = queue.pop()
+            outcome = await self._deliver(chat_id, send, result, stop)
+            if outcome is None:
+                return
+            if outcome == SENT:
+                result.sent += 1
+                self.sent += 1
+            else:
+                result.failed += 1
+                self.failed += 1
+                if outcome == UNREACHABLE:
+                    result.unreachable += 1
+                    self.unreachable += 1
+            if on_result is not None:
+                await on_result(chat_id, outcome)
+
+    async def _deliver(self, chat_id: int, send: SendFunc, result: BroadcastResult,
+                       stop: asyncio.Event | None) -> str | None:
+        # None — остановились в очереди на отправку: получатель остаётся необработанным
+        attempt = 1
+        while True:
+            await self._wait_chat(chat_id)
+            await self._pacer.wait()
+            if self._stopped(stop):
+                return None
+            try:
+                await send(chat_id)
+                return SENT
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                logging.warning(f"Рассылка: Telegram просит подождать {e.retry_after} с")
+                self._pacer.hold(e.retry_after)
+            except _TRANSIENT_ERRORS as e:
+                if attempt >= self.max_attempts:
+                    logging.warning(f"Рассылка: {chat_id} не доставлено после {attempt} попыток: {e}")
+                    return FAILED
+                delay = self.backoff * 2 ** (attempt - 1)
+                attempt += 1
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                logging.debug(f"Рассылка: {chat_id} не доставлено: {e}")
+                return UNREACHABLE if is_unreachable(e) else FAILED
+            except Exception as e:
+                logging.error(f"Рассылка: ошибка отправки {chat_id}: {e}")
+                return FAILED
+            result.retries += 1
+            self.retries += 1
+
+    async def pace(self):
+        # Служебные запросы рассылок (правки прогресса) идут в том же общем темпе
+        await self._pacer.wait()
+
+    async def _wait_chat(self, chat_id: int):
+        now = time.monotonic()
+        at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = at + self.chat_interval
+        if len(self._chat_next) > _CHAT_TABLE_PRUNE_AT:
+            self._chat_next = {key: value for key, value in self._chat_next.items() if value > now}
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "sent": self.sent,
+            "failed": self.failed,
+            "unreachable": self.unreachable,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+        }
+
+
+broadcaster = Broadcaster(
+    BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_CHAT_INTERVAL,
+    BROADCAST_MAX_ATTEMPTS, BROADCAST_RETRY_BACKOFF,
+)
+
+
+# ────────────────────────────────────────────────
+# Рассылки-задания
+# ────────────────────────────────────────────────
+# Задание и его получатели лежат в broadcast_jobs / broadcast_recipients.
+# Итог по каждому получателю записывается сразу после отправки, и только потом воркер берёт
+# следующего; записи воркеров одной рассылки write_queue объединяет в общий коммит.
+# Поэтому и после штатного перезапуска, и после аварийного падения задание продолжается ровно
+# с необработанных получателей. Повторно сообщение может получить лишь тот, кому отправка уже
+# ушла, а отметка ещё не записана, — не больше одного получателя на воркер.
+
+def content_sender(bot: Bot, content: dict) -> SendFunc:
+    kind = content.get("type", "text")
+    text = content.get("text") or ""
+    file_id = content.get("file_id")
+
+    async def send(chat_id: int):
+        if kind == "photo":
+            await bot.send_photo(chat_id, file_id, caption=text)
+        elif kind == "video":
+            await bot.send_video(chat_id, file_id, caption=text)
+        elif kind == "document":
+            await bot.send_document(chat_id, file_id, caption=text)
+        else:
+            await bot.send_message(chat_id, text)
+
+    return send
+
+
+# Итоги по получателям, ещё не записанные в БД: если запись не удалась,
+# они уйдут со следующей.
+# job — отсоединённая копия строки задания: её счётчики идут в сообщение с прогрессом
+class _Checkpoint:
+    def __init__(self, job: BroadcastJob):
+        self.job = job
+        self.sent: list[int] = []
+        self.failed: list[int] = []
+        self.unreachable: list[int] = []
+        # Время и повторы закончившегося запуска — пишутся вместе с последними отметками
+        self.elapsed = 0.0
+        self.retries = 0
+
+    async def record(self, chat_id: int, outcome: str):
+        if outcome == SENT:
+            self.sent.append(chat_id)
+            self.job.sent += 1
+        else:
+            self.failed.append(chat_id)
+            self.job.failed += 1
+            if outcome == UNREACHABLE:
+                self.unreachable.append(chat_id)
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Рассылка #{self.job.id}: не удалось записать прогресс: {e}")
+
+    def finish_run(self, outcome: "BroadcastResult"):
+        self.elapsed += outcome.elapsed
+        self.retries += outcome.retries
+        self.job.elapsed += outcome.elapsed
+        self.job.retries += outcome.retries
+
+    async def flush(self):
+        if not self.sent and not self.failed and not self.elapsed:
+            return
+        sent, failed, elapsed, retries = self.sent, self.failed, self.elapsed, self.retries
+        self.sent, self.failed, self.elapsed, self.retries = [], [], 0.0, 0
+        job_id = self.job.id
+        unreachable, self.unreachable = self.unreachable, []
+
+        async def op(session):
+            for status, ids in (("sent", sent), ("failed", failed)):
+                if ids:
+                    await session.execute(
+                        sa.update(BroadcastRecipient)
+                        .where(BroadcastRecipient.job_id == job_id, BroadcastRecipient.telegram_id.in_(ids))
+                        .values(status=status)
+                    )
+            await session.execute(
+                sa.update(BroadcastJob).where(BroadcastJob.id == job_id).values(
+                    sent=BroadcastJob.sent + len(sent), failed=BroadcastJob.failed + len(failed),
+                    elapsed=BroadcastJob.elapsed + elapsed, retries=BroadcastJob.retries + retries,
+                )
+            )
+
+        try:
+            await write_queue.submit(op)
+        except BaseException:
+            # Запишем со следующей попыткой: отметки и счётчики меняются в одной транзакции
+            self.sent[:0] = sent
+            self.failed[:0] = failed
+            self.unreachable[:0] = unreachable
+            self.elapsed += elapsed
+            self.retries += retries
+            raise
+
+        if unreachable:
+            # Отдельной операцией: ошибка в отметке пользователей не откатывает прогресс рассылки
+            try:
+                await mark_unreachable(unreachable)
+            except Exception as e:
+                logging.error(f"Рассылка #{job_id}: не удалось отметить недоступных получателей: {e}")
+
+
+JOB_STATUS_TEXT = {
+    "running": "🔄 идёт",
+    "paused": "⏸ на паузе",
+    "cancelled": "⛔ отменена",
+    "done": "✅ завершена",
+}
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds + 0.5)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
+
+# Текст сообщения о рассылке: во время отправки — текущая скорость и оценка окончания,
+# после — итоговые время, средняя скорость и число повторов
+def job_status_text(job: BroadcastJob, rate: float = 0.0) -> str:
+    done = job.sent + job.failed
+    remaining = job.total - done
+    text = (
+        f"📢 <b>Рассылка #{job.id}</b> — {JOB_STATUS_TEXT.get(job.status, job.status)}\n"
+        f"{job.title}\n\n"
+        f"Отправлено: <b>{job.sent}</b>, не доставлено: <b>{job.failed}</b>, осталось: <b>{remaining}</b>"
+    )
+    if job.status == "running" and rate > 0:
+        text += f"\nСкорость: {rate:.1f} сообщ./с, до конца ~{format_duration(remaining / rate)}"
+    elif job.status != "running" and job.elapsed > 0:
+        text += (
+            f"\nВремя отправки: {format_duration(job.elapsed)}, "
+            f"в среднем {done / job.elapsed:.1f} сообщ./с, повторов: {job.retries}"
+        )
+    return text
+
+
+class BroadcastJobs:
+    def __init__(self):
+        self._running: dict[int, tuple[asyncio.Task, asyncio.Event]] = {}
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    async def create(self, bot: Bot, owner_telegram_id: int, title: str, content: dict,
+                     recipients: Iterable[int], status_message: types.Message | None = None) -> int:
+        # status_message — уже отправленное сообщение, в котором рассылка показывает прогресс
+        recipients = list(dict.fromkeys(recipients))
+
+        async def op(session):
+            job = BroadcastJob(
+                owner_telegram_id=owner_telegram_id, title=title, content=content,
+                status="running", total=len(recipients), created_at=datetime.now(),
+                status_chat_id=status_message.chat.id if status_message else None,
+                status_message_id=status_message.message_id if status_message else None,
+            )
+            session.add(job)
+            await session.flush()
+            if recipients:
+                await session.execute(
+                    sa.insert(BroadcastRecipient),
+                    [{"job_id": job.id, "telegram_id": telegram_id} for telegram_id in recipients],
+                )
+            return job.id
+
+        job_id = await write_queue.submit(op)
+        self._start(bot, job_id)
+        return job_id
+
+    async def resume_all(self, bot: Bot) -> int:
+        # При старте: задания, прерванные остановкой бота, продолжаются сами
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                sa.select(BroadcastJob.id).where(BroadcastJob.status == "running").order_by(BroadcastJob.id)
+            )
+            job_ids = result.scalars().all()
+        for job_id in job_ids:
+            self._start(bot, job_id)
+        return len(job_ids)
+
+    async def pause(self, job_id: int) -> bool:
+        if not await self._set_status(job_id, "paused", ("running",)):
+            return False
+        self._signal_stop(job_id)
+        return True
+
+    async def resume(self, bot: Bot, job_id: int) -> bool:
+        if not await self._set_status(job_id, "running", ("paused",)):
+            return False
+        # Прежний запуск мог ещё дописывать итоги после паузы
+        entry = self._running.get(job_id)
+        if entry is not None:
+            with suppress(Exception):
+                await entry[0]
+        self._start(bot, job_id)
+        return True
+
+    async def cancel(self, job_id: int) -> bool:
+        if not await self._set_status(job_id, "cancelled", ("running", "paused"), finished=True):
+            return False
+        self._signal_stop(job_id)
+        return True
+
+    async def wait_stopped(self, timeout: float) -> bool:
+        # Остановка бота: воркеры видят update_scheduler.closing, здесь ждём последний checkpoint
+        tasks = [task for task, _ in self._running.values()]
+        if not tasks:
+            return True
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        return not pending
+
+    def _start(self, bot: Bot, job_id: int):
+        stop = asyncio.Event()
+        task = asyncio.create_task(self._run(bot, job_id, stop))
+        self._running[job_id] = (task, stop)
+
+    def _signal_stop(self, job_id: int):
+        entry = self._running.get(job_id)
+        if entry is not None:
+            entry[1].set()
+
+    async def _set_status(self, job_id: int, status: str, allowed_from: tuple[str, ...],
+                          finished: bool = False) -> bool:
+        values = {"status": status}
+        if finished:
+            values["finished_at"] = datetime.now()
+        stmt = (
+            sa.update(BroadcastJob)
+            .where(BroadcastJob.id == job_id, BroadcastJob.status.in_(allowed_from))
+            .values(**values)
+        )
+
+        async def op(session):
+            result = await session.execute(stmt)
+            return result.rowcount > 0
+
+        return await write_queue.submit(op)
+
+    async def _run(self, bot: Bot, job_id: int, stop: asyncio.Event):
+        try:
+            async with AsyncSessionLocal() as session:
+                job = await session.get(BroadcastJob, job_id)
+                result = await session.execute(
+                    sa.select(BroadcastRecipient.telegram_id)
+                    .where(BroadcastRecipient.job_id == job_id, BroadcastRecipient.status == "pending")
+                    .order_by(BroadcastRecipient.telegram_id)
+                )
+                pending = result.scalars().all()
+            if job is None or job.status != "running":
+                return
+            logging.info(f"Рассылка #{job_id}: осталось {len(pending)} из {job.total}")
+
+            checkpoint = _Checkpoint(job)
+            progress = asyncio.create_task(self._show_progress(bot, job))
+            outcome = None
+            try:
+                outcome = await broadcaster.run(
+                    pending, content_sender(bot, job.content), on_result=checkpoint.record, stop=stop,
+                )
+            finally:
+                progress.cancel()
+                with suppress(asyncio.CancelledError):
+                    await progress
+                if outcome is not None:
+                    checkpoint.finish_run(outcome)
+                await checkpoint.flush()
+            logging.info(
+                f"Рассылка #{job_id}: запуск за {outcome.elapsed:.0f} с, {outcome.rate:.1f} сообщ./с, "
+                f"повторов {outcome.retries}"
+            )
+
+            if outcome.interrupted:
+                if update_scheduler.closing:
+                    # Задание остаётся running и продолжится после перезапуска
+                    return
+                # Пауза или отмена: статус уже записан, показываем его в сообщении с прогрессом
+                async with AsyncSessionLocal() as session:
+                    job.status = await session.scalar(sa.select(BroadcastJob.status).where(BroadcastJob.id == job_id))
+                await self._edit_status(bot, job)
+                return
+            if await self._set_status(job_id, "done", ("running",), finished=True):
+                job.status = "done"
+                await self._edit_status(bot, job)
+                await self._report(bot, job)
+        except Exception:
+            logging.exception(f"Рассылка #{job_id}: ошибка выполнения")
+        finally:
+            entry = self._running.get(job_id)
+            if entry is not None and entry[0] is asyncio.current_task():
+                del self._running[job_id]
+
+    async def _show_progress(self, bot: Bot, job: BroadcastJob):
+        # Скорость — по приросту обработанных за последние интервалы, старые интервалы быстро забываются
+        rate = DecayingAverage(half_life=BROADCAST_PROGRESS_INTERVAL * 2)
+        last_done, last_at = job.sent + job.failed, time.monotonic()
+        while True:
+            await self._edit_status(bot, job, rate.value())
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            now, done = time.monotonic(), job.sent + job.failed
+            rate.observe((done - last_done) / (now - last_at), now)
+            last_done, last_at = done, now
+
+    async def _edit_status(self, bot: Bot, job: BroadcastJob, rate: float = 0.0):
+        if job.status_message_id is None:
+            return
+        await broadcaster.pace()
+        try:
+            await bot.edit_message_text(
+                job_status_text(job, rate), chat_id=job.status_chat_id, message_id=job.status_message_id,
+                reply_markup=get_broadcast_job_keyboard(job.id, job.status),
+            )
+        except TelegramBadRequest:
+            pass  # текст не изменился или сообщение удалено — прогресс просто не показываем
+        except Exception as e:
+            logging.warning(f"Рассылка #{job.id}: не удалось обновить прогресс: {e}")
+
+    async def _report(self, bot: Bot, job: BroadcastJob):
+        # Правка сообщения не присылает уведомление — итог отдельным сообщением
+        try:
+            await bot.send_message(job.owner_telegram_id, job_status_text(job))
+        except Exception as e:
+            logging.error(f"Рассылка #{job.id}: не удалось отправить отчёт: {e}")
+
+
+broadcast_jobs = BroadcastJobs()
@@ -0,0 +1,175 @@
+import time
+from collections import OrderedDict
+
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, BOT_STATUS_REFRESH_INTERVAL
+
+
+# Компактная запись о пользователе — всё, что нужно проверкам прав и BanMiddleware
+class CachedUser:
+    __slots__ = ("id", "telegram_id", "role", "is_banned", "unreachable")
+
+    def __init__(self, id: int, telegram_id: int, role: str, is_banned: bool, unreachable: bool = False):
+        self.id = id
+        self.telegram_id = telegram_id
+        self.role = role
+        self.is_banned = is_banned
+        self.unreachable = unreachable  # есть unreachable_at — рассылки пропускают пользователя
+
+    def __repr__(self):
+        return (
+            f"CachedUser(id={self.id}, telegram_id={self.telegram_id}, role={self.role!r}, "
+            f"is_banned={self.is_banned}, unreachable={self.unreachable})"
+        )
+
+
+# Маркер промаха: None в кэше означает «пользователя нет в БД»
+MISSING = object()
+
+
+# LRU-кэш с TTL по telegram_id.
+# Инвалидируется явно там, где меняются role/is_banned; TTL страхует от пропущенных мест.
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[float, CachedUser | None]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, telegram_id: int):
+        entry = self._data.get(telegram_id)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            del self._data[telegram_id]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(telegram_id)
+        self.hits += 1
+        return record
+
+    def peek(self, telegram_id: int):
+        # Чтение без учёта в статистике и без сдвига в LRU (планировщик апдейтов)
+        entry = self._data.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            return MISSING
+        return entry[1]
+
+    def put(self, telegram_id: int, record: CachedUser | None):
+        self._data[telegram_id] = (time.monotonic() + self.ttl, record)
+        self._data.move_to_end(telegram_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, telegram_id: int):
+        if self._data.pop(telegram_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# Снимок строки bot_status — читается на каждом апдейте (PauseMiddleware, главное меню)
+class CachedBotStatus:
+    __slots__ = ("is_paused", "pause_reason", "paused_by", "paused_at")
+
+    def __init__(self, is_paused: bool, pause_reason: str | None, paused_by: int | None, paused_at):
+        self.is_paused = is_paused
+        self.pause_reason = pause_reason
+        self.paused_by = paused_by
+        self.paused_at = paused_at
+
+
+# Пауза — редкое действие админа: статус обновляет set_bot_paused,
+# а чтение из БД нужно только при старте и раз в refresh_interval на случай правок в обход бота
+class BotStatusCache:
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._status: CachedBotStatus | None = None
+        self._expires_at = 0.0
+        self.refreshes = 0
+
+    def get(self) -> CachedBotStatus | None:
+        if self._status is None or self._expires_at < time.monotonic():
+            return None
+        return self._status
+
+    def put(self, status: CachedBotStatus):
+        self._status = status
+        self._expires_at = time.monotonic() + self.refresh_interval
+        self.refreshes += 1
+
+
+# Множество забаненных telegram_id — проверка бана в BanMiddleware без обращения к БД.
+# Загружается при старте, обновляется в do_ban_unban после коммита и периодически сверяется с таблицей.
+class BanRegistry:
+    def __init__(self):
+        self._banned: set[int] = set()
+        # id, изменённые во время идущей сверки: их локальное состояние свежее снимка из БД
+        self._touched: set[int] | None = None
+        self.loaded = False
+        self.reconciles = 0
+        self.drift = 0
+
+    def is_banned(self, telegram_id: int) -> bool:
+        return telegram_id in self._banned
+
+    def ban(self, telegram_id: int):
+        self._banned.add(telegram_id)
+        if self._touched is not None:
+            self._touched.add(telegram_id)
+
+    def unban(self, telegram_id: int):
+        self._banned.discard(telegram_id)
+        if self._touched is not None:
+            self._touched.add(telegram_id)
+
+    def begin_sync(self):
+        self._touched = set()
+
+    def abort_sync(self):
+        self._touched = None
+
+    def finish_sync(self, banned_ids):
+        fresh = set(banned_ids)
+        for telegram_id in self._touched or ():
+            if telegram_id in self._banned:
+                fresh.add(telegram_id)
+            else:
+                fresh.discard(telegram_id)
+        self._touched = None
+        if self.loaded:
+            self.drift += len(fresh ^ self._banned)
+        self._banned = fresh
+        self.loaded = True
+        self.reconciles += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._banned),
+            "loaded": self.loaded,
+            "reconciles": self.reconciles,
+            "drift": self.drift,
+        }
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+ban_registry = BanRegistry()
+bot_status_cache = BotStatusCache(BOT_STATUS_REFRESH_INTERVAL)
@@ -0,0 +1,113 @@
+from aiogram.filters import Filter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+
+# ────────────────────────────────────────────────
+# Типизированные callback_data инлайн-кнопок
+# ────────────────────────────────────────────────
+# Формат — "префикс:поле:поле" (pack() из aiogram). Префикс определяет тип,
+# action — что сделать. Строка разбирается один раз в CallbackDataMiddleware,
+# хендлеры получают готовый объект в аргументе callback_data и фильтруются по типу и action.
+
+class ConferenceCallback(CallbackData, prefix="cf"):
+    action: str  # select | delete | confirm_delete | broadcast | export | admin_delete
+    id: int
+
+
+class ApplicationCallback(CallbackData, prefix="ap"):
+    action: str  # approve | reject | confirm
+    id: int
+
+
+class ApplicationPage(CallbackData, prefix="pg"):
+    mode: str  # current | archive
+    index: int
+
+
+class RequestCallback(CallbackData, prefix="rq"):
+    kind: str  # create | edit | appeal — заявка на создание, на редактирование, апелляция
+    action: str  # approve | reject | appeal (подать апелляцию на отклонённую заявку на создание)
+    id: int
+
+
+class SupportCallback(CallbackData, prefix="sp"):
+    action: str  # answer | reply | page
+    id: int  # ID обращения, для page — номер страницы
+
+
+class BroadcastCallback(CallbackData, prefix="bc"):
+    action: str  # pause | resume | cancel
+    id: int  # ID задания рассылки
+
+
+CALLBACK_TYPES: dict[str, type[CallbackData]] = {
+    cls.__prefix__: cls
+    for cls in (
+        ConferenceCallback, ApplicationCallback, ApplicationPage, RequestCallback, SupportCallback,
+        BroadcastCallback,
+    )
+}
+
+# Кнопки в уже отправленных сообщениях несут старый формат "действие_..._ID" —
+# переводим его в те же объекты, чтобы старые клавиатуры продолжали работать
+_LEGACY_PREFIXES = [
+    ("select_conf_", lambda i: ConferenceCallback(action="select", id=i)),
+    ("delete_conf_", lambda i: ConferenceCallback(action="delete", id=i)),
+    ("confirm_delete_", lambda i: ConferenceCallback(action="confirm_delete", id=i)),
+    ("broadcast_", lambda i: ConferenceCallback(action="broadcast", id=i)),
+    ("export_conf_", lambda i: ConferenceCallback(action="export", id=i)),
+    ("admin_delete_conf_", lambda i: ConferenceCallback(action="admin_delete", id=i)),
+    ("approve_", lambda i: ApplicationCallback(action="approve", id=i)),
+    ("reject_", lambda i: ApplicationCallback(action="reject", id=i)),
+    ("confirm_part_", lambda i: ApplicationCallback(action="confirm", id=i)),
+    ("conf_create_approve_", lambda i: RequestCallback(kind="create", action="approve", id=i)),
+    ("conf_create_reject_", lambda i: RequestCallback(kind="create", action="reject", id=i)),
+    ("conf_edit_approve_", lambda i: RequestCallback(kind="edit", action="approve", id=i)),
+    ("conf_edit_reject_", lambda i: RequestCallback(kind="edit", action="reject", id=i)),
+    ("conf_appeal_approve_", lambda i: RequestCallback(kind="appeal", action="approve", id=i)),
+    ("conf_appeal_reject_", lambda i: RequestCallback(kind="appeal", action="reject", id=i)),
+    ("appeal_submit_", lambda i: RequestCallback(kind="create", action="appeal", id=i)),
+    ("support_answer_", lambda i: SupportCallback(action="answer", id=i)),
+    ("reply_support_", lambda i: SupportCallback(action="reply", id=i)),
+    ("nav_support_", lambda i: SupportCallback(action="page", id=i)),
+]
+
+
+def _parse_legacy(data: str) -> CallbackData | None:
+    if data.startswith("nav_org_"):
+        mode, _, index = data[len("nav_org_"):].partition("_")
+        return ApplicationPage(mode=mode, index=int(index)) if index.isdigit() else None
+    for prefix, build in _LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            tail = data[len(prefix):]
+            return build(int(tail)) if tail.isdigit() else None
+    return None
+
+
+def parse_callback_data(data: str | None) -> CallbackData | None:
+    if not data:
+        return None
+    prefix, sep, _ = data.partition(":")
+    factory = CALLBACK_TYPES.get(prefix) if sep else None
+    if factory is None:
+        return _parse_legacy(data)
+    try:
+        return factory.unpack(data)
+    except (TypeError, ValueError):
+        return None
+
+
+# Фильтр хендлера: тип callback_data, допустимые action (если заданы) и точные значения других полей
+class OnCallback(Filter):
+    def __init__(self, factory: type[CallbackData], *actions: str, **fields):
+        self.factory = factory
+        self.actions = frozenset(actions)
+        self.fields = fields
+
+    async def __call__(self, callback: CallbackQuery, callback_data: CallbackData | None = None) -> bool:
+        if not isinstance(callback_data, self.factory):
+            return False
+        if self.actions and callback_data.action not in self.actions:
+            return False
+        return all(getattr(callback_data, name) == value for name, value in self.fields.items())
@@ -1,41 +1,301 @@
 import asyncio
-import sqlite3
+import functools
+import time
 import sqlalchemy as sa
 from enum import StrEnum
 from sqlalchemy import (
-    String, Integer, BigInteger, Float, Text, ForeignKey, JSON, select, func, DateTime
+    String, Integer, BigInteger, Float, Text, ForeignKey, JSON, select, func, Date, DateTime, event, Index
 )
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker, Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.pool import StaticPool
-from datetime import datetime
-
-from config import DB_PATH, TECH_SPECIALIST_ID, CHIEF_ADMIN_IDS
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool, AsyncAdaptedQueuePool
+from datetime import datetime, date as date_type
+
+from config import (
+    DATABASE_URL, TECH_SPECIALIST_ID, CHIEF_ADMIN_IDS,
+    DB_ENGINE_MODE, DB_READ_POOL_SIZE, DB_POOL_TIMEOUT,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE,
+    DB_WRITE_BEHIND, DB_WRITE_BATCH_WINDOW_MS, DB_WRITE_BATCH_MAX
+)
+from cache import user_cache, ban_registry, bot_status_cache, CachedBotStatus, CachedUser, MISSING
+from utils import DecayingAverage
 import logging
 
-# Движок — стабильный на Windows
-engine = create_async_engine(
-    f"sqlite+aiosqlite:///{DB_PATH}",
-    connect_args={
-        "timeout": 30.0,
-        "check_same_thread": False,
-        "detect_types": sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
-    },
-    echo=False,
-    pool_pre_ping=True,
-    future=True,
-    poolclass=StaticPool,
-)
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+
+SQLITE_CONNECT_ARGS = {
+    "timeout": 30.0,
+    "check_same_thread": False,
+    # detect_types не используем: даты/время конвертирует сам SQLAlchemy,
+    # а встроенный конвертер sqlite3 для DATE отдаёт ему уже готовый date
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection, read_only: bool):
+    # PRAGMA synchronous/foreign_keys действуют на соединение, поэтому ставим их на каждое новое
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL;")
+    cursor.execute("PRAGMA foreign_keys=ON;")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON;")
+    cursor.close()
+    # Встроенный lower() в SQLite понимает только ASCII; подменяем на юникодный,
+    # чтобы ilike/icontains по кириллице работали так же, как в PostgreSQL
+    dbapi_connection.create_function("lower", 1, _unicode_lower, deterministic=True)
+
+
+def _unicode_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+if not IS_SQLITE:
+    # PostgreSQL и прочие серверные СУБД: один пул на чтение и запись,
+    # конкурентность обеспечивает сама СУБД
+    engine = create_async_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_pre_ping=True,
+        future=True,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    read_engine = engine
+elif DB_ENGINE_MODE == "single":
+    # Одно соединение на весь процесс (старый режим) — стабильный на Windows
+    engine = create_async_engine(
+        DATABASE_URL,
+        connect_args=SQLITE_CONNECT_ARGS,
+        echo=False,
+        pool_pre_ping=True,
+        future=True,
+        poolclass=StaticPool,
+    )
+    read_engine = engine
+else:
+    # Писатель: ровно одно соединение, остальные ждут его в очереди пула
+    engine = create_async_engine(
+        DATABASE_URL,
+        connect_args=SQLITE_CONNECT_ARGS,
+        echo=False,
+        pool_pre_ping=True,
+        future=True,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    # Читатели: N read-only соединений, в режиме WAL читают параллельно с писателем
+    read_engine = create_async_engine(
+        DATABASE_URL,
+        connect_args=SQLITE_CONNECT_ARGS,
+        echo=False,
+        pool_pre_ping=True,
+        future=True,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DB_READ_POOL_SIZE,
+        max_overflow=0,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+
+    @event.listens_for(read_engine.sync_engine, "connect")
+    def _on_read_connect(dbapi_connection, connection_record):
+        _set_sqlite_pragmas(dbapi_connection, read_only=True)
+
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_write_connect(dbapi_connection, connection_record):
+        _set_sqlite_pragmas(dbapi_connection, read_only=False)
+
+
+# Сколько сессии ждут соединение-писатель (в режиме split — единственное, на PostgreSQL и в single —
+# любое соединение пула). Растёт, когда записи не успевают: по нему срабатывает сброс нагрузки
+write_wait = DecayingAverage(half_life=10.0)
 
-AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+class RoutingSession(Session):
+    # В пул читателей уходят только SELECT; flush, INSERT/UPDATE/DELETE и всё,
+    # про что нельзя сказать, что оно только читает (text(), from_statement()), — писателю.
+    # После первой записи сессия до конца транзакции остаётся на писателе,
+    # чтобы видеть свои же незакоммиченные изменения.
+    def get_bind(self, mapper=None, clause=None, **kw):
+        # Если за этим get_bind последует новое соединение, after_begin посчитает ожидание от этой точки
+        self.info["bind_requested_at"] = time.monotonic()
+        if read_engine is engine:
+            return engine.sync_engine
+        if self._flushing or clause is None or not clause.is_select:
+            self.info["use_writer"] = True
+        if self.info.get("use_writer"):
+            return engine.sync_engine
+        return read_engine.sync_engine
+
+
+@event.listens_for(RoutingSession, "after_begin")
+def _track_write_wait(session, transaction, connection):
+    requested_at = session.info.pop("bind_requested_at", None)
+    if requested_at is not None and connection.engine is engine.sync_engine:
+        write_wait.observe(time.monotonic() - requested_at)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _reset_writer_route(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("use_writer", None)
+
+
+AsyncSessionLocal = sessionmaker(
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False,
+)
 
 
 async def enable_wal():
+    if not IS_SQLITE:
+        return
+    # journal_mode хранится в самом файле БД — достаточно выставить один раз через писателя
     async with engine.begin() as conn:
         await conn.execute(sa.text("PRAGMA journal_mode=WAL;"))
-        await conn.execute(sa.text("PRAGMA synchronous=NORMAL;"))
-        await conn.execute(sa.text("PRAGMA foreign_keys=ON;"))
-        await conn.commit()
+
+
+# ────────────────────────────────────────────────
+# Групповой коммит (write-behind)
+# ────────────────────────────────────────────────
+# Некритичные мелкие записи (обновление имени, новые обращения, смена статуса заявки)
+# складываются в очередь и раз в несколько миллисекунд коммитятся одной транзакцией —
+# один fsync на пачку вместо одного на запись. Каждый вызов submit() получает future,
+# который завершается только после коммита пачки (результат операции или её исключение).
+# Оплаты и баны через очередь НЕ идут — там нужен немедленный синхронный коммит.
+#
+# Операция — async-функция от AsyncSession; коммит делает очередь.
+# Если пачка падает, она откатывается и операции повторяются по одной,
+# чтобы ошибка одной записи не роняла соседние.
+# Без DB_WRITE_BEHIND очередь выключена: submit() сразу выполняет операцию в своей транзакции.
+
+class WriteQueue:
+    def __init__(self, enabled: bool, window: float, max_batch: int):
+        self.enabled = enabled
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: list[tuple] = []
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.batches = 0
+        self.ops = 0
+        self.fallbacks = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.enabled and not self.running:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Дописываем всё, что успели поставить в очередь, и останавливаем фоновую задачу
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    def submit(self, op) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if not self.running:
+            return loop.create_task(self._apply_single(op))
+        future = loop.create_future()
+        self._pending.append((op, future))
+        self._wakeup.set()
+        return future
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._stopping:
+                # Окно накопления: всё, что придёт за это время, уйдёт одним коммитом
+                await asyncio.sleep(self.window)
+            await self._flush_once()
+            if self._stopping and not self._pending:
+                return
+
+    async def _flush_once(self):
+        batch = self._pending[:self.max_batch]
+        self._pending = self._pending[self.max_batch:]
+        if not self._pending and self._wakeup is not None:
+            self._wakeup.clear()
+
+        batch = [(op, future) for op, future in batch if not future.cancelled()]
+        if not batch:
+            return
+
+        try:
+            async with AsyncSessionLocal() as session:
+                results = [await op(session) for op, _ in batch]
+                await session.commit()
+        except Exception:
+            logging.exception(f"Групповой коммит из {len(batch)} операций не удался, повторяем по одной")
+            self.fallbacks += 1
+            for op, future in batch:
+                try:
+                    result = await self._apply_single(op)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+
+        self.batches += 1
+        self.ops += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _apply_single(self, op):
+        async with AsyncSessionLocal() as session:
+            result = await op(session)
+            await session.commit()
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "ops": self.ops,
+            "avg_batch": self.ops / self.batches if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+        }
+
+
+write_queue = WriteQueue(DB_WRITE_BEHIND, DB_WRITE_BATCH_WINDOW_MS / 1000, DB_WRITE_BATCH_MAX)
+
+
+def queued_update(obj, **values) -> asyncio.Future:
+    # UPDATE одной строки через очередь; загруженный объект сразу получает новые значения
+    # как «закоммиченные», чтобы сессия вызывающего не записала их второй раз при flush
+    mapper = sa.inspect(obj).mapper
+    model = mapper.class_
+    row_id = sa.inspect(obj).identity[0]
+    stmt = sa.update(model).where(mapper.primary_key[0] == row_id).values(**values)
+
+    async def op(session):
+        await session.execute(stmt)
+
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+    return write_queue.submit(op)
 
 
 class Base(DeclarativeBase):
@@ -52,6 +312,11 @@ class Role(StrEnum):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_role", "role"),
+        Index("ix_users_is_banned", "is_banned"),
+        Index("ix_users_unreachable_at", "unreachable_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
@@ -59,6 +324,8 @@ class User(Base):
     role: Mapped[str] = mapped_column(String(50), default=Role.PARTICIPANT.value)
     is_banned: Mapped[bool] = mapped_column(default=False)
     ban_reason: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Когда Telegram ответил, что писать пользователю нельзя (заблокировал бота, удалил аккаунт)
+    unreachable_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     full_name: Mapped[str | None] = mapped_column(String(200), nullable=True)
     age: Mapped[int | None] = mapped_column(Integer, nullable=True)
@@ -73,12 +340,16 @@ class User(Base):
 
 class Conference(Base):
     __tablename__ = "conferences"
+    __table_args__ = (
+        Index("ix_conferences_organizer_id", "organizer_id"),
+        Index("ix_conferences_is_active_date", "is_active", "date"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(200))
     description: Mapped[str | None] = mapped_column(Text, nullable=True)
     city: Mapped[str | None] = mapped_column(String(100), nullable=True)
-    date: Mapped[str] = mapped_column(String(50))  # Одна дата проведения
+    date: Mapped[date_type] = mapped_column(Date)  # Одна дата проведения
     is_active: Mapped[bool] = mapped_column(default=True)
 
     fee: Mapped[float] = mapped_column(Float, default=0.0)
@@ -96,6 +367,10 @@ class Conference(Base):
 
 class Application(Base):
     __tablename__ = "applications"
+    __table_args__ = (
+        Index("ix_applications_conference_id_status", "conference_id", "status"),
+        Index("ix_applications_user_id_status", "user_id", "status"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
@@ -112,6 +387,9 @@ class Application(Base):
 
 class ConferenceCreationRequest(Base):
     __tablename__ = "conference_creation_requests"
+    __table_args__ = (
+        Index("ix_conference_creation_requests_status_appeal", "status", "appeal"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
@@ -133,6 +411,9 @@ class ConferenceEditRequest(Base):
 
 class SupportRequest(Base):
     __tablename__ = "support_requests"
+    __table_args__ = (
+        Index("ix_support_requests_status", "status"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
@@ -167,14 +448,251 @@ class BotStatus(Base):
     resumed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
 
-async def get_bot_status() -> BotStatus:
+class FsmRecord(Base):
+    __tablename__ = "fsm_states"
+    __table_args__ = (
+        Index("ix_fsm_states_updated_at", "updated_at"),
+    )
+
+    storage_key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    data: Mapped[str] = mapped_column(Text, default="{}")  # JSON
+    updated_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+# Рассылка как задание: получатели фиксируются при создании, у каждого свой статус —
+# после перезапуска продолжаем с тех, кому ещё не отправляли
+class BroadcastJob(Base):
+    __tablename__ = "broadcast_jobs"
+    __table_args__ = (
+        Index("ix_broadcast_jobs_status", "status"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    owner_telegram_id: Mapped[int] = mapped_column(BigInteger)  # кто запустил — ему отчёт
+    title: Mapped[str] = mapped_column(String(300))
+    content: Mapped[dict] = mapped_column(JSON)  # {"type": text | photo | video | document, "text": ..., "file_id": ...}
+    status: Mapped[str] = mapped_column(String(20), default="running")  # running | paused | cancelled | done
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    sent: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    retries: Mapped[int] = mapped_column(Integer, default=0)
+    elapsed: Mapped[float] = mapped_column(Float, default=0.0)  # секунд отправки, без пауз и простоя между запусками
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Сообщение с прогрессом, которое редактируется по ходу рассылки
+    status_chat_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    status_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+
+class BroadcastRecipient(Base):
+    __tablename__ = "broadcast_recipients"
+    __table_args__ = (
+        Index("ix_broadcast_recipients_job_status", "job_id", "status"),
+    )
+
+    job_id: Mapped[int] = mapped_column(ForeignKey("broadcast_jobs.id"), primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    status: Mapped[str] = mapped_column(String(10), default="pending")  # pending | sent | failed
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+# ────────────────────────────────────────────────
+# Миграции схемы
+# ────────────────────────────────────────────────
+# create_all создаёт только недостающие таблицы и не трогает существующие,
+# поэтому новые индексы и колонки доводятся до живой БД миграциями.
+# Каждая миграция — синхронная функция от Connection, идемпотентная
+# (на свежей БД create_all уже всё создал, и шаг должен просто ничего не делать).
+# Номер версии только растёт; новые миграции добавляются в конец MIGRATIONS.
+# На SQLite миграции идут с выключенными foreign_keys (иначе нельзя пересобрать
+# таблицу, на которую ссылаются другие) и проверяются foreign_key_check перед коммитом.
+
+# Форматы, в которых дата конференции могла попасть в БД строкой
+LEGACY_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%Y.%m.%d", "%d/%m/%Y")
+
+
+def parse_legacy_date(value) -> date_type | None:
+    if isinstance(value, date_type):
+        return value
+    text = str(value or "").strip()
+    for fmt in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _create_indexes(connection, *tables):
+    for table in tables:
+        # Индекс по колонке, которой в старой БД ещё нет, создаст миграция, добавляющая колонку
+        existing = {col["name"] for col in sa.inspect(connection).get_columns(table)}
+        for index in Base.metadata.tables[table].indexes:
+            if all(col.name in existing for col in index.columns):
+                index.create(connection, checkfirst=True)
+
+
+def _add_column(connection, table: str, column: str, ddl: str) -> bool:
+    existing = {col["name"] for col in sa.inspect(connection).get_columns(table)}
+    if column in existing:
+        return False
+    connection.execute(sa.text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _rebuild_table(connection, table_name: str, overrides: dict[int, dict]):
+    # Пересборка таблицы по текущей модели (SQLite не умеет ALTER COLUMN):
+    # новая таблица → копия общих колонок → точечные правки строк → замена старой
+    table = Base.metadata.tables[table_name]
+    tmp_name = f"_{table_name}_rebuild"
+    tmp_table = sa.Table(tmp_name, sa.MetaData(), *(sa.Column(col.name, col.type) for col in table.columns))
+    create_ddl = str(sa.schema.CreateTable(table).compile(dialect=connection.dialect)).replace(
+        f"CREATE TABLE {table_name} ", f"CREATE TABLE {tmp_name} ", 1
+    )
+
+    connection.execute(sa.text(f"DROP TABLE IF EXISTS {tmp_name}"))
+    connection.execute(sa.text(create_ddl))
+
+    old_columns = {col["name"] for col in sa.inspect(connection).get_columns(table_name)}
+    columns = ", ".join(col.name for col in table.columns if col.name in old_columns)
+    connection.execute(sa.text(f"INSERT INTO {tmp_name} ({columns}) SELECT {columns} FROM {table_name}"))
+    for row_id, values in overrides.items():
+        connection.execute(tmp_table.update().where(tmp_table.c.id == row_id).values(**values))
+
+    connection.execute(sa.text(f"DROP TABLE {table_name}"))
+    connection.execute(sa.text(f"ALTER TABLE {tmp_name} RENAME TO {table_name}"))
+    _create_indexes(connection, table_name)
+
+
+def _migration_001_hot_indexes(connection):
+    _create_indexes(
+        connection,
+        "users", "conferences", "applications",
+        "conference_creation_requests", "support_requests",
+    )
+
+
+def _migration_002_conference_date(connection):
+    date_column = next(
+        col for col in sa.inspect(connection).get_columns("conferences") if col["name"] == "date"
+    )
+    if isinstance(date_column["type"], sa.Date):
+        return
+
+    # Строки приводим к ISO (ГГГГ-ММ-ДД): тогда сравнение по дате — это диапазон по индексу (is_active, date)
+    overrides = {}
+    broken = []
+    for row_id, raw in connection.execute(sa.text("SELECT id, date FROM conferences")):
+        parsed = parse_legacy_date(raw)
+        if parsed is None:
+            broken.append((row_id, raw))
+        elif raw != parsed.isoformat():
+            overrides[row_id] = {"date": parsed}
+    if broken:
+        raise RuntimeError(f"Не удалось разобрать даты конференций (id, значение): {broken}")
+
+    if IS_SQLITE:
+        _rebuild_table(connection, "conferences", overrides)
+        return
+    # Серверные СУБД меняют тип колонки на месте
+    for row_id, values in overrides.items():
+        connection.execute(
+            sa.text("UPDATE conferences SET date = :date WHERE id = :id"),
+            {"date": values["date"].isoformat(), "id": row_id},
+        )
+    connection.execute(sa.text("ALTER TABLE conferences ALTER COLUMN date TYPE DATE USING date::date"))
+
+
+def _migration_003_broadcast_progress(connection):
+    _add_column(connection, "broadcast_jobs", "retries", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "broadcast_jobs", "elapsed", "FLOAT NOT NULL DEFAULT 0")
+    _add_column(connection, "broadcast_jobs", "status_chat_id", "BIGINT")
+    _add_column(connection, "broadcast_jobs", "status_message_id", "INTEGER")
+
+
+def _migration_004_unreachable_users(connection):
+    _add_column(connection, "users", "unreachable_at", "TIMESTAMP")
+    _create_indexes(connection, "users")
+
+
+MIGRATIONS = [
+    (1, "Индексы по горячим фильтрам", _migration_001_hot_indexes),
+    (2, "Conference.date: строка → DATE", _migration_002_conference_date),
+    (3, "Рассылки: статистика и сообщение с прогрессом", _migration_003_broadcast_progress),
+    (4, "Пользователи: отметка недоступности", _migration_004_unreachable_users),
+]
+
+
+def _run_migrations(connection):
+    version_row = connection.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).first()
+    current = version_row[0] if version_row else 0
+    if version_row is None:
+        connection.execute(sa.insert(SchemaVersion).values(id=1, version=0))
+        connection.commit()
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logging.info(f"Миграция схемы {version}: {description}")
+        migrate(connection)
+        if IS_SQLITE:
+            violations = connection.execute(sa.text("PRAGMA foreign_key_check")).fetchall()
+            if violations:
+                connection.rollback()
+                raise RuntimeError(f"Миграция {version} нарушает внешние ключи: {violations[:10]}")
+        connection.execute(
+            sa.update(SchemaVersion).where(SchemaVersion.id == 1).values(version=version)
+        )
+        connection.commit()
+        current = version
+
+    return current
+
+
+def _snapshot_bot_status(status: BotStatus) -> CachedBotStatus:
+    return CachedBotStatus(status.is_paused, status.pause_reason, status.paused_by, status.paused_at)
+
+
+async def get_bot_status() -> CachedBotStatus:
+    # Обычно — из памяти; строку bot_status создаёт init_db, здесь только страховка
+    cached = bot_status_cache.get()
+    if cached is not None:
+        return cached
+
     async with AsyncSessionLocal() as session:
         status = await session.get(BotStatus, 1)
         if not status:
             status = BotStatus(id=1, is_paused=False)
             session.add(status)
-            await session.commit()
-        return status
+        snapshot = _snapshot_bot_status(status)
+        await session.commit()
+
+    bot_status_cache.put(snapshot)
+    return snapshot
+
+
+async def load_ban_registry():
+    # Снимок забаненных из таблицы. Баны/разбаны, прошедшие во время запроса,
+    # BanRegistry сохранит поверх снимка
+    from queries import banned_telegram_ids
+
+    ban_registry.begin_sync()
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(banned_telegram_ids())
+            banned_ids = result.scalars().all()
+    except Exception:
+        ban_registry.abort_sync()
+        raise
+    ban_registry.finish_sync(banned_ids)
+    return len(banned_ids)
 
 
 async def set_bot_paused(paused: bool, reason: str | None, user_id: int):
@@ -198,13 +716,45 @@ async def set_bot_paused(paused: bool, reason: str | None, user_id: int):
             status.paused_by = None
             status.paused_at = None
 
+        snapshot = _snapshot_bot_status(status)
         await session.commit()
 
+    bot_status_cache.put(snapshot)
+
+
+async def close_db():
+    # Читатели закрываются первыми: checkpoint(TRUNCATE) не может перенести кадры,
+    # которые ещё видит открытое чтение
+    if read_engine is not engine:
+        await read_engine.dispose()
+    if IS_SQLITE:
+        # Переносим WAL в основной файл и обнуляем журнал — следующему запуску нечего восстанавливать
+        try:
+            async with engine.connect() as conn:
+                await conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logging.error(f"Не удалось выполнить checkpoint WAL: {e}")
+    await engine.dispose()
+
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    # Каждая миграция коммитится вместе с номером версии; шаги идемпотентны,
+    # так что прерванная миграция просто повторится при следующем запуске
+    async with engine.connect() as conn:
+        if IS_SQLITE:
+            # Вне транзакции, иначе PRAGMA игнорируется
+            await conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            version = await conn.run_sync(_run_migrations)
+        finally:
+            if IS_SQLITE:
+                await conn.rollback()
+                await conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+    logging.info(f"Версия схемы БД: {version}")
+
     async with AsyncSessionLocal() as session:
         status = await session.get(BotStatus, 1)
         if not status:
@@ -213,51 +763,130 @@ async def init_db():
             await session.commit()
 
 
+def get_privileged_role(telegram_id: int) -> str | None:
+    # Роль Тех Специалиста важнее Главного Админа (раньше она назначалась последней)
+    if telegram_id == TECH_SPECIALIST_ID:
+        return Role.CHIEF_TECH.value
+    if telegram_id in CHIEF_ADMIN_IDS:
+        return Role.CHIEF_ADMIN.value
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _user_upsert_statement(update_columns: tuple[str, ...]) -> sa.TextClause:
+    # Текст запроса зависит только от набора обновляемых колонок, поэтому
+    # компилируется один раз и дальше берётся из кэша SQLAlchemy
+    # (on_conflict_do_update диалекта sqlite не кэшируется и компилируется на каждый вызов)
+    if update_columns:
+        on_conflict = "DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in update_columns)
+    else:
+        on_conflict = "DO NOTHING"
+    columns = ", ".join(column.name for column in User.__table__.columns)
+    return sa.text(
+        "INSERT INTO users (telegram_id, username, full_name, role, is_banned) "
+        "VALUES (:telegram_id, :username, :full_name, :role, :is_banned) "
+        f"ON CONFLICT (telegram_id) {on_conflict} "
+        f"RETURNING {columns}"
+    )
+
+
+def _on_queued_user_update(telegram_id: int, future: asyncio.Future):
+    # Ошибку отложенной записи никто не ждёт — логируем её здесь и сбрасываем кэш,
+    # чтобы следующий апдейт перечитал пользователя из БД
+    if future.cancelled() or future.exception() is None:
+        return
+    logging.error(f"Не удалось обновить пользователя {telegram_id}: {future.exception()}")
+    user_cache.invalidate(telegram_id)
+
+
 async def get_or_create_user(telegram_id: int, full_name: str | None = None, username: str | None = None) -> User:
+    from queries import user_by_telegram_id  # queries импортирует модели отсюда
+
+    privileged_role = get_privileged_role(telegram_id)
+
+    # Поля, которые нужно привести к актуальным значениям
+    changes = {}
+    if full_name:
+        changes["full_name"] = full_name
+    if username:
+        changes["username"] = username
+    if privileged_role:
+        changes["role"] = privileged_role
+
     async with AsyncSessionLocal() as session:
-        # Сначала ищем существующего пользователя
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        # Быстрый путь: пользователь есть и ничего не изменилось — обходимся чтением без записи
+        result = await session.execute(user_by_telegram_id(telegram_id))
         user = result.scalar_one_or_none()
+        if user is not None and all(getattr(user, key) == value for key, value in changes.items()):
+            return user
+
+        # Обновление имени/username существующего пользователя — некритичная запись:
+        # при включённом групповом коммите не ждём её, а отдаём пользователя сразу
+        if user is not None and write_queue.running and user.role == changes.get("role", user.role):
+            update = queued_update(user, **{key: value for key, value in changes.items() if getattr(user, key) != value})
+            update.add_done_callback(functools.partial(_on_queued_user_update, telegram_id))
+            return user
+
+        # Один INSERT ... ON CONFLICT DO UPDATE ... RETURNING вместо SELECT + нескольких коммитов
+        stmt = select(User).from_statement(_user_upsert_statement(tuple(changes)))
+        result = await session.execute(
+            stmt,
+            {
+                "telegram_id": telegram_id,
+                "username": username,
+                "full_name": full_name or "Не указано",
+                "role": privileged_role or Role.PARTICIPANT.value,
+                "is_banned": False,
+            },
+            execution_options={"populate_existing": True},
+        )
+        upserted = result.scalar_one_or_none()
+        await session.commit()
+        user_cache.invalidate(telegram_id)
+
+        if upserted is None:
+            # Параллельный запрос успел создать пользователя раньше нас
+            result = await session.execute(user_by_telegram_id(telegram_id))
+            return result.scalar_one()
 
         if user is None:
-            # Новый пользователь — создаём
-            user = User(
-                telegram_id=telegram_id,
-                username=username,
-                full_name=full_name or "Не указано",
-                role=Role.PARTICIPANT.value,
-                is_banned=False
-            )
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
             logging.info(f"Создан новый пользователь: {telegram_id} ({full_name})")
         else:
-            # Пользователь уже есть — обновляем только нужные поля (если изменились)
-            updated = False
-            if full_name and user.full_name != full_name:
-                user.full_name = full_name
-                updated = True
-            if username and user.username != username:
-                user.username = username
-                updated = True
-            if updated:
-                await session.commit()
-                await session.refresh(user)
-                logging.info(f"Обновлён пользователь: {telegram_id}")
+            logging.info(f"Обновлён пользователь: {telegram_id}")
+        if privileged_role and (user is None or user.role != privileged_role):
+            logging.info(f"Назначена роль {privileged_role} для {telegram_id}")
+
+        return upserted
+
+# Недоступные пользователи пропускаются рассылками и напоминаниями (unreachable_at IS NULL по индексу).
+# Отметку снимает DbSessionMiddleware, как только пользователь снова пишет боту;
+# флаг в user_cache меняется сразу, иначе закэшированная запись не даст её снять
+def mark_unreachable(telegram_ids: list[int]) -> asyncio.Future:
+    stmt = (
+        sa.update(User)
+        .where(User.telegram_id.in_(telegram_ids), User.unreachable_at.is_(None))
+        .values(unreachable_at=datetime.now())
+    )
 
-        # Назначаем специальные роли (только если они не назначены)
-        if telegram_id in CHIEF_ADMIN_IDS and user.role != Role.CHIEF_ADMIN.value:
-            user.role = Role.CHIEF_ADMIN.value
-            await session.commit()
-            logging.info(f"Назначена роль Главный Админ для {telegram_id}")
+    async def op(session):
+        await session.execute(stmt)
 
-        if telegram_id == TECH_SPECIALIST_ID and user.role != Role.CHIEF_TECH.value:
-            user.role = Role.CHIEF_TECH.value
-            await session.commit()
-            logging.info(f"Назначена роль Главный Тех Специалист для {telegram_id}")
+    for telegram_id in telegram_ids:
+        record = user_cache.peek(telegram_id)
+        if record is not MISSING and record is not None:
+            record.unreachable = True
+    return write_queue.submit(op)
+
+
+def mark_reachable(record: CachedUser) -> asyncio.Future:
+    stmt = sa.update(User).where(User.telegram_id == record.telegram_id).values(unreachable_at=None)
+
+    async def op(session):
+        await session.execute(stmt)
+
+    record.unreachable = False
+    return write_queue.submit(op)
 
-        return user
 
 class ApplicationState:
     pass
\ No newline at end of file
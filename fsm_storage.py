@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any
+
+import sqlalchemy as sa
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from config import FSM_STATE_TTL, FSM_FLUSH_INTERVAL
+from database import AsyncSessionLocal, FsmRecord, write_queue
+
+# Брошенные анкеты ищутся не чаще раза в минуту
+FSM_SWEEP_INTERVAL = 60.0
+
+
+# Состояние и данные одного ключа; touched_at — время последней записи (time.time())
+class _Record:
+    __slots__ = ("state", "data", "touched_at")
+
+    def __init__(self, state: str | None, data: dict, touched_at: float):
+        self.state = state
+        self.data = data
+        self.touched_at = touched_at
+
+
+def _encode_key(key: StorageKey) -> str:
+    # business_connection_id — последним: это непрозрачная строка, split до него её не режет
+    return ":".join((
+        str(key.bot_id), str(key.chat_id), str(key.user_id),
+        str(key.thread_id or ""), key.destiny, key.business_connection_id or "",
+    ))
+
+
+def _decode_key(value: str) -> StorageKey:
+    bot_id, chat_id, user_id, thread_id, destiny, business_connection_id = value.split(":", 5)
+    return StorageKey(
+        bot_id=int(bot_id), chat_id=int(chat_id), user_id=int(user_id),
+        thread_id=int(thread_id) if thread_id else None,
+        business_connection_id=business_connection_id or None,
+        destiny=destiny,
+    )
+
+
+# FSM-хранилище в таблице fsm_states.
+# При старте load() поднимает в память все живые записи, дальше память — основная копия:
+# чтения не ходят в БД, пустой ключ означает «нет состояния».
+# Записи помечают ключ «грязным»; раз в flush_interval все грязные ключи уходят одной
+# операцией через write_queue (DELETE + INSERT в одной транзакции). Ключ без состояния
+# и данных из таблицы просто удаляется. При аварийном падении теряются изменения
+# за последние flush_interval секунд — анкету придётся продолжить с предыдущего шага.
+class DatabaseStorage(BaseStorage):
+    def __init__(self, ttl: float, flush_interval: float):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._records: dict[StorageKey, _Record] = {}
+        self._dirty: set[StorageKey] = set()
+        self._task: asyncio.Task | None = None
+        self._last_sweep = 0.0
+        self.flushes = 0
+        self.written = 0
+        self.expired = 0
+        self.errors = 0
+
+    # ───── BaseStorage ─────
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record = self._get(key)
+        self._put(key, state, record.data if record else {})
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        record = self._get(key)
+        self._put(key, record.state if record else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    async def close(self) -> None:
+        # Останавливаем фоновую запись и дописываем то, что не успело уйти
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # ───── Память ─────
+
+    def _get(self, key: StorageKey) -> _Record | None:
+        record = self._records.get(key)
+        if record is not None and record.touched_at < time.time() - self.ttl:
+            # Брошенная анкета: для пользователя её уже нет, из таблицы удалит ближайший flush
+            self._drop(key)
+            return None
+        return record
+
+    def _put(self, key: StorageKey, state: str | None, data: dict):
+        if state is None and not data:
+            self._records.pop(key, None)
+        else:
+            self._records[key] = _Record(state, data, time.time())
+        self._dirty.add(key)
+
+    def _drop(self, key: StorageKey):
+        del self._records[key]
+        self._dirty.add(key)
+        self.expired += 1
+
+    def _sweep(self, now: float):
+        cutoff = now - self.ttl
+        for key in [key for key, record in self._records.items() if record.touched_at < cutoff]:
+            self._drop(key)
+
+    # ───── БД ─────
+
+    async def load(self) -> int:
+        cutoff = datetime.fromtimestamp(time.time() - self.ttl)
+        async with AsyncSessionLocal() as session:
+            await session.execute(sa.delete(FsmRecord).where(FsmRecord.updated_at < cutoff))
+            result = await session.execute(
+                sa.select(FsmRecord.storage_key, FsmRecord.state, FsmRecord.data, FsmRecord.updated_at)
+            )
+            rows = result.all()
+            await session.commit()
+
+        for storage_key, state, data, updated_at in rows:
+            key = _decode_key(storage_key)
+            # Записи, сделанные после старта, новее снимка из таблицы
+            if key not in self._dirty:
+                self._records[key] = _Record(state, json.loads(data), updated_at.timestamp())
+        return len(rows)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            now = time.time()
+            if now - self._last_sweep >= FSM_SWEEP_INTERVAL:
+                self._last_sweep = now
+                self._sweep(now)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка записи состояний FSM: {e}")
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        # Снимок берётся без await: всё, что изменится дальше, попадёт в следующий flush
+        keys, self._dirty = self._dirty, set()
+        flushed, rows = set(), []
+        for key in keys:
+            record = self._records.get(key)
+            if record is not None:
+                try:
+                    data = json.dumps(record.data, ensure_ascii=False)
+                except (TypeError, ValueError) as e:
+                    # Пропускаем только этот ключ: в таблице остаётся прежняя запись,
+                    # в памяти — текущая; следующая запись в ключ снова пометит его грязным
+                    logging.error(f"Состояние FSM {_encode_key(key)} не сериализуется в JSON: {e}")
+                    self.errors += 1
+                    continue
+                rows.append({
+                    "storage_key": _encode_key(key),
+                    "state": record.state,
+                    "data": data,
+                    "updated_at": datetime.fromtimestamp(record.touched_at),
+                })
+            flushed.add(key)
+        if not flushed:
+            return
+        encoded_keys = [_encode_key(key) for key in flushed]
+
+        async def op(session):
+            await session.execute(sa.delete(FsmRecord).where(FsmRecord.storage_key.in_(encoded_keys)))
+            if rows:
+                await session.execute(sa.insert(FsmRecord), rows)
+
+        try:
+            await write_queue.submit(op)
+        except BaseException as e:
+            # Повторим со следующим flush (в том числе если запись прервала остановка бота);
+            # повторная запись безопасна — пишется текущее состояние ключа из памяти
+            self._dirty |= flushed
+            if isinstance(e, Exception):
+                self.errors += 1
+            raise
+        self.flushes += 1
+        self.written += len(flushed)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._records),
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "written": self.written,
+            "expired": self.expired,
+            "errors": self.errors,
+        }
+
+
+fsm_storage = DatabaseStorage(FSM_STATE_TTL, FSM_FLUSH_INTERVAL)
@@ -1,6 +1,7 @@
-from aiogram import Router, types, F
+from aiogram import Router, types, F, flags
 from aiogram.filters import Command
 from sqlalchemy import select, func, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram.types import InlineKeyboardButton, BufferedInputFile, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
@@ -12,7 +13,6 @@ from aiogram.exceptions import TelegramBadRequest
 from datetime import datetime
 
 from database import (
-    AsyncSessionLocal,
     ConferenceCreationRequest,
     ConferenceEditRequest,
     Conference,
@@ -20,13 +20,26 @@ from database import (
     User,
     Role,
     get_or_create_user,
+    parse_legacy_date,
+    IS_SQLITE,
     DeletedConference,
     get_bot_status,
     set_bot_paused,
     SupportRequest
 )
 from keyboards import get_main_menu_keyboard, get_cancel_keyboard
+from callbacks import ConferenceCallback, RequestCallback, SupportCallback, OnCallback
+from utils import dataframe_document
 from config import CHIEF_ADMIN_IDS, TECH_SPECIALIST_ID
+from cache import CachedUser, user_cache
+from queries import (
+    user_by_telegram_id,
+    active_conferences,
+    active_conferences_count,
+    users_export,
+    deleted_conferences_export,
+    support_requests_export,
+)
 
 router = Router()
 
@@ -40,173 +53,82 @@ class AdminStates(StatesGroup):
 support_pagination = {}
 
 # Проверки ролей
-async def is_admin_or_chief(user_id: int) -> bool:
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.telegram_id == user_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            return False
-        return user.role in [Role.ADMIN.value, Role.CHIEF_ADMIN.value] if user else False
+async def is_admin_or_chief(db_user: CachedUser | None) -> bool:
+    if not db_user:
+        return False
+    return db_user.role in [Role.ADMIN.value, Role.CHIEF_ADMIN.value]
 
 async def is_chief_admin(user_id: int) -> bool:
     return user_id in CHIEF_ADMIN_IDS
 
-from config import TECH_SPECIALIST_ID
-
 async def is_chief_tech(user_id: int) -> bool:
     return user_id == TECH_SPECIALIST_ID
 
-async def can_delete_conference(user_id: int) -> bool:
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.telegram_id == user_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            return False
-        return user.role in [Role.ADMIN.value, Role.CHIEF_ADMIN.value, Role.CHIEF_TECH.value] if user else False
+async def can_delete_conference(db_user: CachedUser | None) -> bool:
+    if not db_user:
+        return False
+    return db_user.role in [Role.ADMIN.value, Role.CHIEF_ADMIN.value, Role.CHIEF_TECH.value]
 
 async def can_pause_bot(user_id: int) -> bool:
     return user_id in CHIEF_ADMIN_IDS or await is_chief_tech(user_id)
 
-async def can_view_conferences(user_id: int) -> bool:
-    return await is_admin_or_chief(user_id) or await is_chief_tech(user_id)
+async def can_view_conferences(user_id: int, db_user: CachedUser | None) -> bool:
+    return await is_admin_or_chief(db_user) or await is_chief_tech(user_id)
 
 # Универсальная функция обновления списка всех заявок (создание + редактирование + апелляции)
-async def update_requests_message(event: types.Message | types.CallbackQuery):
-    async with AsyncSessionLocal() as session:
-        create_requests = (await session.execute(
-            select(ConferenceCreationRequest).where(ConferenceCreationRequest.status == "pending")
-        )).scalars().all()
-
-        edit_requests = (await session.execute(
-            select(ConferenceEditRequest).where(ConferenceEditRequest.status == "pending")
-        )).scalars().all()
-
-        appeal_requests = (await session.execute(
-            select(ConferenceCreationRequest).where(
-                ConferenceCreationRequest.status == "rejected",
-                ConferenceCreationRequest.appeal == True
-            )
-        )).scalars().all()
+async def update_requests_message(event: types.Message | types.CallbackQuery, session: AsyncSession):
+    create_requests = (await session.execute(
+        select(ConferenceCreationRequest).where(ConferenceCreationRequest.status == "pending")
+    )).scalars().all()
+
+    edit_requests = (await session.execute(
+        select(ConferenceEditRequest).where(ConferenceEditRequest.status == "pending")
+    )).scalars().all()
+
+    appeal_requests = (await session.execute(
+        select(ConferenceCreationRequest).where(
+            ConferenceCreationRequest.status == "rejected",
+            ConferenceCreationRequest.appeal == True
+        )
+    )).scalars().all()
 
-        if not create_requests and not edit_requests and not appeal_requests:
-            text = "Нет активных заявок."
-            if isinstance(event, types.Message):
-                await event.answer(text)
-            else:
-                await event.message.edit_text(text)
-            return
+    if not create_requests and not edit_requests and not appeal_requests:
+        text = "Нет активных заявок."
+        if isinstance(event, types.Message):
+            await event.answer(text)
+        else:
+            await event.message.edit_text(text)
+        return
 
-        if create_requests:
-            await event.bot.send_message(event.from_user.id, "<b>Заявки на создание конференций:</b>")
-            for req in create_requests:
-                user = await session.get(User, req.user_id)
-                data = req.data
-
-                text = f"ID: <code>{req.id}</code>\n"
-                text += f"От: {user.full_name or user.telegram_id}\n\n"
-                text += f"<b>Название:</b> {data.get('name', '—')}\n"
-                if data.get('description'):
-                    text += f"<b>Описание:</b>\n{data.get('description')}\n\n"
-                text += f"<b>Город:</b> {data.get('city', 'Онлайн')}\n"
-                text += f"<b>Дата проведения:</b> {data.get('date', '—')}\n"
-                text += f"<b>Оргвзнос:</b> {data.get('fee', 0)} руб.\n"
-
-                builder = InlineKeyboardBuilder()
-                builder.row(
-                    InlineKeyboardButton(text="Одобрить", callback_data=f"conf_create_approve_{req.id}"),
-                    InlineKeyboardButton(text="Отклонить", callback_data=f"conf_create_reject_{req.id}")
-                )
-
-                if data.get('poster_path') and os.path.exists(data['poster_path']):
-                    photo = FSInputFile(data['poster_path'])
-                    await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
-                else:
-                    await event.bot.send_message(event.from_user.id, text, reply_markup=builder.as_markup())
+    if create_requests:
+        await event.bot.send_message(event.from_user.id, "<b>Заявки на создание конференций:</b>")
+        for req in create_requests:
+            user = await session.get(User, req.user_id)
+            data = req.data
 
-        if edit_requests:
-            await event.bot.send_message(event.from_user.id, "<b>Заявки на редактирование:</b>")
-            for req in edit_requests:
-                conf = await session.get(Conference, req.conference_id)
-                organizer = await session.get(User, req.organizer_id)
-                data = req.data
-
-                text = f"ID: <code>{req.id}</code>\n"
-                text += f"Конференция: <b>{conf.name}</b>\n"
-                text += f"От: {organizer.full_name or organizer.telegram_id}\n\n"
-                text += f"<b>Текущие данные:</b>\n"
-                text += f"Название: {conf.name}\n"
-                if conf.description:
-                    text += f"Описание: {conf.description}\n"
-                text += f"Город: {conf.city or 'Онлайн'}\n"
-                text += f"Дата проведения: {conf.date}\n"
-                text += f"Оргвзнос: {conf.fee} руб.\n\n"
-                text += f"<b>Новые данные:</b>\n"
-                text += f"Название: {data.get('name', conf.name)}\n"
-                if data.get('description') is not None:
-                    text += f"Описание: {data.get('description') or '(удалено)'}\n"
-                text += f"Город: {data.get('city', conf.city)}\n"
-                text += f"Дата проведения: {data.get('date', conf.date)}\n"
-                text += f"Оргвзнос: {data.get('fee', conf.fee)} руб.\n"
-
-                builder = InlineKeyboardBuilder()
-                builder.row(
-                    InlineKeyboardButton(text="Одобрить", callback_data=f"conf_edit_approve_{req.id}"),
-                    InlineKeyboardButton(text="Отклонить", callback_data=f"conf_edit_reject_{req.id}")
-                )
-
-                if data.get('poster_path') and os.path.exists(data['poster_path']):
-                    photo = FSInputFile(data['poster_path'])
-                    await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
-                else:
-                    if conf.poster_path and os.path.exists(conf.poster_path):
-                        photo = FSInputFile(conf.poster_path)
-                        await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
-                    else:
-                        await event.bot.send_message(event.from_user.id, text, reply_markup=builder.as_markup())
-
-        if appeal_requests:
-            await event.bot.send_message(event.from_user.id, "<b>Апелляции к Глав Админу:</b>")
-            for req in appeal_requests:
-                user = await session.get(User, req.user_id)
-                data = req.data
-
-                text = f"ID: <code>{req.id}</code> (апелляция)\n"
-                text += f"От: {user.full_name or user.telegram_id}\n\n"
-                text += f"Название: {data.get('name')}\n"
-                if data.get('description'):
-                    text += f"Описание: {data.get('description')}\n"
-                text += f"Город: {data.get('city')}\n"
-                text += f"Дата проведения: {data.get('date')}\n"
-                text += f"Оргвзнос: {data.get('fee', 0)} руб.\n"
-
-                builder = InlineKeyboardBuilder()
-                builder.row(
-                    InlineKeyboardButton(text="Одобрить", callback_data=f"conf_appeal_approve_{req.id}"),
-                    InlineKeyboardButton(text="Отклонить", callback_data=f"conf_appeal_reject_{req.id}")
-                )
-
-                if data.get('poster_path') and os.path.exists(data['poster_path']):
-                    photo = FSInputFile(data['poster_path'])
-                    await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
-                else:
-                    await event.bot.send_message(event.from_user.id, text, reply_markup=builder.as_markup())
+            text = f"ID: <code>{req.id}</code>\n"
+            text += f"От: {user.full_name or user.telegram_id}\n\n"
+            text += f"<b>Название:</b> {data.get('name', '—')}\n"
+            if data.get('description'):
+                text += f"<b>Описание:</b>\n{data.get('description')}\n\n"
+            text += f"<b>Город:</b> {data.get('city', 'Онлайн')}\n"
+            text += f"<b>Дата проведения:</b> {data.get('date', '—')}\n"
+            text += f"<b>Оргвзнос:</b> {data.get('fee', 0)} руб.\n"
 
-# Функция для заявок на редактирование
-async def update_edit_requests_message(event: types.Message | types.CallbackQuery):
-    async with AsyncSessionLocal() as session:
-        edit_requests = (await session.execute(
-            select(ConferenceEditRequest).where(ConferenceEditRequest.status == "pending")
-        )).scalars().all()
-
-        if not edit_requests:
-            text = "Нет заявок на редактирование конференций."
-            if isinstance(event, types.Message):
-                await event.answer(text)
+            builder = InlineKeyboardBuilder()
+            builder.row(
+                InlineKeyboardButton(text="Одобрить", callback_data=RequestCallback(kind="create", action="approve", id=req.id).pack()),
+                InlineKeyboardButton(text="Отклонить", callback_data=RequestCallback(kind="create", action="reject", id=req.id).pack())
+            )
+
+            if data.get('poster_path') and os.path.exists(data['poster_path']):
+                photo = FSInputFile(data['poster_path'])
+                await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
             else:
-                await event.message.edit_text(text)
-            return
+                await event.bot.send_message(event.from_user.id, text, reply_markup=builder.as_markup())
 
-        await event.bot.send_message(event.from_user.id, "<b>Заявки на редактирование конференций:</b>")
+    if edit_requests:
+        await event.bot.send_message(event.from_user.id, "<b>Заявки на редактирование:</b>")
         for req in edit_requests:
             conf = await session.get(Conference, req.conference_id)
             organizer = await session.get(User, req.organizer_id)
@@ -232,8 +154,8 @@ async def update_edit_requests_message(event: types.Message | types.CallbackQuer
 
             builder = InlineKeyboardBuilder()
             builder.row(
-                InlineKeyboardButton(text="Одобрить", callback_data=f"conf_edit_approve_{req.id}"),
-                InlineKeyboardButton(text="Отклонить", callback_data=f"conf_edit_reject_{req.id}")
+                InlineKeyboardButton(text="Одобрить", callback_data=RequestCallback(kind="edit", action="approve", id=req.id).pack()),
+                InlineKeyboardButton(text="Отклонить", callback_data=RequestCallback(kind="edit", action="reject", id=req.id).pack())
             )
 
             if data.get('poster_path') and os.path.exists(data['poster_path']):
@@ -246,37 +168,8 @@ async def update_edit_requests_message(event: types.Message | types.CallbackQuer
                 else:
                     await event.bot.send_message(event.from_user.id, text, reply_markup=builder.as_markup())
 
-# Команда просмотра всех заявок
-@router.message(Command("admin_requests"))
-async def admin_conference_requests(message: types.Message):
-    if not await is_admin_or_chief(message.from_user.id):
-        await message.answer("Доступ запрещён.")
-        return
-
-    await update_requests_message(message)
-
-# Кнопка заявок на редактирование
-
-# Кнопка "Посмотреть апелляции"
-@router.message(F.text == "📥 Посмотреть апелляции")
-async def view_appeals(message: types.Message):
-    if not await is_chief_admin(message.from_user.id):
-        await message.answer("Доступ только Глав Админу.")
-        return
-
-    async with AsyncSessionLocal() as session:
-        appeal_requests = (await session.execute(
-            select(ConferenceCreationRequest).where(
-                ConferenceCreationRequest.status == "rejected",
-                ConferenceCreationRequest.appeal == True
-            )
-        )).scalars().all()
-
-        if not appeal_requests:
-            await message.answer("Нет активных апелляций.")
-            return
-
-        await message.answer("<b>Активные апелляции:</b>")
+    if appeal_requests:
+        await event.bot.send_message(event.from_user.id, "<b>Апелляции к Глав Админу:</b>")
         for req in appeal_requests:
             user = await session.get(User, req.user_id)
             data = req.data
@@ -292,73 +185,178 @@ async def view_appeals(message: types.Message):
 
             builder = InlineKeyboardBuilder()
             builder.row(
-                InlineKeyboardButton(text="Одобрить", callback_data=f"conf_appeal_approve_{req.id}"),
-                InlineKeyboardButton(text="Отклонить", callback_data=f"conf_appeal_reject_{req.id}")
+                InlineKeyboardButton(text="Одобрить", callback_data=RequestCallback(kind="appeal", action="approve", id=req.id).pack()),
+                InlineKeyboardButton(text="Отклонить", callback_data=RequestCallback(kind="appeal", action="reject", id=req.id).pack())
             )
 
             if data.get('poster_path') and os.path.exists(data['poster_path']):
                 photo = FSInputFile(data['poster_path'])
-                await message.answer_photo(photo, caption=text, reply_markup=builder.as_markup())
+                await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
             else:
-                await message.answer(text, reply_markup=builder.as_markup())
+                await event.bot.send_message(event.from_user.id, text, reply_markup=builder.as_markup())
+
+# Функция для заявок на редактирование
+async def update_edit_requests_message(event: types.Message | types.CallbackQuery, session: AsyncSession):
+    edit_requests = (await session.execute(
+        select(ConferenceEditRequest).where(ConferenceEditRequest.status == "pending")
+    )).scalars().all()
+
+    if not edit_requests:
+        text = "Нет заявок на редактирование конференций."
+        if isinstance(event, types.Message):
+            await event.answer(text)
+        else:
+            await event.message.edit_text(text)
+        return
+
+    await event.bot.send_message(event.from_user.id, "<b>Заявки на редактирование конференций:</b>")
+    for req in edit_requests:
+        conf = await session.get(Conference, req.conference_id)
+        organizer = await session.get(User, req.organizer_id)
+        data = req.data
+
+        text = f"ID: <code>{req.id}</code>\n"
+        text += f"Конференция: <b>{conf.name}</b>\n"
+        text += f"От: {organizer.full_name or organizer.telegram_id}\n\n"
+        text += f"<b>Текущие данные:</b>\n"
+        text += f"Название: {conf.name}\n"
+        if conf.description:
+            text += f"Описание: {conf.description}\n"
+        text += f"Город: {conf.city or 'Онлайн'}\n"
+        text += f"Дата проведения: {conf.date}\n"
+        text += f"Оргвзнос: {conf.fee} руб.\n\n"
+        text += f"<b>Новые данные:</b>\n"
+        text += f"Название: {data.get('name', conf.name)}\n"
+        if data.get('description') is not None:
+            text += f"Описание: {data.get('description') or '(удалено)'}\n"
+        text += f"Город: {data.get('city', conf.city)}\n"
+        text += f"Дата проведения: {data.get('date', conf.date)}\n"
+        text += f"Оргвзнос: {data.get('fee', conf.fee)} руб.\n"
+
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(text="Одобрить", callback_data=RequestCallback(kind="edit", action="approve", id=req.id).pack()),
+            InlineKeyboardButton(text="Отклонить", callback_data=RequestCallback(kind="edit", action="reject", id=req.id).pack())
+        )
+
+        if data.get('poster_path') and os.path.exists(data['poster_path']):
+            photo = FSInputFile(data['poster_path'])
+            await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
+        else:
+            if conf.poster_path and os.path.exists(conf.poster_path):
+                photo = FSInputFile(conf.poster_path)
+                await event.bot.send_photo(event.from_user.id, photo, caption=text, reply_markup=builder.as_markup())
+            else:
+                await event.bot.send_message(event.from_user.id, text, reply_markup=builder.as_markup())
+
+# Команда просмотра всех заявок
+@router.message(Command("admin_requests"))
+async def admin_conference_requests(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not await is_admin_or_chief(db_user):
+        await message.answer("Доступ запрещён.")
+        return
+
+    await update_requests_message(message, session)
+
+# Кнопка заявок на редактирование
+
+# Кнопка "Посмотреть апелляции"
+async def view_appeals(message: types.Message, session: AsyncSession):
+    if not await is_chief_admin(message.from_user.id):
+        await message.answer("Доступ только Глав Админу.")
+        return
+
+    appeal_requests = (await session.execute(
+        select(ConferenceCreationRequest).where(
+            ConferenceCreationRequest.status == "rejected",
+            ConferenceCreationRequest.appeal == True
+        )
+    )).scalars().all()
+
+    if not appeal_requests:
+        await message.answer("Нет активных апелляций.")
+        return
+
+    await message.answer("<b>Активные апелляции:</b>")
+    for req in appeal_requests:
+        user = await session.get(User, req.user_id)
+        data = req.data
+
+        text = f"ID: <code>{req.id}</code> (апелляция)\n"
+        text += f"От: {user.full_name or user.telegram_id}\n\n"
+        text += f"Название: {data.get('name')}\n"
+        if data.get('description'):
+            text += f"Описание: {data.get('description')}\n"
+        text += f"Город: {data.get('city')}\n"
+        text += f"Дата проведения: {data.get('date')}\n"
+        text += f"Оргвзнос: {data.get('fee', 0)} руб.\n"
+
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(text="Одобрить", callback_data=RequestCallback(kind="appeal", action="approve", id=req.id).pack()),
+            InlineKeyboardButton(text="Отклонить", callback_data=RequestCallback(kind="appeal", action="reject", id=req.id).pack())
+        )
+
+        if data.get('poster_path') and os.path.exists(data['poster_path']):
+            photo = FSInputFile(data['poster_path'])
+            await message.answer_photo(photo, caption=text, reply_markup=builder.as_markup())
+        else:
+            await message.answer(text, reply_markup=builder.as_markup())
 
 # Просмотр всех конференций
-@router.message(F.text == "🗂 Все конференции")
-async def view_all_conferences(message: types.Message):
-    if not await can_view_conferences(message.from_user.id):
+async def view_all_conferences(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not await can_view_conferences(message.from_user.id, db_user):
         await message.answer("Доступ запрещён.")
         return
 
-    async with AsyncSessionLocal() as session:
-        conferences = (await session.execute(select(Conference).where(Conference.is_active == True))).scalars().all()
+    conferences = (await session.execute(active_conferences())).all()
 
-        if not conferences:
-            await message.answer("Нет активных конференций.")
-            return
+    if not conferences:
+        await message.answer("Нет активных конференций.")
+        return
 
-        for conf in conferences:
-            organizer = await session.get(User, conf.organizer_id)
-            organizer_name = organizer.full_name or organizer.telegram_id if organizer else "—"
+    can_delete = await can_delete_conference(db_user)
 
-            text = f"<b>{conf.name}</b> (ID: {conf.id})\n"
-            text += f"Организатор: {organizer_name}\n"
-            text += f"Город: {conf.city or 'Онлайн'}\n"
-            text += f"Дата проведения: {conf.date}\n"
-            text += f"Оргвзнос: {conf.fee} руб.\n"
-            if conf.description:
-                text += f"\n<i>{conf.description}</i>\n"
+    for conf in conferences:
+        organizer_name = conf.organizer_name or conf.organizer_telegram_id or "—"
 
-            builder = InlineKeyboardBuilder()
-            if await can_delete_conference(message.from_user.id):
-                builder.row(InlineKeyboardButton(text="Удалить конференцию", callback_data=f"admin_delete_conf_{conf.id}"))
+        text = f"<b>{conf.name}</b> (ID: {conf.id})\n"
+        text += f"Организатор: {organizer_name}\n"
+        text += f"Город: {conf.city or 'Онлайн'}\n"
+        text += f"Дата проведения: {conf.date}\n"
+        text += f"Оргвзнос: {conf.fee} руб.\n"
+        if conf.description:
+            text += f"\n<i>{conf.description}</i>\n"
 
-            if conf.poster_path and os.path.exists(conf.poster_path):
-                photo = FSInputFile(conf.poster_path)
-                await message.answer_photo(photo, caption=text, reply_markup=builder.as_markup())
-            else:
-                await message.answer(text, reply_markup=builder.as_markup())
+        builder = InlineKeyboardBuilder()
+        if can_delete:
+            builder.row(InlineKeyboardButton(text="Удалить конференцию", callback_data=ConferenceCallback(action="admin_delete", id=conf.id).pack()))
+
+        if conf.poster_path and os.path.exists(conf.poster_path):
+            photo = FSInputFile(conf.poster_path)
+            await message.answer_photo(photo, caption=text, reply_markup=builder.as_markup())
+        else:
+            await message.answer(text, reply_markup=builder.as_markup())
 
 # Статистика
-@router.message(F.text == "📊 Статистика")
-async def stats(message: types.Message):
-    if not (await is_admin_or_chief(message.from_user.id) or await is_chief_tech(message.from_user.id)):
+@flags.deferrable
+async def stats(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not (await is_admin_or_chief(db_user) or await is_chief_tech(message.from_user.id)):
         await message.answer("Доступ запрещён.")
         return
 
-    async with AsyncSessionLocal() as session:
-        users_count = await session.scalar(select(func.count(User.id)))
-        conf_count = await session.scalar(select(func.count(Conference.id)).where(Conference.is_active == True))
-        apps_count = await session.scalar(select(func.count(Application.id)))
+    users_count = await session.scalar(select(func.count(User.id)))
+    conf_count = await session.scalar(active_conferences_count())
+    apps_count = await session.scalar(select(func.count(Application.id)))
 
-        text = "<b>Статистика бота:</b>\n\n"
-        text += f"Пользователей: {users_count}\n"
-        text += f"Активных конференций: {conf_count}\n"
-        text += f"Всего заявок на участие: {apps_count}\n"
+    text = "<b>Статистика бота:</b>\n\n"
+    text += f"Пользователей: {users_count}\n"
+    text += f"Активных конференций: {conf_count}\n"
+    text += f"Всего заявок на участие: {apps_count}\n"
 
-        await message.answer(text)
+    await message.answer(text)
 
 # Приостановка/запуск бота
-@router.message(F.text.in_({"🛑 Приостановить бота", "▶ Возобновить работу бота"}))
 async def pause_bot_handler(message: types.Message, state: FSMContext):
     if not await can_pause_bot(message.from_user.id):
         await message.answer("Доступ запрещён.")
@@ -408,13 +406,13 @@ async def pause_reason_handler(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Удаление через кнопку
-@router.callback_query(F.data.startswith("admin_delete_conf_"))
-async def admin_delete_start(callback: types.CallbackQuery, state: FSMContext):
-    if not await can_delete_conference(callback.from_user.id):
+@router.callback_query(OnCallback(ConferenceCallback, "admin_delete"))
+async def admin_delete_start(callback: types.CallbackQuery, callback_data: ConferenceCallback, state: FSMContext, db_user: CachedUser | None):
+    if not await can_delete_conference(db_user):
         await callback.answer("Доступ запрещён.", show_alert=True)
         return
 
-    conf_id = int(callback.data.split("_")[-1])
+    conf_id = callback_data.id
     await state.update_data(conf_id=conf_id)
     await state.set_state(AdminStates.delete_conf_reason)
 
@@ -425,8 +423,8 @@ async def admin_delete_start(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(Command("delete_conf"))
-async def delete_conference_command(message: types.Message):
-    if not await can_delete_conference(message.from_user.id):
+async def delete_conference_command(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not await can_delete_conference(db_user):
         await message.answer("Доступ запрещён.")
         return
 
@@ -441,40 +439,39 @@ async def delete_conference_command(message: types.Message):
         await message.answer("Формат: /delete_conf ID_конференции причина")
         return
 
-    await perform_conference_deletion(message, conf_id, reason)
+    await perform_conference_deletion(message, session, conf_id, reason)
 
 @router.message(StateFilter(AdminStates.delete_conf_reason))
-async def delete_reason_handler(message: types.Message, state: FSMContext):
+async def delete_reason_handler(message: types.Message, state: FSMContext, session: AsyncSession):
     reason = message.text.strip()
     data = await state.get_data()
     conf_id = data["conf_id"]
 
-    await perform_conference_deletion(message, conf_id, reason)
+    await perform_conference_deletion(message, session, conf_id, reason)
     await state.clear()
 
-async def perform_conference_deletion(target, conf_id: int, reason: str):
-    async with AsyncSessionLocal() as session:
-        conf = await session.get(Conference, conf_id)
-        if not conf:
-            await target.answer("Конференция не найдена.")
-            return
+async def perform_conference_deletion(target, session: AsyncSession, conf_id: int, reason: str):
+    conf = await session.get(Conference, conf_id)
+    if not conf:
+        await target.answer("Конференция не найдена.")
+        return
 
-        organizer = await session.get(User, conf.organizer_id)
+    organizer = await session.get(User, conf.organizer_id)
 
-        deleted_log = DeletedConference(
-            conference_name=conf.name,
-            organizer_telegram_id=organizer.telegram_id,
-            deleted_by_telegram_id=target.from_user.id,
-            reason=reason,
-            deleted_at=datetime.now().strftime("%Y-%m-%d %H:%M")
-        )
-        session.add(deleted_log)
+    deleted_log = DeletedConference(
+        conference_name=conf.name,
+        organizer_telegram_id=organizer.telegram_id,
+        deleted_by_telegram_id=target.from_user.id,
+        reason=reason,
+        deleted_at=datetime.now().strftime("%Y-%m-%d %H:%M")
+    )
+    session.add(deleted_log)
 
-        await session.execute(delete(Application).where(Application.conference_id == conf_id))
-        await session.execute(delete(ConferenceEditRequest).where(ConferenceEditRequest.conference_id == conf_id))
+    await session.execute(delete(Application).where(Application.conference_id == conf_id))
+    await session.execute(delete(ConferenceEditRequest).where(ConferenceEditRequest.conference_id == conf_id))
 
-        await session.delete(conf)
-        await session.commit()
+    await session.delete(conf)
+    await session.commit()
 
     await target.answer(f"Конференция <b>{conf.name}</b> удалена по причине: {reason}")
 
@@ -487,134 +484,132 @@ async def perform_conference_deletion(target, conf_id: int, reason: str):
         pass
 
 # Обработка создания
-@router.callback_query(F.data.startswith("conf_create_approve_") | F.data.startswith("conf_create_reject_"))
-async def process_create_request(callback: types.CallbackQuery):
-    action = "approve" if "approve" in callback.data else "reject"
-    req_id = int(callback.data.split("_")[-1])
-
-    async with AsyncSessionLocal() as session:
-        req = await session.get(ConferenceCreationRequest, req_id)
-        if not req:
-            await callback.answer("Заявка не найдена.")
-            return
+@router.callback_query(OnCallback(RequestCallback, "approve", "reject", kind="create"))
+async def process_create_request(callback: types.CallbackQuery, callback_data: RequestCallback, session: AsyncSession):
+    action = callback_data.action
+    req_id = callback_data.id
+
+    req = await session.get(ConferenceCreationRequest, req_id)
+    if not req:
+        await callback.answer("Заявка не найдена.")
+        return
 
-        user = await session.get(User, req.user_id)
-        req_data = req.data
-
-        if action == "approve":
-            req.status = "approved"
-            user.role = Role.ORGANIZER.value
-
-            conference = Conference(
-                name=req_data["name"],
-                description=req_data.get("description"),
-                city=req_data.get("city"),
-                date=req_data.get("date"),
-                fee=float(req_data.get("fee", 0)),
-                qr_code_path=req_data.get("qr_code_path"),
-                poster_path=req_data.get("poster_path"),
-                organizer_id=user.id,
-                is_active=True
-            )
-            session.add(conference)
-            await session.commit()
+    user = await session.get(User, req.user_id)
+    req_data = req.data
+
+    if action == "approve":
+        req.status = "approved"
+        user.role = Role.ORGANIZER.value
+
+        conference = Conference(
+            name=req_data["name"],
+            description=req_data.get("description"),
+            city=req_data.get("city"),
+            date=parse_legacy_date(req_data.get("date")),
+            fee=float(req_data.get("fee", 0)),
+            qr_code_path=req_data.get("qr_code_path"),
+            poster_path=req_data.get("poster_path"),
+            organizer_id=user.id,
+            is_active=True
+        )
+        session.add(conference)
+        await session.commit()
+        user_cache.invalidate(user.telegram_id)
 
-            await callback.bot.send_message(
-                user.telegram_id,
-                f"🎉 Ваша заявка на создание конференции <b>{req_data['name']}</b> одобрена!\n\n"
-                "Теперь вы — Организатор.\n"
-                "Перезапустите бота командой /main_menu."
-            )
-        else:
-            req.status = "rejected"
-            await session.commit()
+        await callback.bot.send_message(
+            user.telegram_id,
+            f"🎉 Ваша заявка на создание конференции <b>{req_data['name']}</b> одобрена!\n\n"
+            "Теперь вы — Организатор.\n"
+            "Перезапустите бота командой /main_menu."
+        )
+    else:
+        req.status = "rejected"
+        await session.commit()
 
-            builder = InlineKeyboardBuilder()
-            builder.row(
-                InlineKeyboardButton(text="Подать апелляцию", callback_data=f"appeal_submit_{req.id}"),
-                InlineKeyboardButton(text="Главное меню", callback_data="back_to_main")
-            )
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(text="Подать апелляцию", callback_data=RequestCallback(kind="create", action="appeal", id=req.id).pack()),
+            InlineKeyboardButton(text="Главное меню", callback_data="back_to_main")
+        )
 
-            await callback.bot.send_message(
-                user.telegram_id,
-                f"❌ Ваша заявка на создание конференции <b>{req_data['name']}</b> отклонена.",
-                reply_markup=builder.as_markup()
-            )
+        await callback.bot.send_message(
+            user.telegram_id,
+            f"❌ Ваша заявка на создание конференции <b>{req_data['name']}</b> отклонена.",
+            reply_markup=builder.as_markup()
+        )
 
-        await callback.answer(f"Заявка {'одобрена' if action == 'approve' else 'отклонена'}")
+    await callback.answer(f"Заявка {'одобрена' if action == 'approve' else 'отклонена'}")
 
     try:
         await callback.message.delete()
     except:
         pass
 
-    await update_requests_message(callback)
+    await update_requests_message(callback, session)
 
 # Обработка редактирования
-@router.callback_query(F.data.startswith("conf_edit_approve_") | F.data.startswith("conf_edit_reject_"))
-async def process_edit_request(callback: types.CallbackQuery):
-    action = "approve" if "approve" in callback.data else "reject"
-    req_id = int(callback.data.split("_")[-1])
-
-    async with AsyncSessionLocal() as session:
-        req = await session.get(ConferenceEditRequest, req_id)
-        if not req:
-            await callback.answer("Заявка не найдена.")
-            return
+@router.callback_query(OnCallback(RequestCallback, "approve", "reject", kind="edit"))
+async def process_edit_request(callback: types.CallbackQuery, callback_data: RequestCallback, session: AsyncSession):
+    action = callback_data.action
+    req_id = callback_data.id
+
+    req = await session.get(ConferenceEditRequest, req_id)
+    if not req:
+        await callback.answer("Заявка не найдена.")
+        return
 
-        conf = await session.get(Conference, req.conference_id)
-        organizer = await session.get(User, req.organizer_id)
-        edit_data = req.data
-
-        if action == "approve":
-            conf.name = edit_data.get("name", conf.name)
-            conf.description = edit_data.get("description", conf.description)
-            conf.city = edit_data.get("city", conf.city)
-            conf.date = edit_data.get("date", conf.date)
-            conf.fee = edit_data.get("fee", conf.fee)
-            if edit_data.get("qr_code_path"):
-                conf.qr_code_path = edit_data["qr_code_path"]
-            if edit_data.get("poster_path"):
-                conf.poster_path = edit_data["poster_path"]
-
-            req.status = "approved"
-            await session.commit()
-
-            await callback.bot.send_message(
-                organizer.telegram_id,
-                f"✅ Ваши изменения в конференции <b>{conf.name}</b> одобрены!"
-            )
-        else:
-            req.status = "rejected"
-            await session.commit()
+    conf = await session.get(Conference, req.conference_id)
+    organizer = await session.get(User, req.organizer_id)
+    edit_data = req.data
+
+    if action == "approve":
+        conf.name = edit_data.get("name", conf.name)
+        conf.description = edit_data.get("description", conf.description)
+        conf.city = edit_data.get("city", conf.city)
+        conf.date = parse_legacy_date(edit_data.get("date")) or conf.date
+        conf.fee = edit_data.get("fee", conf.fee)
+        if edit_data.get("qr_code_path"):
+            conf.qr_code_path = edit_data["qr_code_path"]
+        if edit_data.get("poster_path"):
+            conf.poster_path = edit_data["poster_path"]
+
+        req.status = "approved"
+        await session.commit()
 
-            await callback.bot.send_message(
-                organizer.telegram_id,
-                f"❌ Ваши изменения в конференции <b>{conf.name}</b> отклонены."
-            )
+        await callback.bot.send_message(
+            organizer.telegram_id,
+            f"✅ Ваши изменения в конференции <b>{conf.name}</b> одобрены!"
+        )
+    else:
+        req.status = "rejected"
+        await session.commit()
+
+        await callback.bot.send_message(
+            organizer.telegram_id,
+            f"❌ Ваши изменения в конференции <b>{conf.name}</b> отклонены."
+        )
 
-        await callback.answer(f"Редактирование {'одобрено' if action == 'approve' else 'отклонено'}")
+    await callback.answer(f"Редактирование {'одобрено' if action == 'approve' else 'отклонено'}")
 
     try:
         await callback.message.delete()
     except:
         pass
 
-    await update_edit_requests_message(callback)
+    await update_edit_requests_message(callback, session)
 
 # Подача апелляции
-@router.callback_query(F.data.startswith("appeal_submit_"))
-async def appeal_submit(callback: types.CallbackQuery):
-    req_id = int(callback.data.split("_")[-1])
-
-    async with AsyncSessionLocal() as session:
-        req = await session.get(ConferenceCreationRequest, req_id)
-        if not req:
-            await callback.answer("Заявка не найдена.")
-            return
+@router.callback_query(OnCallback(RequestCallback, "appeal", kind="create"))
+async def appeal_submit(callback: types.CallbackQuery, callback_data: RequestCallback, session: AsyncSession):
+    req_id = callback_data.id
 
-        req.appeal = True
-        await session.commit()
+    req = await session.get(ConferenceCreationRequest, req_id)
+    if not req:
+        await callback.answer("Заявка не найдена.")
+        return
+
+    req.appeal = True
+    await session.commit()
 
     await callback.message.edit_text("Ваша апелляция отправлена Глав Админу.\nОжидайте решения.")
 
@@ -628,205 +623,173 @@ async def appeal_submit(callback: types.CallbackQuery):
 
 # Возврат в главное меню
 @router.callback_query(F.data == "back_to_main")
-async def back_to_main(callback: types.CallbackQuery):
-    db_user = await get_or_create_user(callback.from_user.id)
+async def back_to_main(callback: types.CallbackQuery, db_user: CachedUser | None):
+    if db_user is None:
+        db_user = await get_or_create_user(callback.from_user.id)
     await callback.message.edit_text("Главное меню", reply_markup=get_main_menu_keyboard(db_user.role))
     await callback.answer()
 
 # Обработка апелляции
-@router.callback_query(F.data.startswith("conf_appeal_approve_") | F.data.startswith("conf_appeal_reject_"))
-async def process_appeal(callback: types.CallbackQuery):
+@router.callback_query(OnCallback(RequestCallback, "approve", "reject", kind="appeal"))
+async def process_appeal(callback: types.CallbackQuery, callback_data: RequestCallback, session: AsyncSession):
     if not await is_chief_admin(callback.from_user.id):
         await callback.answer("Доступ только Глав Админу.")
         return
 
-    action = "approve" if "approve" in callback.data else "reject"
-    req_id = int(callback.data.split("_")[-1])
+    action = callback_data.action
+    req_id = callback_data.id
 
-    async with AsyncSessionLocal() as session:
-        req = await session.get(ConferenceCreationRequest, req_id)
-        if not req:
-            await callback.answer("Заявка не найдена.")
-            return
+    req = await session.get(ConferenceCreationRequest, req_id)
+    if not req:
+        await callback.answer("Заявка не найдена.")
+        return
 
-        user = await session.get(User, req.user_id)
-        req_data = req.data
-
-        if action == "approve":
-            req.status = "approved"
-            user.role = Role.ORGANIZER.value
-
-            conference = Conference(
-                name=req_data["name"],
-                description=req_data.get("description"),
-                city=req_data.get("city"),
-                date=req_data.get("date"),
-                fee=float(req_data.get("fee", 0)),
-                qr_code_path=req_data.get("qr_code_path"),
-                poster_path=req_data.get("poster_path"),
-                organizer_id=user.id,
-                is_active=True
-            )
-            session.add(conference)
-            await session.commit()
+    user = await session.get(User, req.user_id)
+    req_data = req.data
+
+    if action == "approve":
+        req.status = "approved"
+        user.role = Role.ORGANIZER.value
+
+        conference = Conference(
+            name=req_data["name"],
+            description=req_data.get("description"),
+            city=req_data.get("city"),
+            date=parse_legacy_date(req_data.get("date")),
+            fee=float(req_data.get("fee", 0)),
+            qr_code_path=req_data.get("qr_code_path"),
+            poster_path=req_data.get("poster_path"),
+            organizer_id=user.id,
+            is_active=True
+        )
+        session.add(conference)
+        await session.commit()
+        user_cache.invalidate(user.telegram_id)
 
-            await callback.bot.send_message(user.telegram_id, "✅ Ваша апелляция одобрена! Вы стали Организатором.")
-        else:
-            req.appeal = False
-            await session.commit()
+        await callback.bot.send_message(user.telegram_id, "✅ Ваша апелляция одобрена! Вы стали Организатором.")
+    else:
+        req.appeal = False
+        await session.commit()
 
-            await callback.bot.send_message(user.telegram_id, "❌ Ваша апелляция отклонена.")
+        await callback.bot.send_message(user.telegram_id, "❌ Ваша апелляция отклонена.")
 
-        await callback.answer("Апелляция обработана")
+    await callback.answer("Апелляция обработана")
 
     try:
         await callback.message.delete()
     except:
         pass
 
-    await update_requests_message(callback)
+    await update_requests_message(callback, session)
 
 # Экспорт данных бота
-@router.message(F.text == "📤 Экспорт данных бота")
-async def export_bot_data(message: types.Message):
+@flags.deferrable
+async def export_bot_data(message: types.Message, session: AsyncSession):
     user_id = message.from_user.id
 
     if user_id == TECH_SPECIALIST_ID:
-        async with AsyncSessionLocal() as session:
-            users = (await session.execute(select(User))).scalars().all()
-            users_data = []
-            for user in users:
-                users_data.append({
-                    "Telegram ID": user.telegram_id,
-                    "Username": user.username or "—",
-                    "ФИО": user.full_name or "—",
-                    "Роль": user.role,
-                    "Забанен": "Да" if user.is_banned else "Нет",
-                    "Причина бана": user.ban_reason or "—"
-                })
-
-            df_users = pd.DataFrame(users_data)
-            users_filename = "tech_export_users_with_bans.xlsx"
-            df_users.to_excel(users_filename, index=False)
-
-            conferences = (await session.execute(select(Conference).where(Conference.is_active == True))).scalars().all()
-            conf_data = []
-            for conf in conferences:
-                organizer = await session.get(User, conf.organizer_id)
-                organizer_name = organizer.full_name or organizer.telegram_id if organizer else "—"
-                conf_data.append({
-                    "ID": conf.id,
-                    "Название": conf.name,
-                    "Организатор": organizer_name,
-                    "Город": conf.city or "Онлайн",
-                    "Дата проведения": conf.date,
-                    "Оргвзнос": conf.fee
-                })
-
-            df_confs = pd.DataFrame(conf_data)
-            confs_filename = "tech_active_conferences.xlsx"
-            df_confs.to_excel(confs_filename, index=False)
-
-            deleted = (await session.execute(select(DeletedConference))).scalars().all()
-            deleted_data = []
-            for d in deleted:
-                deleted_data.append({
-                    "Название конференции": d.conference_name,
-                    "Организатор ID": d.organizer_telegram_id,
-                    "Удалил (ID)": d.deleted_by_telegram_id,
-                    "Причина удаления": d.reason,
-                    "Дата удаления": d.deleted_at
-                })
-
-            df_deleted = pd.DataFrame(deleted_data)
-            deleted_filename = "tech_deleted_conferences.xlsx"
-            df_deleted.to_excel(deleted_filename, index=False)
-
-        with open(users_filename, "rb") as f1:
-            await message.answer_document(BufferedInputFile(f1.read(), filename=users_filename), caption="1/3 Экспорт: Пользователи (с банами)")
-        with open(confs_filename, "rb") as f2:
-            await message.answer_document(BufferedInputFile(f2.read(), filename=confs_filename), caption="2/3 Экспорт: Активные конференции")
-        with open(deleted_filename, "rb") as f3:
-            await message.answer_document(BufferedInputFile(f3.read(), filename=deleted_filename), caption="3/3 Экспорт: Удалённые конференции")
-
-        os.remove(users_filename)
-        os.remove(confs_filename)
-        os.remove(deleted_filename)
+        users = (await session.execute(users_export())).all()
+        users_data = []
+        for user in users:
+            users_data.append({
+                "Telegram ID": user.telegram_id,
+                "Username": user.username or "—",
+                "ФИО": user.full_name or "—",
+                "Роль": user.role,
+                "Забанен": "Да" if user.is_banned else "Нет",
+                "Причина бана": user.ban_reason or "—"
+            })
+
+        users_file = dataframe_document(pd.DataFrame(users_data), "tech_export_users_with_bans.xlsx")
+
+        conferences = (await session.execute(active_conferences())).all()
+        conf_data = []
+        for conf in conferences:
+            organizer_name = conf.organizer_name or conf.organizer_telegram_id or "—"
+            conf_data.append({
+                "ID": conf.id,
+                "Название": conf.name,
+                "Организатор": organizer_name,
+                "Город": conf.city or "Онлайн",
+                "Дата проведения": conf.date,
+                "Оргвзнос": conf.fee
+            })
+
+        confs_file = dataframe_document(pd.DataFrame(conf_data), "tech_active_conferences.xlsx")
+
+        deleted = (await session.execute(deleted_conferences_export())).all()
+        deleted_data = []
+        for d in deleted:
+            deleted_data.append({
+                "Название конференции": d.conference_name,
+                "Организатор ID": d.organizer_telegram_id,
+                "Удалил (ID)": d.deleted_by_telegram_id,
+                "Причина удаления": d.reason,
+                "Дата удаления": d.deleted_at
+            })
+
+        deleted_file = dataframe_document(pd.DataFrame(deleted_data), "tech_deleted_conferences.xlsx")
+
+        await message.answer_document(users_file, caption="1/3 Экспорт: Пользователи (с банами)")
+        await message.answer_document(confs_file, caption="2/3 Экспорт: Активные конференции")
+        await message.answer_document(deleted_file, caption="3/3 Экспорт: Удалённые конференции")
         return
 
     if user_id in CHIEF_ADMIN_IDS:
-        async with AsyncSessionLocal() as session:
-            users = (await session.execute(select(User))).scalars().all()
-            users_data = []
-            for user in users:
-                users_data.append({
-                    "Telegram ID": user.telegram_id,
-                    "Username": user.username or "—",
-                    "ФИО": user.full_name or "—",
-                    "Роль": user.role,
-                    "Забанен": "Да" if user.is_banned else "Нет",
-                    "Причина бана": user.ban_reason or "—"
-                })
-
-            df_users = pd.DataFrame(users_data)
-            users_filename = "admin_users_with_bans.xlsx"
-            df_users.to_excel(users_filename, index=False)
-
-            conferences = (await session.execute(select(Conference).where(Conference.is_active == True))).scalars().all()
-            conf_data = []
-            for conf in conferences:
-                organizer = await session.get(User, conf.organizer_id)
-                organizer_name = organizer.full_name or organizer.telegram_id if organizer else "—"
-                conf_data.append({
-                    "Статус": "Активна",
-                    "ID": conf.id,
-                    "Название": conf.name,
-                    "Организатор": organizer_name,
-                    "Город": conf.city or "Онлайн",
-                    "Дата проведения": conf.date,
-                    "Оргвзнос": conf.fee
-                })
-
-            deleted = (await session.execute(select(DeletedConference))).scalars().all()
-            for d in deleted:
-                conf_data.append({
-                    "Статус": "Удалена",
-                    "ID": "—",
-                    "Название": d.conference_name,
-                    "Организатор": d.organizer_telegram_id,
-                    "Город": "—",
-                    "Дата проведения": "—",
-                    "Оргвзнос": "—",
-                    "Удалил": d.deleted_by_telegram_id,
-                    "Причина": d.reason,
-                    "Дата удаления": d.deleted_at
-                })
-
-            df_confs = pd.DataFrame(conf_data)
-            confs_filename = "admin_conferences_full.xlsx"
-            df_confs.to_excel(confs_filename, index=False)
-
-        with open(users_filename, "rb") as f1:
-            await message.answer_document(
-                BufferedInputFile(f1.read(), filename=users_filename),
-                caption="1/2 Экспорт: Пользователи (с ролями и банами)"
-            )
+        users = (await session.execute(users_export())).all()
+        users_data = []
+        for user in users:
+            users_data.append({
+                "Telegram ID": user.telegram_id,
+                "Username": user.username or "—",
+                "ФИО": user.full_name or "—",
+                "Роль": user.role,
+                "Забанен": "Да" if user.is_banned else "Нет",
+                "Причина бана": user.ban_reason or "—"
+            })
 
-        with open(confs_filename, "rb") as f2:
-            await message.answer_document(
-                BufferedInputFile(f2.read(), filename=confs_filename),
-                caption="2/2 Экспорт: Все конференции (активные + удалённые)"
-            )
+        users_file = dataframe_document(pd.DataFrame(users_data), "admin_users_with_bans.xlsx")
+
+        conferences = (await session.execute(active_conferences())).all()
+        conf_data = []
+        for conf in conferences:
+            organizer_name = conf.organizer_name or conf.organizer_telegram_id or "—"
+            conf_data.append({
+                "Статус": "Активна",
+                "ID": conf.id,
+                "Название": conf.name,
+                "Организатор": organizer_name,
+                "Город": conf.city or "Онлайн",
+                "Дата проведения": conf.date,
+                "Оргвзнос": conf.fee
+            })
 
-        os.remove(users_filename)
-        os.remove(confs_filename)
+        deleted = (await session.execute(deleted_conferences_export())).all()
+        for d in deleted:
+            conf_data.append({
+                "Статус": "Удалена",
+                "ID": "—",
+                "Название": d.conference_name,
+                "Организатор": d.organizer_telegram_id,
+                "Город": "—",
+                "Дата проведения": "—",
+                "Оргвзнос": "—",
+                "Удалил": d.deleted_by_telegram_id,
+                "Причина": d.reason,
+                "Дата удаления": d.deleted_at
+            })
+
+        confs_file = dataframe_document(pd.DataFrame(conf_data), "admin_conferences_full.xlsx")
+
+        await message.answer_document(users_file, caption="1/2 Экспорт: Пользователи (с ролями и банами)")
+        await message.answer_document(confs_file, caption="2/2 Экспорт: Все конференции (активные + удалённые)")
         return
 
     await message.answer("Доступ запрещён.")
 
 # Назначение роли — только Глав Тех
 @router.message(Command("set_role"))
-async def set_role(message: types.Message):
+async def set_role(message: types.Message, session: AsyncSession):
     if not await is_chief_tech(message.from_user.id):
         await message.answer("Доступ запрещён. Только для Главного Тех Специалиста.")
         return
@@ -840,29 +803,29 @@ async def set_role(message: types.Message):
         _, target, role_str = message.text.split(maxsplit=2)
         target = target.lstrip("@")
 
-        async with AsyncSessionLocal() as session:
-            if target.isdigit():
-                result = await session.execute(select(User).where(User.telegram_id == int(target)))
-            else:
-                result = await session.execute(select(User).where(User.full_name.ilike(f"%{target}%")))
-            target_user = result.scalar_one_or_none()
+        if target.isdigit():
+            result = await session.execute(user_by_telegram_id(int(target)))
+        else:
+            result = await session.execute(select(User).where(User.full_name.icontains(target, autoescape=True)))
+        target_user = result.scalar_one_or_none()
 
-            if not target_user:
-                await message.answer("Пользователь не найден.")
-                return
+        if not target_user:
+            await message.answer("Пользователь не найден.")
+            return
 
-            if role_str not in [r.value for r in Role]:
-                await message.answer("Неверная роль.")
-                return
+        if role_str not in [r.value for r in Role]:
+            await message.answer("Неверная роль.")
+            return
 
-            target_user.role = role_str
-            await session.commit()
+        target_user.role = role_str
+        await session.commit()
+        user_cache.invalidate(target_user.telegram_id)
 
-            await message.answer(f"Роль пользователя {target_user.full_name or target_user.telegram_id} изменена на {role_str}")
-            try:
-                await message.bot.send_message(target_user.telegram_id, f"Ваша роль изменена на: {role_str}")
-            except:
-                pass
+        await message.answer(f"Роль пользователя {target_user.full_name or target_user.telegram_id} изменена на {role_str}")
+        try:
+            await message.bot.send_message(target_user.telegram_id, f"Ваша роль изменена на: {role_str}")
+        except:
+            pass
     except:
         await message.answer("Неверный формат команды.")
 
@@ -870,38 +833,36 @@ async def set_role(message: types.Message):
 
 # Просмотр обращений
 # Просмотр обращений — исправленная версия
-@router.message(F.text == "📩 Обращения пользователей")
-async def view_support_requests(message: types.Message):
+async def view_support_requests(message: types.Message, session: AsyncSession):
     if not await is_chief_tech(message.from_user.id):
         await message.answer("Доступ запрещён.")
         return
 
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(SupportRequest).order_by(SupportRequest.id.desc())
-        )
-        requests = result.scalars().all()
-
-        if not requests:
-            await message.answer("Нет обращений в техподдержку.")
-            return
+    result = await session.execute(
+        select(SupportRequest).order_by(SupportRequest.id.desc())
+    )
+    requests = result.scalars().all()
 
-        # Загружаем пользователей заранее
-        enriched_requests = []
-        for req in requests:
-            user_result = await session.execute(select(User).where(User.id == req.user_id))
-            user = user_result.scalar_one_or_none()
-            enriched_requests.append({
-                "request": req,
-                "user": user
-            })
+    if not requests:
+        await message.answer("Нет обращений в техподдержку.")
+        return
 
-        support_pagination[message.from_user.id] = {
-            "index": 0,
-            "total": len(enriched_requests),
-            "requests": enriched_requests
-        }
-        await show_support_request(message, enriched_requests, 0)
+    # Загружаем пользователей заранее
+    enriched_requests = []
+    for req in requests:
+        user_result = await session.execute(select(User).where(User.id == req.user_id))
+        user = user_result.scalar_one_or_none()
+        enriched_requests.append({
+            "request": req,
+            "user": user
+        })
+
+    support_pagination[message.from_user.id] = {
+        "index": 0,
+        "total": len(enriched_requests),
+        "requests": enriched_requests
+    }
+    await show_support_request(message, enriched_requests, 0)
 
 async def show_support_request(target, enriched_requests: list, index: int):
     item = enriched_requests[index]
@@ -922,13 +883,13 @@ async def show_support_request(target, enriched_requests: list, index: int):
         text += f"\n<b>Ответ:</b> {req.response}"
 
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="📩 Ответить", callback_data=f"reply_support_{req.id}"))
+    builder.row(InlineKeyboardButton(text="📩 Ответить", callback_data=SupportCallback(action="reply", id=req.id).pack()))
 
     nav = []
     if index > 0:
-        nav.append(InlineKeyboardButton(text="◀ Назад", callback_data=f"nav_support_{index-1}"))
+        nav.append(InlineKeyboardButton(text="◀ Назад", callback_data=SupportCallback(action="page", id=index - 1).pack()))
     if index < len(enriched_requests) - 1:
-        nav.append(InlineKeyboardButton(text="Вперёд ▶", callback_data=f"nav_support_{index+1}"))
+        nav.append(InlineKeyboardButton(text="Вперёд ▶", callback_data=SupportCallback(action="page", id=index + 1).pack()))
     if nav:
         builder.row(*nav)
 
@@ -972,9 +933,9 @@ async def show_support_request(target, enriched_requests: list, index: int):
             raise e
 
 # Навигация по обращениям
-@router.callback_query(F.data.startswith("nav_support_"))
-async def navigate_support(callback: types.CallbackQuery):
-    index = int(callback.data.split("_")[-1])
+@router.callback_query(OnCallback(SupportCallback, "page"))
+async def navigate_support(callback: types.CallbackQuery, callback_data: SupportCallback):
+    index = callback_data.id
     user_id = callback.from_user.id
 
     data = support_pagination.get(user_id)
@@ -992,13 +953,13 @@ async def navigate_support(callback: types.CallbackQuery):
     await callback.answer(f"{index + 1}/{total}")
 
 # Начало ответа
-@router.callback_query(F.data.startswith("reply_support_"))
-async def start_reply_support(callback: types.CallbackQuery, state: FSMContext):
+@router.callback_query(OnCallback(SupportCallback, "reply"))
+async def start_reply_support(callback: types.CallbackQuery, callback_data: SupportCallback, state: FSMContext):
     if not await is_chief_tech(callback.from_user.id):
         await callback.answer("Доступ запрещён.", show_alert=True)
         return
 
-    req_id = int(callback.data.split("_")[-1])
+    req_id = callback_data.id
     await state.update_data(support_id=req_id)
     await state.set_state(AdminStates.waiting_support_reply)
     await callback.message.answer(
@@ -1010,7 +971,7 @@ async def start_reply_support(callback: types.CallbackQuery, state: FSMContext):
 # Обработка ответа
 # Обработка ответа на обращение (через кнопку "Ответить")
 @router.message(StateFilter(AdminStates.waiting_support_reply))
-async def process_support_reply(message: types.Message, state: FSMContext):
+async def process_support_reply(message: types.Message, state: FSMContext, session: AsyncSession):
     if not await is_chief_tech(message.from_user.id):
         await message.answer("Доступ запрещён.")
         await state.clear()
@@ -1028,33 +989,32 @@ async def process_support_reply(message: types.Message, state: FSMContext):
         await message.answer("Ответ не может быть пустым.")
         return
 
-    async with AsyncSessionLocal() as session:
-        req_result = await session.execute(select(SupportRequest).where(SupportRequest.id == support_id))
-        req = req_result.scalar_one_or_none()
-        if not req:
-            await message.answer("Обращение не найдено.")
-            await state.clear()
-            return
+    req_result = await session.execute(select(SupportRequest).where(SupportRequest.id == support_id))
+    req = req_result.scalar_one_or_none()
+    if not req:
+        await message.answer("Обращение не найдено.")
+        await state.clear()
+        return
 
-        # Обновляем обращение
-        req.response = response_text
-        req.status = "answered"
-        await session.commit()
+    # Обновляем обращение
+    req.response = response_text
+    req.status = "answered"
+    await session.commit()
 
-        # Загружаем пользователя для отправки ответа
-        user_result = await session.execute(select(User).where(User.id == req.user_id))
-        user = user_result.scalar_one_or_none()
+    # Загружаем пользователя для отправки ответа
+    user_result = await session.execute(select(User).where(User.id == req.user_id))
+    user = user_result.scalar_one_or_none()
 
-        if user and user.telegram_id:
-            try:
-                await message.bot.send_message(
-                    user.telegram_id,
-                    f"📩 <b>Ответ от техподдержки:</b>\n\n{response_text}"
-                )
-            except Exception as e:
-                await message.answer(f"Ответ сохранён, но не удалось отправить пользователю: {e}")
-        else:
-            await message.answer("Ответ сохранён, но пользователь не найден или заблокировал бота.")
+    if user and user.telegram_id:
+        try:
+            await message.bot.send_message(
+                user.telegram_id,
+                f"📩 <b>Ответ от техподдержки:</b>\n\n{response_text}"
+            )
+        except Exception as e:
+            await message.answer(f"Ответ сохранён, но не удалось отправить пользователю: {e}")
+    else:
+        await message.answer("Ответ сохранён, но пользователь не найден или заблокировал бота.")
 
     await message.answer(
         "✅ Ответ успешно отправлен и сохранён.",
@@ -1065,7 +1025,7 @@ async def process_support_reply(message: types.Message, state: FSMContext):
 # Команда /reply_support
 # Команда /reply_support ID текст
 @router.message(Command("reply_support"))
-async def cmd_reply_support(message: types.Message):
+async def cmd_reply_support(message: types.Message, session: AsyncSession):
     if not await is_chief_tech(message.from_user.id):
         await message.answer("Доступ запрещён.")
         return
@@ -1084,71 +1044,61 @@ async def cmd_reply_support(message: types.Message):
         await message.answer("Текст ответа не может быть пустым.")
         return
 
-    async with AsyncSessionLocal() as session:
-        req_result = await session.execute(select(SupportRequest).where(SupportRequest.id == support_id))
-        req = req_result.scalar_one_or_none()
-        if not req:
-            await message.answer("Обращение не найдено.")
-            return
+    req_result = await session.execute(select(SupportRequest).where(SupportRequest.id == support_id))
+    req = req_result.scalar_one_or_none()
+    if not req:
+        await message.answer("Обращение не найдено.")
+        return
 
-        req.response = response_text
-        req.status = "answered"
-        await session.commit()
+    req.response = response_text
+    req.status = "answered"
+    await session.commit()
 
-        user_result = await session.execute(select(User).where(User.id == req.user_id))
-        user = user_result.scalar_one_or_none()
+    user_result = await session.execute(select(User).where(User.id == req.user_id))
+    user = user_result.scalar_one_or_none()
 
-        if user and user.telegram_id:
-            try:
-                await message.bot.send_message(
-                    user.telegram_id,
-                    f"📩 <b>Ответ от техподдержки:</b>\n\n{response_text}"
-                )
-            except Exception as e:
-                await message.answer(f"Ответ сохранён, но не удалось отправить: {e}")
-        else:
-            await message.answer("Ответ сохранён, но пользователь не найден.")
+    if user and user.telegram_id:
+        try:
+            await message.bot.send_message(
+                user.telegram_id,
+                f"📩 <b>Ответ от техподдержки:</b>\n\n{response_text}"
+            )
+        except Exception as e:
+            await message.answer(f"Ответ сохранён, но не удалось отправить: {e}")
+    else:
+        await message.answer("Ответ сохранён, но пользователь не найден.")
 
     await message.answer("Ответ отправлен пользователю.")
 
 # Экспорт обращений
-@router.message(F.text == "📤 Экспорт обращений")
-async def export_support_requests(message: types.Message):
+@flags.deferrable
+async def export_support_requests(message: types.Message, session: AsyncSession):
     if not await is_chief_tech(message.from_user.id):
         await message.answer("Доступ запрещён.")
         return
 
-    async with AsyncSessionLocal() as session:
-        requests = (await session.execute(select(SupportRequest))).scalars().all()
+    requests = (await session.execute(support_requests_export())).all()
 
-        if not requests:
-            await message.answer("Нет обращений для экспорта.")
-            return
-
-        data = []
-        for req in requests:
-            user = await session.get(User, req.user_id)
-            data.append({
-                "ID": req.id,
-                "ФИО": user.full_name or "—",
-                "Telegram ID": user.telegram_id,
-                "Текст обращения": req.message,
-                "Скриншот (путь)": req.screenshot_path or "—",
-                "Статус": req.status,
-                "Ответ": req.response or "—"
-            })
+    if not requests:
+        await message.answer("Нет обращений для экспорта.")
+        return
 
-        df = pd.DataFrame(data)
-        filename = "support_requests_export.xlsx"
-        df.to_excel(filename, index=False)
+    data = []
+    for req in requests:
+        data.append({
+            "ID": req.id,
+            "ФИО": req.full_name or "—",
+            "Telegram ID": req.telegram_id,
+            "Текст обращения": req.message,
+            "Скриншот (путь)": req.screenshot_path or "—",
+            "Статус": req.status,
+            "Ответ": req.response or "—"
+        })
 
-        with open(filename, "rb") as f:
-            await message.answer_document(
-                BufferedInputFile(f.read(), filename=filename),
-                caption="📤 Экспорт всех обращений в техподдержку"
-            )
+    df = pd.DataFrame(data)
+    file = dataframe_document(df, "support_requests_export.xlsx")
 
-        os.remove(filename)
+    await message.answer_document(file, caption="📤 Экспорт всех обращений в техподдержку")
 
 @router.message(Command("backup_db"))
 async def backup_db(message: types.Message):
@@ -1156,6 +1106,10 @@ async def backup_db(message: types.Message):
         await message.answer("🚫 Доступ запрещён.")
         return
 
+    if not IS_SQLITE:
+        await message.answer("ℹ️ Бэкап файлом доступен только для SQLite. Для PostgreSQL используйте pg_dump.")
+        return
+
     try:
         with open("mun_bot.db", "rb") as db_file:
             await message.answer_document(
@@ -1,14 +1,16 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import BufferedInputFile
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import pandas as pd
-import os
 
-from database import AsyncSessionLocal, User, Role
+from database import User, Role
 from config import TECH_SPECIALIST_ID, CHIEF_ADMIN_IDS
+from cache import CachedUser, user_cache, ban_registry
+from queries import user_by_telegram_id
 from states import BanReasonState  # должен существовать
+from utils import dataframe_document
 
 router = Router()
 
@@ -16,29 +18,23 @@ router = Router()
 # =========================
 # 🔐 Проверка прав
 # =========================
-async def can_ban_unban(user_id: int) -> bool:
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == user_id)
-        )
-        user = result.scalar_one_or_none()
-
-        if not user:
-            return False
+async def can_ban_unban(db_user: CachedUser | None) -> bool:
+    if not db_user:
+        return False
 
-        return user.role in [
-            Role.ADMIN.value,
-            Role.CHIEF_ADMIN.value,
-            Role.CHIEF_TECH.value
-        ]
+    return db_user.role in [
+        Role.ADMIN.value,
+        Role.CHIEF_ADMIN.value,
+        Role.CHIEF_TECH.value
+    ]
 
 
 # =========================
 # 🚫 НАЧАЛО БАНА
 # =========================
 @router.message(Command("ban"))
-async def start_ban(message: types.Message, state: FSMContext):
-    if not await can_ban_unban(message.from_user.id):
+async def start_ban(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
+    if not await can_ban_unban(db_user):
         await message.answer("Доступ запрещён.")
         return
 
@@ -52,7 +48,7 @@ async def start_ban(message: types.Message, state: FSMContext):
     await state.update_data(target=target, action="ban")
 
     if message.from_user.id == TECH_SPECIALIST_ID:
-        await do_ban_unban(message, state, reason="Без причины (Глав Тех Специалист)")
+        await do_ban_unban(message, state, session, reason="Без причины (Глав Тех Специалист)")
     else:
         await state.set_state(BanReasonState.reason)
         await message.answer("Введите причину бана:")
@@ -62,8 +58,8 @@ async def start_ban(message: types.Message, state: FSMContext):
 # 🔓 НАЧАЛО РАЗБАНА
 # =========================
 @router.message(Command("unban"))
-async def start_unban(message: types.Message, state: FSMContext):
-    if not await can_ban_unban(message.from_user.id):
+async def start_unban(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
+    if not await can_ban_unban(db_user):
         await message.answer("Доступ запрещён.")
         return
 
@@ -77,7 +73,7 @@ async def start_unban(message: types.Message, state: FSMContext):
     await state.update_data(target=target, action="unban")
 
     if message.from_user.id == TECH_SPECIALIST_ID:
-        await do_ban_unban(message, state, reason="Без причины (Глав Тех Специалист)")
+        await do_ban_unban(message, state, session, reason="Без причины (Глав Тех Специалист)")
     else:
         await state.set_state(BanReasonState.reason)
         await message.answer("Введите причину разбана:")
@@ -87,77 +83,80 @@ async def start_unban(message: types.Message, state: FSMContext):
 # ✏️ ОБРАБОТКА ПРИЧИНЫ
 # =========================
 @router.message(BanReasonState.reason)
-async def process_reason(message: types.Message, state: FSMContext):
+async def process_reason(message: types.Message, state: FSMContext, session: AsyncSession):
     await state.update_data(reason=message.text)
-    await do_ban_unban(message, state, reason=message.text)
+    await do_ban_unban(message, state, session, reason=message.text)
 
 
 # =========================
 # ⚙️ ВЫПОЛНЕНИЕ БАНА / РАЗБАНА
 # =========================
-async def do_ban_unban(message: types.Message, state: FSMContext, reason: str):
+async def do_ban_unban(message: types.Message, state: FSMContext, session: AsyncSession, reason: str):
     data = await state.get_data()
     target = data["target"]
     action = data["action"]
 
-    async with AsyncSessionLocal() as session:
-        if target.isdigit():
-            result = await session.execute(
-                select(User).where(User.telegram_id == int(target))
-            )
-        else:
-            result = await session.execute(
-                select(User).where(User.full_name.ilike(f"%{target}%"))
-            )
+    if target.isdigit():
+        result = await session.execute(
+            user_by_telegram_id(int(target))
+        )
+    else:
+        result = await session.execute(
+            select(User).where(User.full_name.icontains(target, autoescape=True))
+        )
+
+    user = result.scalar_one_or_none()
 
-        user = result.scalar_one_or_none()
+    if not user:
+        await message.answer("Пользователь не найден.")
+        await state.clear()
+        return
 
-        if not user:
-            await message.answer("Пользователь не найден.")
+    # ========= БАН =========
+    if action == "ban":
+        if user.is_banned:
+            await message.answer(
+                f"Пользователь {user.full_name or user.telegram_id} уже забанен."
+            )
             await state.clear()
             return
 
-        # ========= БАН =========
-        if action == "ban":
-            if user.is_banned:
-                await message.answer(
-                    f"Пользователь {user.full_name or user.telegram_id} уже забанен."
-                )
-                await state.clear()
-                return
+        user.is_banned = True
+        user.ban_reason = reason
 
-            user.is_banned = True
-            user.ban_reason = reason
+        await session.commit()
+        user_cache.invalidate(user.telegram_id)
+        ban_registry.ban(user.telegram_id)
 
-            await session.commit()
+        action_text = "заблокирован"
+        user_text = (
+            "🚫 Вы заблокированы в боте MUN.\n"
+            f"Причина: {reason}"
+        )
 
-            action_text = "заблокирован"
-            user_text = (
-                "🚫 Вы заблокированы в боте MUN.\n"
-                f"Причина: {reason}"
+    # ======== РАЗБАН ========
+    else:
+        if not user.is_banned:
+            await message.answer(
+                f"Пользователь {user.full_name or user.telegram_id} не забанен."
             )
+            await state.clear()
+            return
 
-        # ======== РАЗБАН ========
-        else:
-            if not user.is_banned:
-                await message.answer(
-                    f"Пользователь {user.full_name or user.telegram_id} не забанен."
-                )
-                await state.clear()
-                return
-
-            old_reason = user.ban_reason
+        old_reason = user.ban_reason
 
-            user.is_banned = False
-            user.ban_reason = None
+        user.is_banned = False
+        user.ban_reason = None
 
-            # 🔥 ВАЖНО: ВСЕГДА ВОЗВРАЩАЕМ УЧАСТНИКА
-            user.role = Role.PARTICIPANT.value
+        # 🔥 ВАЖНО: ВСЕГДА ВОЗВРАЩАЕМ УЧАСТНИКА
+        user.role = Role.PARTICIPANT.value
 
-            await session.commit()
+        await session.commit()
+        user_cache.invalidate(user.telegram_id)
+        ban_registry.unban(user.telegram_id)
 
-            action_text = "разблокирован"
-            user_text = "✅ Вы разблокированы в боте MUN."
+        action_text = "разблокирован"
+        user_text = "✅ Вы разблокированы в боте MUN."
 
     await message.answer(
         f"Пользователь {user.full_name or user.telegram_id} {action_text}."
@@ -178,16 +177,15 @@ async def do_ban_unban(message: types.Message, state: FSMContext, reason: str):
 # 📄 СПИСОК ЗАБАНЕННЫХ (CSV)
 # =========================
 @router.message(Command("banned_list"))
-async def banned_list(message: types.Message):
-    if not await can_ban_unban(message.from_user.id):
+async def banned_list(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not await can_ban_unban(db_user):
         await message.answer("Доступ запрещён.")
         return
 
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(User).where(User.is_banned == True)
-        )
-        banned_users = result.scalars().all()
+    result = await session.execute(
+        select(User).where(User.is_banned == True)
+    )
+    banned_users = result.scalars().all()
 
     if not banned_users:
         await message.answer("Забаненных пользователей нет.")
@@ -202,15 +200,9 @@ async def banned_list(message: types.Message):
         })
 
     df = pd.DataFrame(data)
-    filename = "banned_users.csv"
-    df.to_csv(filename, index=False, encoding="utf-8-sig")
-
-    with open(filename, "rb") as f:
-        file = BufferedInputFile(f.read(), filename=filename)
+    file = dataframe_document(df, "banned_users.csv")
 
     await message.answer_document(
         file,
         caption="📋 Список забаненных пользователей"
-    )
-
-    os.remove(filename)
\ No newline at end of file
+    )
\ No newline at end of file
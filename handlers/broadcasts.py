@@ -0,0 +1,94 @@
+from contextlib import suppress
+
+from aiogram import Router, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import BroadcastJob, Role
+from cache import CachedUser
+from callbacks import BroadcastCallback, OnCallback
+from keyboards import get_broadcast_job_keyboard
+from broadcast import broadcast_jobs, job_status_text, format_duration
+
+router = Router()
+
+# Сколько последних завершённых рассылок показывать в /broadcasts
+RECENT_JOBS_LIMIT = 5
+
+
+# =========================
+# 🔐 Проверка прав
+# =========================
+# Тех. специалист управляет всеми рассылками, остальные — только своими
+def can_control_job(job: BroadcastJob, db_user: CachedUser | None) -> bool:
+    if not db_user:
+        return False
+    return db_user.role == Role.CHIEF_TECH.value or job.owner_telegram_id == db_user.telegram_id
+
+
+# =========================
+# 📋 Незавершённые и последние рассылки
+# =========================
+@router.message(Command("broadcasts"))
+async def list_broadcasts(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not db_user or db_user.role not in (Role.CHIEF_TECH.value, Role.ORGANIZER.value):
+        await message.answer("🚫 Доступ запрещён.")
+        return
+
+    own = select(BroadcastJob)
+    if db_user.role != Role.CHIEF_TECH.value:
+        own = own.where(BroadcastJob.owner_telegram_id == db_user.telegram_id)
+    jobs = (await session.execute(
+        own.where(BroadcastJob.status.in_(("running", "paused"))).order_by(BroadcastJob.id)
+    )).scalars().all()
+    finished = (await session.execute(
+        own.where(BroadcastJob.status.in_(("done", "cancelled")))
+        .order_by(BroadcastJob.id.desc()).limit(RECENT_JOBS_LIMIT)
+    )).scalars().all()
+
+    if not jobs:
+        await message.answer("Незавершённых рассылок нет.")
+    for job in jobs:
+        await message.answer(job_status_text(job), reply_markup=get_broadcast_job_keyboard(job.id, job.status))
+
+    if finished:
+        lines = []
+        for job in finished:
+            done = job.sent + job.failed
+            speed = f", {done / job.elapsed:.1f} сообщ./с" if job.elapsed > 0 else ""
+            lines.append(
+                f"#{job.id} {job.title} — {'отменена' if job.status == 'cancelled' else 'завершена'} "
+                f"{job.finished_at:%d.%m %H:%M}: {job.sent} из {job.total}, не доставлено {job.failed}, "
+                f"{format_duration(job.elapsed)}{speed}, повторов {job.retries}"
+            )
+        await message.answer("🗂 <b>Последние рассылки:</b>\n\n" + "\n".join(lines))
+
+
+# =========================
+# ⏸ Пауза / ▶️ продолжение / ⛔ отмена
+# =========================
+@router.callback_query(OnCallback(BroadcastCallback, "pause", "resume", "cancel"))
+async def control_broadcast(callback: types.CallbackQuery, callback_data: BroadcastCallback, session: AsyncSession, db_user: CachedUser | None):
+    job = await session.get(BroadcastJob, callback_data.id)
+    if not job:
+        await callback.answer("Рассылка не найдена.", show_alert=True)
+        return
+    if not can_control_job(job, db_user):
+        await callback.answer("🚫 Доступ запрещён.", show_alert=True)
+        return
+
+    if callback_data.action == "pause":
+        changed = await broadcast_jobs.pause(job.id)
+    elif callback_data.action == "resume":
+        changed = await broadcast_jobs.resume(callback.bot, job.id)
+    else:
+        changed = await broadcast_jobs.cancel(job.id)
+
+    # Статус и счётчики — свежие, после записи из broadcast_jobs.
+    # Сообщение с прогрессом рассылка правит и сама — текст может уже совпадать
+    await session.refresh(job)
+    with suppress(TelegramBadRequest):
+        await callback.message.edit_text(job_status_text(job), reply_markup=get_broadcast_job_keyboard(job.id, job.status))
+    await callback.answer(None if changed else "Статус рассылки уже изменился.")
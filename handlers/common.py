@@ -1,14 +1,15 @@
-from aiogram import Router, types, F
+from aiogram import Router, types, F, flags
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardButton, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from sqlalchemy import select, func
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import os
 
 from aiogram.types import Message, CallbackQuery
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import (
     AsyncSessionLocal,
@@ -18,7 +19,8 @@ from database import (
     Role,
     ConferenceCreationRequest,
     SupportRequest,
-    get_or_create_user
+    get_or_create_user,
+    write_queue
 )
 
 from keyboards import (
@@ -26,15 +28,20 @@ from keyboards import (
     get_cancel_keyboard,
     get_main_menu_keyboard
 )
+from callbacks import ConferenceCallback, OnCallback
 
 from states import ParticipantRegistration, CreateConferenceRequest, SupportAppeal
 from config import CHIEF_ADMIN_IDS, TECH_SPECIALIST_ID
+from cache import CachedUser, user_cache
+from queries import user_by_telegram_id, upcoming_conferences
 
 from aiogram import BaseMiddleware
 import logging
 
 router = Router()
 
+logger = logging.getLogger(__name__)
+
 os.makedirs("qr_codes", exist_ok=True)
 os.makedirs("posters", exist_ok=True)
 os.makedirs("support_screenshots", exist_ok=True)
@@ -61,75 +68,66 @@ def validate_conference_date(date_str: str) -> str | None:
 
     return None
 
-# Форматирование даты
-def format_conference_date(date_str: str) -> str:
-    try:
-        conf_date = datetime.strptime(date_str.strip(), "%Y-%m-%d")
-        return f"Дата проведения: {conf_date.strftime('%d %B %Y')}"
-    except:
-        return f"Дата: {date_str}"
+# Форматирование даты (Conference.date — уже date, строка приходит только из данных анкеты)
+def format_conference_date(conf_date: date | str) -> str:
+    if isinstance(conf_date, str):
+        try:
+            conf_date = datetime.strptime(conf_date.strip(), "%Y-%m-%d").date()
+        except ValueError:
+            return f"Дата: {conf_date}"
+    return f"Дата проведения: {conf_date.strftime('%d %B %Y')}"
 
 # Список конференций
 @router.message(Command("conferences"))
-async def cmd_conferences(message: types.Message):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(Conference).where(Conference.is_active == True)
+async def cmd_conferences(message: types.Message, session: AsyncSession):
+    # Только предстоящие: диапазон по индексу (is_active, date)
+    result = await session.execute(upcoming_conferences(date.today()))
+    conferences = result.all()
+
+    if not conferences:
+        await message.answer(
+            "😔 Пока нет актуальных конференций.\n"
+            "Следите за обновлениями или создайте свою!"
         )
-        conferences = result.scalars().all()
-
-        if not conferences:
-            await message.answer(
-                "😔 Пока нет актуальных конференций.\n"
-                "Следите за обновлениями или создайте свою!"
-            )
-            return
+        return
 
-        for conf in conferences:
-            text = f"<b>{conf.name}</b>\n"
-            text += f"📍 {conf.city or 'Онлайн'}\n"
-            text += f"📅 {format_conference_date(conf.date)}\n"
-            fee_text = f"💸 Оргвзнос: {conf.fee} руб." if conf.fee > 0 else "🆓 Бесплатно"
-            text += f"{fee_text}\n\n"
-            if conf.description:
-                text += f"<i>{conf.description}</i>\n\n"
-            text += "Нажмите кнопку ниже, чтобы подать заявку:"
-
-            builder = InlineKeyboardBuilder()
-            builder.row(InlineKeyboardButton(text="Подать заявку", callback_data=f"select_conf_{conf.id}"))
-
-            if conf.poster_path and os.path.exists(conf.poster_path):
-                photo = FSInputFile(conf.poster_path)
-                await message.answer_photo(photo, caption=text, reply_markup=builder.as_markup())
-            else:
-                await message.answer(text, reply_markup=builder.as_markup())
+    for conf in conferences:
+        text = f"<b>{conf.name}</b>\n"
+        text += f"📍 {conf.city or 'Онлайн'}\n"
+        text += f"📅 {format_conference_date(conf.date)}\n"
+        fee_text = f"💸 Оргвзнос: {conf.fee} руб." if conf.fee > 0 else "🆓 Бесплатно"
+        text += f"{fee_text}\n\n"
+        if conf.description:
+            text += f"<i>{conf.description}</i>\n\n"
+        text += "Нажмите кнопку ниже, чтобы подать заявку:"
+
+        builder = InlineKeyboardBuilder()
+        builder.row(InlineKeyboardButton(text="Подать заявку", callback_data=ConferenceCallback(action="select", id=conf.id).pack()))
+
+        if conf.poster_path and os.path.exists(conf.poster_path):
+            photo = FSInputFile(conf.poster_path)
+            await message.answer_photo(photo, caption=text, reply_markup=builder.as_markup())
+        else:
+            await message.answer(text, reply_markup=builder.as_markup())
 
 # Регистрация
 @router.message(Command("register"))
-async def cmd_register(message: types.Message):
-    await cmd_conferences(message)
+async def cmd_register(message: types.Message, session: AsyncSession):
+    await cmd_conferences(message, session)
 
 # Выбор конференции
-@router.callback_query(F.data.startswith("select_conf_"))
-async def select_conference(callback: types.CallbackQuery, state: FSMContext):
-    conf_id = int(callback.data.split("_")[-1])
+@router.callback_query(OnCallback(ConferenceCallback, "select"))
+async def select_conference(callback: types.CallbackQuery, callback_data: ConferenceCallback, state: FSMContext, session: AsyncSession):
+    conf_id = callback_data.id
 
-    async with AsyncSessionLocal() as session:
-        conf = await session.get(Conference, conf_id)
-        if not conf:
-            await callback.answer("Конференция не найдена.", show_alert=True)
-            return
-
-        today = datetime.now().date()
-        try:
-            conf_date = datetime.strptime(conf.date.strip(), "%Y-%m-%d").date()
-        except ValueError:
-            await callback.answer("Ошибка в дате конференции.", show_alert=True)
-            return
+    conf = await session.get(Conference, conf_id)
+    if not conf:
+        await callback.answer("Конференция не найдена.", show_alert=True)
+        return
 
-        if conf_date < today:
-            await callback.answer("Нельзя подать заявку на конференцию, которая уже прошла.", show_alert=True)
-            return
+    if conf.date < date.today():
+        await callback.answer("Нельзя подать заявку на конференцию, которая уже прошла.", show_alert=True)
+        return
 
     await state.update_data(conference_id=conf_id)
     await state.set_state(ParticipantRegistration.full_name)
@@ -184,50 +182,48 @@ async def process_experience(message: types.Message, state: FSMContext):
     await message.answer("6. Желаемый комитет:", reply_markup=get_cancel_keyboard())
 
 @router.message(ParticipantRegistration.committee)
-async def process_committee(message: types.Message, state: FSMContext):
+async def process_committee(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
     data = await state.get_data()
     data["committee"] = message.text.strip()
 
-    async with AsyncSessionLocal() as session:
-        user_result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = user_result.scalar_one()
-
-        user.full_name = data.get("full_name")
-        user.age = data.get("age")
-        user.email = data.get("email")
-        user.institution = data.get("institution")
-        user.experience = data.get("experience")
-
-        application = Application(
-            user_id=user.id,
-            conference_id=data["conference_id"],
-            committee=data["committee"],
-            status="pending"
-        )
-        session.add(application)
-        await session.commit()
-        await session.refresh(application)
-
-        conf = await session.get(Conference, data["conference_id"])
-
-        notify_text = (
-            f"🔔 <b>Новая заявка на участие!</b>\n\n"
-            f"Конференция: <b>{conf.name}</b>\n\n"
-            f"<b>Анкета участника:</b>\n"
-            f"• ФИО: {data.get('full_name')}\n"
-            f"• Возраст: {data.get('age')}\n"
-            f"• Email: {data.get('email')}\n"
-            f"• Учебное заведение: {data.get('institution')}\n"
-            f"• Опыт в MUN: {data.get('experience')}\n"
-            f"• Комитет: {data['committee']}\n\n"
-            f"ID заявки: <code>{application.id}</code>"
-        )
+    user = await session.get(User, db_user.id)
+
+    user.full_name = data.get("full_name")
+    user.age = data.get("age")
+    user.email = data.get("email")
+    user.institution = data.get("institution")
+    user.experience = data.get("experience")
 
-        if conf.organizer_id:
-            try:
-                await message.bot.send_message(conf.organizer.telegram_id, notify_text)
-            except:
-                pass
+    application = Application(
+        user_id=user.id,
+        conference_id=data["conference_id"],
+        committee=data["committee"],
+        status="pending"
+    )
+    session.add(application)
+    await session.commit()
+    await session.refresh(application)
+
+    conf = await session.get(Conference, data["conference_id"])
+
+    notify_text = (
+        f"🔔 <b>Новая заявка на участие!</b>\n\n"
+        f"Конференция: <b>{conf.name}</b>\n\n"
+        f"<b>Анкета участника:</b>\n"
+        f"• ФИО: {data.get('full_name')}\n"
+        f"• Возраст: {data.get('age')}\n"
+        f"• Email: {data.get('email')}\n"
+        f"• Учебное заведение: {data.get('institution')}\n"
+        f"• Опыт в MUN: {data.get('experience')}\n"
+        f"• Комитет: {data['committee']}\n\n"
+        f"ID заявки: <code>{application.id}</code>"
+    )
+
+    if conf.organizer_id:
+        try:
+            await message.bot.send_message(conf.organizer.telegram_id, notify_text)
+        except:
+            pass
 
     db_user = await get_or_create_user(message.from_user.id, message.from_user.full_name)
     await message.answer(
@@ -239,25 +235,22 @@ async def process_committee(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Создание конференции — с валидацией
-@router.message(F.text == "Создать конференцию")
-async def cmd_create_conference(message: types.Message, state: FSMContext):
-    async with AsyncSessionLocal() as session:
-        user_result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = user_result.scalar_one_or_none()
+async def cmd_create_conference(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
+    user = db_user
 
-        if not user or user.role != "Участник":
-            await message.answer("Эта функция доступна только Участникам.")
-            return
+    if not user or user.role != "Участник":
+        await message.answer("Эта функция доступна только Участникам.")
+        return
 
-        conf_count = await session.scalar(
-            select(func.count(Conference.id)).where(Conference.organizer_id == user.id)
+    conf_count = await session.scalar(
+        select(func.count(Conference.id)).where(Conference.organizer_id == user.id)
+    )
+    if conf_count > 0:
+        await message.answer(
+            "У вас уже есть активная конференция.\n"
+            "Удалите её или дождитесь завершения, чтобы создать новую."
         )
-        if conf_count > 0:
-            await message.answer(
-                "У вас уже есть активная конференция.\n"
-                "Удалите её или дождитесь завершения, чтобы создать новую."
-            )
-            return
+        return
 
     await state.set_state(CreateConferenceRequest.name)
     await message.answer("Создание конференции. Введите название:", reply_markup=get_cancel_keyboard())
@@ -325,68 +318,67 @@ async def process_conf_qr_skip(message: types.Message, state: FSMContext):
                          reply_markup=get_cancel_keyboard())
 
 @router.message(CreateConferenceRequest.poster, F.photo)
-async def process_conf_poster(message: types.Message, state: FSMContext):
+async def process_conf_poster(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
     file_info = await message.bot.get_file(message.photo[-1].file_id)
     poster_path = f"posters/poster_{message.from_user.id}_{message.message_id}.jpg"
     await message.bot.download_file(file_info.file_path, poster_path)
     await state.update_data(poster_path=poster_path)
-    await finish_conference_creation(message, state)
+    await finish_conference_creation(message, state, session, db_user)
 
 @router.message(CreateConferenceRequest.poster, F.text)
-async def process_conf_poster_skip(message: types.Message, state: FSMContext):
+async def process_conf_poster_skip(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
     if message.text.lower().strip() == "нет":
         await state.update_data(poster_path=None)
-        await finish_conference_creation(message, state)
+        await finish_conference_creation(message, state, session, db_user)
     else:
         await message.answer("Отправьте фото постера или напишите 'нет'")
 
-async def finish_conference_creation(message: types.Message, state: FSMContext):
+async def finish_conference_creation(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
     data = await state.get_data()
 
-    async with AsyncSessionLocal() as session:
-        # Получаем или создаём пользователя
-        result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = result.scalar_one_or_none()
-
-        if user is None:
-            user = User(
-                telegram_id=message.from_user.id,
-                username=message.from_user.username,
-                full_name=message.from_user.full_name or message.from_user.first_name
-            )
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)  # чтобы получить user.id
+    # Получаем или создаём пользователя
+    user = db_user
 
-        user_id = user.id
-        req = ConferenceCreationRequest(
-            user_id=user_id,
-            data=data,
-            status="pending"
+    if user is None:
+        user = User(
+            telegram_id=message.from_user.id,
+            username=message.from_user.username,
+            full_name=message.from_user.full_name or message.from_user.first_name
         )
-        session.add(req)
+        session.add(user)
         await session.commit()
+        await session.refresh(user)  # чтобы получить user.id
+        user_cache.invalidate(user.telegram_id)
+
+    user_id = user.id
+    req = ConferenceCreationRequest(
+        user_id=user_id,
+        data=data,
+        status="pending"
+    )
+    session.add(req)
+    await session.commit()
 
-        user = await session.get(User, user_id)
-        notify_text = (
-            f"🔔 <b>Новая заявка на создание конференции!</b>\n\n"
-            f"От: {user.full_name or user.telegram_id}\n"
-            f"Название: {data['name']}\n"
-            f"Город: {data.get('city', 'Онлайн')}\n"
-            f"Дата проведения: {data['date']}\n"
-            f"Оргвзнос: {data.get('fee', 0)} руб.\n\n"
-            f"ID заявки: <code>{req.id}</code>"
-        )
+    user = await session.get(User, user_id)
+    notify_text = (
+        f"🔔 <b>Новая заявка на создание конференции!</b>\n\n"
+        f"От: {user.full_name or user.telegram_id}\n"
+        f"Название: {data['name']}\n"
+        f"Город: {data.get('city', 'Онлайн')}\n"
+        f"Дата проведения: {data['date']}\n"
+        f"Оргвзнос: {data.get('fee', 0)} руб.\n\n"
+        f"ID заявки: <code>{req.id}</code>"
+    )
 
-        admins = (await session.execute(
-            select(User.telegram_id).where(User.role.in_(["Админ", "Главный Админ"]))
-        )).scalars().all()
+    admins = (await session.execute(
+        select(User.telegram_id).where(User.role.in_(["Админ", "Главный Админ"]))
+    )).scalars().all()
 
-        for admin_id in set(admins + CHIEF_ADMIN_IDS):
-            try:
-                await message.bot.send_message(admin_id, notify_text)
-            except:
-                pass
+    for admin_id in set(admins + CHIEF_ADMIN_IDS):
+        try:
+            await message.bot.send_message(admin_id, notify_text)
+        except:
+            pass
 
     await message.answer(
         "✅ <b>Заявка на создание конференции отправлена!</b>\n\n"
@@ -400,7 +392,6 @@ async def finish_conference_creation(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обращение к тех. специалисту — с сохранением скриншота
-@router.message(F.text == "📩 Обращение к тех. специалисту")
 async def start_support_appeal(message: types.Message, state: FSMContext):
     await state.set_state(SupportAppeal.message)
     await message.answer(
@@ -410,6 +401,20 @@ async def start_support_appeal(message: types.Message, state: FSMContext):
         reply_markup=get_cancel_keyboard()
     )
 
+# Новое обращение пишется через очередь группового коммита; результат — id обращения
+def support_request_insert(user_id: int, text: str, screenshot_path: str | None):
+    async def op(session: AsyncSession) -> int:
+        req = SupportRequest(
+            user_id=user_id,
+            message=text,
+            screenshot_path=screenshot_path,
+            status="pending"
+        )
+        session.add(req)
+        await session.flush()
+        return req.id
+    return op
+
 @router.message(SupportAppeal.message, F.photo)
 async def save_support_appeal_with_photo(message: types.Message, state: FSMContext):
     file_info = await message.bot.get_file(message.photo[-1].file_id)
@@ -424,32 +429,25 @@ async def save_support_appeal_with_photo(message: types.Message, state: FSMConte
         message.from_user.full_name
     )
 
-    async with AsyncSessionLocal() as session:
-        req = SupportRequest(
-            user_id=db_user.id,
-            message=text,
-            screenshot_path=screenshot_path,
-            status="pending"
-        )
-        session.add(req)
-        await session.commit()
-        await session.refresh(req)
+    req_id = await write_queue.submit(
+        support_request_insert(db_user.id, text, screenshot_path)
+    )
 
-        notify_text = (
-            f"🆘 Новое обращение в техподдержку!\n\n"
-            f"От: {message.from_user.full_name or message.from_user.id}\n"
-            f"Текст: {text}\n"
-            f"ID обращения: <code>{req.id}</code>"
-        )
+    notify_text = (
+        f"🆘 Новое обращение в техподдержку!\n\n"
+        f"От: {message.from_user.full_name or message.from_user.id}\n"
+        f"Текст: {text}\n"
+        f"ID обращения: <code>{req_id}</code>"
+    )
 
-        try:
-            await message.bot.send_photo(
-                TECH_SPECIALIST_ID,
-                message.photo[-1].file_id,
-                caption=notify_text
-            )
-        except Exception as e:
-            print(f"Ошибка отправки фото теху: {e}")
+    try:
+        await message.bot.send_photo(
+            TECH_SPECIALIST_ID,
+            message.photo[-1].file_id,
+            caption=notify_text
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отправки фото теху: {e}")
 
     await message.answer(
         "✅ Ваше обращение с скриншотом отправлено в техподдержку.\n"
@@ -467,27 +465,20 @@ async def save_support_appeal_text_only(message: types.Message, state: FSMContex
         message.from_user.full_name or message.from_user.first_name
     )
 
-    async with AsyncSessionLocal() as session:
-        req = SupportRequest(
-            user_id=db_user.id,
-            message=message.text,
-            screenshot_path=None,
-            status="pending"
-        )
-        session.add(req)
-        await session.commit()
-        await session.refresh(req)
+    req_id = await write_queue.submit(
+        support_request_insert(db_user.id, message.text, None)
+    )
 
-        notify_text = (
-            f"🆘 Новое обращение в техподдержку!\n\n"
-            f"От: {message.from_user.full_name or message.from_user.id}\n"
-            f"Текст: {message.text}\n"
-            f"ID обращения: <code>{req.id}</code>"
-        )
-        try:
-            await message.bot.send_message(TECH_SPECIALIST_ID, notify_text)
-        except Exception as e:
-            print(f"Ошибка отправки текста теху: {e}")
+    notify_text = (
+        f"🆘 Новое обращение в техподдержку!\n\n"
+        f"От: {message.from_user.full_name or message.from_user.id}\n"
+        f"Текст: {message.text}\n"
+        f"ID обращения: <code>{req_id}</code>"
+    )
+    try:
+        await message.bot.send_message(TECH_SPECIALIST_ID, notify_text)
+    except Exception as e:
+        logger.error(f"Ошибка отправки текста теху: {e}")
 
     await message.answer(
         "✅ Ваше обращение отправлено в техподдержку.\n"
@@ -516,9 +507,7 @@ async def cancel_form(callback: types.CallbackQuery, state: FSMContext):
 
 async def is_user_banned(telegram_id: int) -> bool:
     async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
+        result = await session.execute(user_by_telegram_id(telegram_id))
         user = result.scalar_one_or_none()
         return bool(user and user.is_banned)
 
@@ -542,12 +531,12 @@ async def block_if_banned(event):
     return False
 
 @router.message(Command("stats"))
-async def stats(message: Message):
-    async with AsyncSessionLocal() as session:
-        users = await session.scalar(select(func.count(User.id)))
-        banned = await session.scalar(select(func.count(User.id)).where(User.is_banned))
-        confs = await session.scalar(select(func.count(Conference.id)))
-        apps = await session.scalar(select(func.count(Application.id)))
+@flags.deferrable
+async def stats(message: Message, session: AsyncSession):
+    users = await session.scalar(select(func.count(User.id)))
+    banned = await session.scalar(select(func.count(User.id)).where(User.is_banned))
+    confs = await session.scalar(select(func.count(Conference.id)))
+    apps = await session.scalar(select(func.count(Application.id)))
 
     await message.answer(
         f"📊 <b>Статистика</b>\n\n"
@@ -1,15 +1,24 @@
-from aiogram import Router, types, F
+from aiogram import Router, types, F, flags
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.types import InlineKeyboardButton, BufferedInputFile, InlineKeyboardMarkup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import pandas as pd
-import os
 import logging
 
-from database import AsyncSessionLocal, SupportRequest, User, Role
+from database import SupportRequest, User, Role, write_queue
 from keyboards import get_main_menu_keyboard, get_cancel_keyboard
+from callbacks import SupportCallback, OnCallback
+from cache import CachedUser, user_cache, ban_registry
+from queries import support_requests_export
+from middlewares.throttling import message_limiter, callback_limiter
+from scheduler import update_scheduler
+from broadcast import broadcaster, broadcast_jobs
+from fsm_storage import fsm_storage
+from utils import dataframe_document
+from middlewares.load_shedding import load_shedder
 from states import SupportResponse  # если ещё не импортировано
 from aiogram.fsm.state import State, StatesGroup
 
@@ -35,108 +44,97 @@ logger = logging.getLogger(__name__)
 _broadcast_mode = set()
 
 # Проверка роли "Глав Тех Специалист"
-async def is_tech_specialist(user_id: int) -> bool:
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.telegram_id == user_id))
-        user = result.scalar_one_or_none()
-        return user.role == Role.CHIEF_TECH.value if user else False
+async def is_tech_specialist(db_user: CachedUser | None) -> bool:
+    return db_user.role == Role.CHIEF_TECH.value if db_user else False
 
 
 # ======================
 # Просмотр очереди обращений
 # ======================
 @router.message(Command("support_requests"))
-async def list_support_requests(message: types.Message):
-    if not await is_tech_specialist(message.from_user.id):
+async def list_support_requests(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not await is_tech_specialist(db_user):
         await message.answer("Доступ запрещён. Только для Главного Тех Специалиста.")
         return
 
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(SupportRequest).order_by(SupportRequest.id))
-        requests = result.scalars().all()
+    result = await session.execute(select(SupportRequest).order_by(SupportRequest.id))
+    requests = result.scalars().all()
 
-        if not requests:
-            await message.answer(
-                "Очередь обращений в техподдержку пуста.",
-                reply_markup=get_main_menu_keyboard("Глав Тех Специалист")
-            )
-            return
-
-        builder = InlineKeyboardBuilder()
-        text = "<b>Очередь обращений в техподдержку:</b>\n\n"
-        for req in requests:
-            user = await session.get(User, req.user_id)
-            status_emoji = "✅" if req.status == "resolved" else "⏳"
-            status_text = "Обработано" if req.status == "resolved" else "Ожидает ответа"
-            text += f"{status_emoji} <b>ID обращения: {req.id}</b> ({status_text})\n"
-            text += f"От: {user.full_name or 'Без имени'} (@{user.telegram_id})\n"
-            text += f"Сообщение:\n{req.message}\n"
-            if req.response:
-                text += f"\nОтвет:\n{req.response}\n"
-            text += "\n"
+    if not requests:
+        await message.answer(
+            "Очередь обращений в техподдержку пуста.",
+            reply_markup=get_main_menu_keyboard("Глав Тех Специалист")
+        )
+        return
 
-            if req.status == "pending":
-                builder.row(
-                    InlineKeyboardButton(text=f"Ответить на обращение {req.id}", callback_data=f"support_answer_{req.id}")
-                )
+    builder = InlineKeyboardBuilder()
+    text = "<b>Очередь обращений в техподдержку:</b>\n\n"
+    for req in requests:
+        user = await session.get(User, req.user_id)
+        status_emoji = "✅" if req.status == "resolved" else "⏳"
+        status_text = "Обработано" if req.status == "resolved" else "Ожидает ответа"
+        text += f"{status_emoji} <b>ID обращения: {req.id}</b> ({status_text})\n"
+        text += f"От: {user.full_name or 'Без имени'} (@{user.telegram_id})\n"
+        text += f"Сообщение:\n{req.message}\n"
+        if req.response:
+            text += f"\nОтвет:\n{req.response}\n"
+        text += "\n"
+
+        if req.status == "pending":
+            builder.row(
+                InlineKeyboardButton(text=f"Ответить на обращение {req.id}", callback_data=SupportCallback(action="answer", id=req.id).pack())
+            )
 
-        builder.row(InlineKeyboardButton(text="📊 Экспорт обращений в CSV", callback_data="export_support_csv"))
-        builder.row(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_menu"))
+    builder.row(InlineKeyboardButton(text="📊 Экспорт обращений в CSV", callback_data="export_support_csv"))
+    builder.row(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_menu"))
 
-        await message.answer(text, reply_markup=builder.as_markup())
+    await message.answer(text, reply_markup=builder.as_markup())
 
 
 # ======================
 # Экспорт обращений в CSV
 # ======================
 @router.callback_query(F.data == "export_support_csv")
-async def export_support_csv(callback: types.CallbackQuery):
-    if not await is_tech_specialist(callback.from_user.id):
+@flags.deferrable
+async def export_support_csv(callback: types.CallbackQuery, session: AsyncSession, db_user: CachedUser | None):
+    if not await is_tech_specialist(db_user):
         await callback.answer("Доступ запрещён.", show_alert=True)
         return
 
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(SupportRequest).order_by(SupportRequest.id))
-        requests = result.scalars().all()
-
-        data = []
-        for req in requests:
-            user = await session.get(User, req.user_id)
-            data.append({
-                "ID обращения": req.id,
-                "Telegram ID": user.telegram_id,
-                "ФИО": user.full_name or "—",
-                "Сообщение": req.message,
-                "Статус": req.status,
-                "Ответ": req.response or "—"
-            })
+    requests = (await session.execute(support_requests_export())).all()
+
+    data = []
+    for req in requests:
+        data.append({
+            "ID обращения": req.id,
+            "Telegram ID": req.telegram_id,
+            "ФИО": req.full_name or "—",
+            "Сообщение": req.message,
+            "Статус": req.status,
+            "Ответ": req.response or "—"
+        })
 
     if not data:
         await callback.answer("Нет данных для экспорта", show_alert=True)
         return
 
     df = pd.DataFrame(data)
-    filename = "support_requests_export.csv"
-    df.to_csv(filename, index=False, encoding="utf-8-sig")
-
-    with open(filename, "rb") as f:
-        file = BufferedInputFile(f.read(), filename=filename)
+    file = dataframe_document(df, "support_requests_export.csv")
 
     await callback.message.answer_document(file, caption="📊 Экспорт всех обращений в техподдержку")
     await callback.answer("Файл отправлен!")
-    os.remove(filename)
 
 
 # ======================
 # Ответ на обращение
 # ======================
-@router.callback_query(F.data.startswith("support_answer_"))
-async def start_support_response(callback: types.CallbackQuery, state: FSMContext):
-    if not await is_tech_specialist(callback.from_user.id):
+@router.callback_query(OnCallback(SupportCallback, "answer"))
+async def start_support_response(callback: types.CallbackQuery, callback_data: SupportCallback, state: FSMContext, db_user: CachedUser | None):
+    if not await is_tech_specialist(db_user):
         await callback.answer("Доступ запрещён.", show_alert=True)
         return
 
-    req_id = int(callback.data.split("_")[-1])
+    req_id = callback_data.id
     await state.update_data(request_id=req_id)
     await state.set_state(SupportResponse.response_text)
 
@@ -149,8 +147,8 @@ async def start_support_response(callback: types.CallbackQuery, state: FSMContex
 
 
 @router.message(SupportResponse.response_text)
-async def send_support_response(message: types.Message, state: FSMContext):
-    if not await is_tech_specialist(message.from_user.id):
+async def send_support_response(message: types.Message, state: FSMContext, session: AsyncSession, db_user: CachedUser | None):
+    if not await is_tech_specialist(db_user):
         await state.clear()
         return
 
@@ -158,28 +156,27 @@ async def send_support_response(message: types.Message, state: FSMContext):
     req_id = data["request_id"]
     response_text = message.text
 
-    async with AsyncSessionLocal() as session:
-        req = await session.get(SupportRequest, req_id)
-        if not req or req.status == "resolved":
-            await message.answer("Обращение не найдено или уже обработано.")
-            await state.clear()
-            return
-
-        req.status = "resolved"
-        req.response = response_text
-        await session.commit()
+    req = await session.get(SupportRequest, req_id)
+    if not req or req.status == "resolved":
+        await message.answer("Обращение не найдено или уже обработано.")
+        await state.clear()
+        return
 
-        user = await session.get(User, req.user_id)
-        try:
-            await message.bot.send_message(
-                user.telegram_id,
-                f"📩 <b>Ответ от техподдержки</b>\n\n"
-                f"По вашему обращению:\n\"{req.message}\"\n\n"
-                f"Ответ:\n{response_text}"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки ответа пользователю {user.telegram_id}: {e}")
-            await message.answer("Не удалось отправить ответ (пользователь заблокировал бота или удалён).")
+    req.status = "resolved"
+    req.response = response_text
+    await session.commit()
+
+    user = await session.get(User, req.user_id)
+    try:
+        await message.bot.send_message(
+            user.telegram_id,
+            f"📩 <b>Ответ от техподдержки</b>\n\n"
+            f"По вашему обращению:\n\"{req.message}\"\n\n"
+            f"Ответ:\n{response_text}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отправки ответа пользователю {user.telegram_id}: {e}")
+        await message.answer("Не удалось отправить ответ (пользователь заблокировал бота или удалён).")
 
     await message.answer(
         f"Ответ на обращение ID {req_id} отправлен.",
@@ -189,12 +186,10 @@ async def send_support_response(message: types.Message, state: FSMContext):
 
 
 # ======================
-# ПРОСТАЯ РАССЫЛКА ВСЕМ ПОЛЬЗОВАТЕЛЯМ
 # ПРОСТАЯ РАССЫЛКА ВСЕМ ПОЛЬЗОВАТЕЛЯМ (ФИНАЛЬНАЯ ВЕРСИЯ)
 # ======================
-@router.message(F.text == "📢 Рассылка всем пользователям")
-async def broadcast_button_help(message: types.Message):
-    if not await is_tech_specialist(message.from_user.id):
+async def broadcast_button_help(message: types.Message, db_user: CachedUser | None):
+    if not await is_tech_specialist(db_user):
         await message.answer("🚫 Доступ запрещён.")
         return
 
@@ -210,8 +205,8 @@ async def broadcast_button_help(message: types.Message):
 
 # 2. Команда /broadcast — основная рассылка (фото, видео, текст)
 @router.message(Command("broadcast"))
-async def cmd_broadcast(message: types.Message):
-    if not await is_tech_specialist(message.from_user.id):
+async def cmd_broadcast(message: types.Message, session: AsyncSession, db_user: CachedUser | None):
+    if not await is_tech_specialist(db_user):
         await message.answer("🚫 Доступ запрещён.")
         return
 
@@ -231,46 +226,98 @@ async def cmd_broadcast(message: types.Message):
         )
         return
 
-    # Начало рассылки
-    await message.answer("🔄 <b>Рассылка началась...</b>")
-
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User.telegram_id))
-        user_ids = [row[0] for row in result.all()]
+    # Заблокировавшие бота и удалённые аккаунты пропускаем — отметку снимет их следующее сообщение боту
+    result = await session.execute(select(User.telegram_id).where(User.unreachable_at.is_(None)))
+    user_ids = [row[0] for row in result.all()]
 
     total = len(user_ids)
     if total == 0:
         await message.answer("❌ Нет пользователей.")
         return
 
-    sent = 0
-    failed = 0
+    # Содержимое сохраняется в задании: после перезапуска бота рассылка продолжится сама
     header = "📢 <b>Сообщение от техподдержки MUN-Бот</b>\n\n"
+    if source.photo:
+        content = {"type": "photo", "file_id": source.photo[-1].file_id, "text": header + (source.caption or command_text or "")}
+    elif source.video:
+        content = {"type": "video", "file_id": source.video.file_id, "text": header + (source.caption or command_text or "")}
+    elif source.document:
+        content = {"type": "document", "file_id": source.document.file_id, "text": header + (source.caption or command_text or "")}
+    else:
+        content = {"type": "text", "text": header + (command_text or source.text or "")}
+
+    # Это сообщение рассылка дальше правит сама: прогресс, скорость, кнопки паузы и отмены
+    status_message = await message.answer("🔄 <b>Рассылка началась...</b>")
+    job_id = await broadcast_jobs.create(
+        message.bot, message.from_user.id, "Всем пользователям", content, user_ids, status_message=status_message
+    )
+    logger.info(f"Рассылка техподдержки #{job_id}: {total} получателей")
 
-    for uid in user_ids:
-        try:
-            if source.photo:
-                caption = header + (source.caption or command_text or "")
-                await message.bot.send_photo(uid, source.photo[-1].file_id, caption=caption, parse_mode="HTML")
-            elif source.video:
-                caption = header + (source.caption or command_text or "")
-                await message.bot.send_video(uid, source.video.file_id, caption=caption, parse_mode="HTML")
-            elif source.document:
-                caption = header + (source.caption or command_text or "")
-                await message.bot.send_document(uid, source.document.file_id, caption=caption, parse_mode="HTML")
-            else:
-                text = header + (command_text or source.text or "")
-                await message.bot.send_message(uid, text, parse_mode="HTML")
-            sent += 1
-        except Exception as e:
-            failed += 1
-            logger.debug(f"Ошибка отправки {uid}: {e}")
 
+# ======================
+# МЕТРИКИ (только для тех. специалиста)
+# ======================
+@router.message(Command("metrics"))
+async def cmd_metrics(message: types.Message, db_user: CachedUser | None):
+    if not await is_tech_specialist(db_user):
+        await message.answer("🚫 Доступ запрещён.")
+        return
+
+    cache_stats = user_cache.stats()
+    queue_stats = write_queue.stats()
+    ban_stats = ban_registry.stats()
+    msg_limits = message_limiter.stats()
+    cb_limits = callback_limiter.stats()
+    sched = update_scheduler.stats()
+    fsm = fsm_storage.stats()
+    load = load_shedder.stats()
+    mailing = broadcaster.stats()
+    class_names = {"staff": "Админы", "organizer": "Организаторы", "participant": "Участники"}
+    class_lines = "".join(
+        f"{class_names[name]}: в работе {c['active']} / {c['limit']}, ждут {c['waiting']}, "
+        f"ожидание ср. {c['avg_wait'] * 1000:.0f} мс, макс. {c['max_wait'] * 1000:.0f} мс\n"
+        for name, c in sched["classes"].items()
+    )
     await message.answer(
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"Всего: <b>{total}</b>\n"
-        f"Отправлено: <b>{sent}</b>\n"
-        f"Не доставлено: <b>{failed}</b>",
-        parse_mode="HTML",
-        reply_markup=get_main_menu_keyboard("Глав Тех Специалист")
+        "📈 <b>Метрики бота</b>\n\n"
+        "<b>Кэш пользователей:</b>\n"
+        f"Записей: {cache_stats['size']} / {cache_stats['maxsize']}\n"
+        f"Попаданий: {cache_stats['hits']}\n"
+        f"Промахов: {cache_stats['misses']}\n"
+        f"Hit rate: {cache_stats['hit_rate']:.1%}\n"
+        f"Вытеснено: {cache_stats['evictions']}\n"
+        f"Инвалидаций: {cache_stats['invalidations']}\n\n"
+        "<b>Групповой коммит:</b>\n"
+        f"Включён: {'да' if queue_stats['enabled'] else 'нет'}\n"
+        f"В очереди: {queue_stats['pending']}\n"
+        f"Пачек: {queue_stats['batches']}, операций: {queue_stats['ops']}\n"
+        f"Средний размер пачки: {queue_stats['avg_batch']:.1f}\n"
+        f"Откатов пачки: {queue_stats['fallbacks']}\n\n"
+        "<b>Реестр банов:</b>\n"
+        f"Забанено: {ban_stats['size']}\n"
+        f"Сверок с БД: {ban_stats['reconciles']}\n"
+        f"Расхождений найдено: {ban_stats['drift']}\n\n"
+        "<b>Антиспам:</b>\n"
+        f"Сообщения: пропущено {msg_limits['allowed']}, отсечено {msg_limits['limited']}, "
+        f"вёдер {msg_limits['size']} / {msg_limits['max_keys']}\n"
+        f"Кнопки: пропущено {cb_limits['allowed']}, отсечено {cb_limits['limited']}, "
+        f"вёдер {cb_limits['size']} / {cb_limits['max_keys']}\n\n"
+        "<b>Обработка апдейтов:</b>\n"
+        f"В работе: {sched['active']} / {sched['max_concurrency']}, ждут: {sched['waiting']}\n"
+        f"Пользователей в очереди: {sched['users']}\n"
+        f"Обработано: {sched['processed']}, макс. ожидание: {sched['max_wait']:.2f} с\n"
+        f"{class_lines}\n"
+        "<b>Анкеты (FSM):</b>\n"
+        f"Незавершённых: {fsm['size']}, ждут записи: {fsm['dirty']}\n"
+        f"Записей в БД: {fsm['written']} за {fsm['flushes']} пачек, ошибок: {fsm['errors']}\n"
+        f"Брошено (TTL): {fsm['expired']}\n\n"
+        "<b>Сброс нагрузки:</b>\n"
+        f"Перегрузка сейчас: {'да' if load['overloaded'] else 'нет'} (эпизодов: {load['episodes']})\n"
+        f"Ожидание записи в БД: {load['write_wait_ms']:.0f} мс, макс. {load['write_wait_max_ms']:.0f} мс\n"
+        f"Отложено действий: {load['shed']}\n\n"
+        "<b>Рассылки:</b>\n"
+        f"Идёт сейчас: {mailing['active']} (заданий: {broadcast_jobs.running})\n"
+        f"Отправлено: {mailing['sent']}, не доставлено: {mailing['failed']} (из них недоступны: {mailing['unreachable']})\n"
+        f"Повторов: {mailing['retries']}, пауз по требованию Telegram: {mailing['flood_waits']}",
+        parse_mode="HTML"
     )
@@ -3,6 +3,8 @@ from aiogram.types import KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from callbacks import ConferenceCallback, BroadcastCallback
+
 # Главное меню — строго по ролям
 def get_main_menu_keyboard(role: str):
     builder = ReplyKeyboardBuilder()
@@ -93,10 +95,10 @@ def get_conferences_keyboard(conferences):
         if conf.city:
             details.append(conf.city)
         if conf.date:  # Одна дата
-            details.append(conf.date)
+            details.append(conf.date.strftime("%d.%m.%Y"))
         if details:
             text += f" ({', '.join(details)})"
-        builder.button(text=text, callback_data=f"select_conf_{conf.id}")
+        builder.button(text=text, callback_data=ConferenceCallback(action="select", id=conf.id).pack())
     builder.adjust(1)
     return builder.as_markup()
 
@@ -104,4 +106,16 @@ def get_conferences_keyboard(conferences):
 def get_cancel_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_form")]
-    ])
\ No newline at end of file
+    ])
+
+# Управление рассылкой: у завершённой и отменённой кнопок нет
+def get_broadcast_job_keyboard(job_id: int, status: str):
+    builder = InlineKeyboardBuilder()
+    if status == "running":
+        builder.button(text="⏸ Пауза", callback_data=BroadcastCallback(action="pause", id=job_id).pack())
+    elif status == "paused":
+        builder.button(text="▶️ Продолжить", callback_data=BroadcastCallback(action="resume", id=job_id).pack())
+    else:
+        return None
+    builder.button(text="⛔ Отменить", callback_data=BroadcastCallback(action="cancel", id=job_id).pack())
+    return builder.as_markup()
\ No newline at end of file
@@ -1,39 +1,31 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
-from sqlalchemy import select
 
-from database import AsyncSessionLocal, User
+from cache import ban_registry
 
 
 class BanMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
-        user_id = None
-
-        if isinstance(event, Message):
-            user_id = event.from_user.id
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id
-
-        if not user_id:
-            return await handler(event, data)
-
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = result.scalar_one_or_none()
-
-            if user and user.is_banned:
-                # 🚫 ПОЛНАЯ БЛОКИРОВКА
-                if isinstance(event, CallbackQuery):
-                    await event.answer(
-                        "🚫 Вы заблокированы и не можете пользоваться ботом.",
-                        show_alert=True
-                    )
-                elif isinstance(event, Message):
-                    await event.answer(
-                        "🚫 Вы заблокированы и не можете пользоваться ботом."
-                    )
-                return  # ❌ дальше код НЕ идёт
-
-        return await handler(event, data)
\ No newline at end of file
+        # Проверка по множеству забаненных в памяти — без запроса к БД.
+        # До первой загрузки реестра опираемся на db_user из DbSessionMiddleware
+        if ban_registry.loaded:
+            user = data.get("event_from_user")
+            banned = user is not None and ban_registry.is_banned(user.id)
+        else:
+            user = data.get("db_user")
+            banned = user is not None and user.is_banned
+
+        if banned:
+            # 🚫 ПОЛНАЯ БЛОКИРОВКА
+            if isinstance(event, CallbackQuery):
+                await event.answer(
+                    "🚫 Вы заблокированы и не можете пользоваться ботом.",
+                    show_alert=True
+                )
+            elif isinstance(event, Message):
+                await event.answer(
+                    "🚫 Вы заблокированы и не можете пользоваться ботом."
+                )
+            return  # ❌ дальше код НЕ идёт
+
+        return await handler(event, data)
@@ -0,0 +1,10 @@
+from aiogram import BaseMiddleware
+
+from callbacks import parse_callback_data
+
+
+# Разбор callback_data один раз на нажатие — хендлеры получают готовый объект
+class CallbackDataMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        data["callback_data"] = parse_callback_data(event.data)
+        return await handler(event, data)
@@ -0,0 +1,55 @@
+import asyncio
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import CachedUser, MISSING, user_cache
+from database import AsyncSessionLocal, mark_reachable
+from queries import user_record_by_telegram_id
+
+# Сессия апдейта и задача, которая его обрабатывает (задачи, запущенные хендлером,
+# наследуют контекст, но сессию им трогать нельзя)
+_update_session: ContextVar[tuple[AsyncSession, asyncio.Task] | None] = ContextVar("update_session", default=None)
+
+
+# Одна сессия БД на апдейт + пользователь, загруженный один раз.
+# Хендлеры и проверки прав получают их как session и db_user (CachedUser из user_cache).
+class DbSessionMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        async with AsyncSessionLocal() as session:
+            db_user = None
+            from_user = data.get("event_from_user")
+            if from_user:
+                db_user = user_cache.get(from_user.id)
+                if db_user is MISSING:
+                    row = (await session.execute(user_record_by_telegram_id(from_user.id))).first()
+                    db_user = CachedUser(*row) if row else None
+                    user_cache.put(from_user.id, db_user)
+                    # Завершаем читающую транзакцию, чтобы не держать соединение пула во время долгих хендлеров
+                    await session.commit()
+                if db_user is not None and db_user.unreachable:
+                    # Пользователь снова пишет боту — рассылки и напоминания снова до него доходят
+                    await mark_reachable(db_user)
+
+            data["session"] = session
+            data["db_user"] = db_user
+            token = _update_session.set((session, asyncio.current_task()))
+            try:
+                return await handler(event, data)
+            finally:
+                _update_session.reset(token)
+
+
+# Запросы к Bot API: перед каждым коммитим открытую транзакцию сессии апдейта,
+# чтобы соединение пула (а при записи — единственный писатель) не простаивало,
+# пока ждём Telegram. Параллельных апдейтов может быть больше, чем соединений.
+class DbSessionReleaseMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        current = _update_session.get()
+        if current is not None:
+            session, task = current
+            if task is asyncio.current_task() and session.in_transaction():
+                await session.commit()
+        return await make_request(bot, method)
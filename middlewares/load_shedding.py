@@ -0,0 +1,75 @@
+import logging
+
+from aiogram import BaseMiddleware, types
+from aiogram.dispatcher.flags import get_flag
+
+from config import SHED_QUEUE_DEPTH, SHED_WRITE_WAIT_MS
+from database import write_wait
+from scheduler import update_scheduler
+
+BUSY_TEXT = "⏳ Бот сейчас перегружен. Это действие временно недоступно — повторите через минуту."
+
+
+# Перегрузка: апдейты копятся в очереди планировщика или записи в БД ждут писателя.
+# Считается на лету из уже собранных метрик, отдельного фонового процесса нет
+class LoadShedder:
+    def __init__(self, queue_depth: int, write_wait_ms: float):
+        self.queue_depth = queue_depth
+        self.write_wait_ms = write_wait_ms
+        self.overloaded = False
+        self.shed = 0
+        self.episodes = 0
+
+    def is_overloaded(self) -> bool:
+        # Только чтение метрик: /metrics смотрит сюда, не меняя счётчиков
+        wait_ms = write_wait.value() * 1000
+        return (
+            (self.queue_depth > 0 and update_scheduler.waiting >= self.queue_depth)
+            or (self.write_wait_ms > 0 and wait_ms >= self.write_wait_ms)
+        )
+
+    def check(self) -> bool:
+        overloaded = self.is_overloaded()
+        if overloaded != self.overloaded:
+            self.overloaded = overloaded
+            if overloaded:
+                self.episodes += 1
+                logging.warning(
+                    f"Перегрузка: в очереди {update_scheduler.waiting}, ожидание записи "
+                    f"{write_wait.value() * 1000:.0f} мс — откладываем второстепенное"
+                )
+            else:
+                logging.info("Нагрузка в норме, второстепенные действия снова доступны")
+        return overloaded
+
+    async def reject_if_busy(self, event: types.Message | types.CallbackQuery) -> bool:
+        # Ответ «занят» — один дешёвый запрос к API вместо запросов к БД и выгрузок хендлера
+        if not self.check():
+            return False
+        self.shed += 1
+        if isinstance(event, types.CallbackQuery):
+            await event.answer(BUSY_TEXT, show_alert=True)
+        else:
+            await event.answer(BUSY_TEXT)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "overloaded": self.is_overloaded(),
+            "waiting": update_scheduler.waiting,
+            "write_wait_ms": write_wait.value() * 1000,
+            "write_wait_max_ms": write_wait.max * 1000,
+            "shed": self.shed,
+            "episodes": self.episodes,
+        }
+
+
+load_shedder = LoadShedder(SHED_QUEUE_DEPTH, SHED_WRITE_WAIT_MS)
+
+
+# Хендлеры с флагом deferrable (@flags.deferrable) при перегрузке не выполняются
+class LoadSheddingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        if get_flag(data, "deferrable") and await load_shedder.reject_if_busy(event):
+            return
+        return await handler(event, data)
@@ -0,0 +1,31 @@
+from aiogram import BaseMiddleware
+
+from config import CHIEF_ADMIN_IDS, TECH_SPECIALIST_ID, RATE_LIMIT_MAX_USERS, RATE_LIMIT_WARN_WINDOW
+from database import get_bot_status
+from utils import RateLimiter
+
+# Уведомление о паузе — не чаще раза в RATE_LIMIT_WARN_WINDOW на пользователя
+_notices = RateLimiter(1 / RATE_LIMIT_WARN_WINDOW, 1, RATE_LIMIT_MAX_USERS, RATE_LIMIT_WARN_WINDOW)
+
+
+# Пауза бота. Регистрируется outer-middleware апдейта раньше DbSessionMiddleware:
+# на паузе апдейт обрывается до открытия сессии и любых хендлеров.
+# Статус берётся из памяти (см. get_bot_status), так что в рабочем режиме проверка бесплатна
+class PauseMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        status = await get_bot_status()
+        if not status.is_paused:
+            return await handler(event, data)
+
+        user = data.get("event_from_user")
+        # Главные админы и Тех Специалист работают и на паузе — иначе бот не возобновить
+        if user is None or user.id in CHIEF_ADMIN_IDS or user.id == TECH_SPECIALIST_ID:
+            return await handler(event, data)
+
+        if _notices.hit(user.id):
+            text = f"🛑 Бот приостановлен\nПричина: {status.pause_reason or 'Технические работы'}"
+            if event.message:
+                await event.message.answer(text)
+            elif event.callback_query:
+                await event.callback_query.answer(text, show_alert=True)
+        return
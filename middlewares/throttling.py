@@ -0,0 +1,44 @@
+from aiogram import BaseMiddleware
+
+from config import (
+    RATE_LIMIT_MESSAGE_RATE, RATE_LIMIT_MESSAGE_BURST,
+    RATE_LIMIT_CALLBACK_RATE, RATE_LIMIT_CALLBACK_BURST,
+    RATE_LIMIT_MAX_USERS, RATE_LIMIT_WARN_WINDOW,
+)
+from utils import RateLimiter
+
+# Отдельные бюджеты для сообщений и нажатий кнопок (статистика — в /metrics)
+message_limiter = RateLimiter(
+    RATE_LIMIT_MESSAGE_RATE, RATE_LIMIT_MESSAGE_BURST, RATE_LIMIT_MAX_USERS, RATE_LIMIT_WARN_WINDOW
+)
+callback_limiter = RateLimiter(
+    RATE_LIMIT_CALLBACK_RATE, RATE_LIMIT_CALLBACK_BURST, RATE_LIMIT_MAX_USERS, RATE_LIMIT_WARN_WINDOW
+)
+
+
+# Антиспам на уровне апдейта. Остальные типы апдейтов пропускаются без ограничений.
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.messages = message_limiter
+        self.callbacks = callback_limiter
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        if event.message:
+            if self.messages.hit(user.id):
+                return await handler(event, data)
+            if self.messages.should_warn(user.id):
+                await event.message.answer("⏳ Не спамьте, подождите секунду...")
+            return
+
+        if event.callback_query:
+            if self.callbacks.hit(user.id):
+                return await handler(event, data)
+            if self.callbacks.should_warn(user.id):
+                await event.callback_query.answer("⏳ Не спамьте!", show_alert=True)
+            return
+
+        return await handler(event, data)
@@ -0,0 +1,193 @@
+from datetime import date
+
+from sqlalchemy import select, func, lambda_stmt
+from sqlalchemy.orm import joinedload
+
+from database import User, Conference, Application, DeletedConference, SupportRequest
+
+
+# ────────────────────────────────────────────────
+# Горячие запросы как lambda_stmt
+# ────────────────────────────────────────────────
+# Обычный select() на каждом вызове заново строится и считает ключ кэша.
+# lambda_stmt строит запрос один раз (по коду лямбды), а значения из замыкания
+# подставляет как параметры — дальше каждый вызов попадает в кэш компиляции SQLAlchemy.
+# В лямбдах только колонки и значения-параметры: никаких условий в зависимости от аргументов,
+# иначе разные формы запроса попадут под один ключ кэша.
+
+APPLICATION_STATUSES = {
+    "current": ("pending", "payment_pending", "payment_sent", "confirmed"),
+    "archive": ("approved", "rejected", "link_sent"),
+}
+
+# Заявки, участникам которых уходит напоминание накануне конференции
+REMINDER_STATUSES = ("confirmed", "link_sent")
+
+
+def user_by_telegram_id(telegram_id: int):
+    return lambda_stmt(lambda: select(User).where(User.telegram_id == telegram_id))
+
+
+def user_record_by_telegram_id(telegram_id: int):
+    # Только поля для CachedUser — без загрузки всей строки пользователя
+    return lambda_stmt(
+        lambda: select(User.id, User.telegram_id, User.role, User.is_banned, User.unreachable_at.is_not(None))
+        .where(User.telegram_id == telegram_id)
+    )
+
+
+def banned_telegram_ids():
+    # По индексу ix_users_is_banned — забаненных единицы
+    return lambda_stmt(lambda: select(User.telegram_id).where(User.is_banned == True))
+
+
+def active_conferences_count():
+    return lambda_stmt(lambda: select(func.count(Conference.id)).where(Conference.is_active == True))
+
+
+def conferences_on_date(day: date):
+    # Организатор — тем же запросом: ленивая загрузка в async-сессии падает с MissingGreenlet.
+    # confirmed — все подтверждённые участники, включая тех, кому напоминание не уйдёт
+    return lambda_stmt(
+        lambda: select(
+            Conference,
+            select(func.count(Application.id))
+            .where(Application.conference_id == Conference.id, Application.status.in_(REMINDER_STATUSES))
+            .correlate(Conference)
+            .scalar_subquery()
+            .label("confirmed"),
+        )
+        .where(Conference.is_active == True, Conference.date == day)
+        .options(joinedload(Conference.organizer))
+    )
+
+
+def reminder_recipients(day: date):
+    # Участники конференций дня с подтверждённой заявкой; недоступные отсекаются по ix_users_unreachable_at
+    return lambda_stmt(
+        lambda: select(Application.conference_id, User.telegram_id, User.is_banned)
+        .join(Conference, Conference.id == Application.conference_id)
+        .join(User, User.id == Application.user_id)
+        .where(
+            Conference.is_active == True,
+            Conference.date == day,
+            Application.status.in_(REMINDER_STATUSES),
+            User.unreachable_at.is_(None),
+        )
+        .order_by(Application.id)
+    )
+
+
+# ────────────────────────────────────────────────
+# Списки и экспорт: строки вместо ORM-объектов
+# ────────────────────────────────────────────────
+# Эти выборки только читаются и сразу превращаются в текст или таблицу.
+# Выбираем нужные колонки — session.execute вернёт лёгкие Row-кортежи
+# без identity map, отслеживания изменений и загрузки связей.
+# Имена колонок совпадают с атрибутами моделей, поэтому row.name, row.city и т. д.
+# читаются так же, как у объектов; поля из связанных таблиц — через label.
+
+CONFERENCE_CARD_COLUMNS = (
+    Conference.id,
+    Conference.name,
+    Conference.city,
+    Conference.date,
+    Conference.fee,
+    Conference.description,
+    Conference.poster_path,
+)
+
+APPLICATION_VIEW_COLUMNS = (
+    Application.id,
+    Application.committee,
+    Application.status,
+    Application.reject_reason,
+    Application.payment_screenshot,
+    Conference.name.label("conference_name"),
+    User.full_name,
+    User.age,
+    User.email,
+    User.institution,
+    User.experience,
+)
+
+
+def upcoming_conferences(today: date):
+    # Диапазон по индексу (is_active, date)
+    return lambda_stmt(
+        lambda: select(*CONFERENCE_CARD_COLUMNS)
+        .where(Conference.is_active == True, Conference.date >= today)
+        .order_by(Conference.date)
+    )
+
+
+def active_conferences():
+    # Организатор подтягивается тем же запросом, а не session.get на каждую конференцию
+    return lambda_stmt(
+        lambda: select(
+            *CONFERENCE_CARD_COLUMNS,
+            User.full_name.label("organizer_name"),
+            User.telegram_id.label("organizer_telegram_id"),
+        )
+        .outerjoin(User, User.id == Conference.organizer_id)
+        .where(Conference.is_active == True)
+        .order_by(Conference.id)
+    )
+
+
+def organizer_applications(organizer_id: int, mode: str):
+    # Заявки на все конференции организатора одним запросом; фильтр по organizer_id через join
+    statuses = APPLICATION_STATUSES["current" if mode == "current" else "archive"]
+    return lambda_stmt(
+        lambda: select(*APPLICATION_VIEW_COLUMNS)
+        .join(Conference, Conference.id == Application.conference_id)
+        .join(User, User.id == Application.user_id)
+        .where(Conference.organizer_id == organizer_id, Application.status.in_(statuses))
+        .order_by(Application.id)
+    )
+
+
+def conference_applications(conference_id: int):
+    return lambda_stmt(
+        lambda: select(*APPLICATION_VIEW_COLUMNS)
+        .join(Conference, Conference.id == Application.conference_id)
+        .join(User, User.id == Application.user_id)
+        .where(Application.conference_id == conference_id)
+        .order_by(Application.id)
+    )
+
+
+def users_export():
+    return lambda_stmt(
+        lambda: select(
+            User.telegram_id, User.username, User.full_name, User.role, User.is_banned, User.ban_reason
+        ).order_by(User.id)
+    )
+
+
+def deleted_conferences_export():
+    return lambda_stmt(
+        lambda: select(
+            DeletedConference.conference_name,
+            DeletedConference.organizer_telegram_id,
+            DeletedConference.deleted_by_telegram_id,
+            DeletedConference.reason,
+            DeletedConference.deleted_at,
+        ).order_by(DeletedConference.id)
+    )
+
+
+def support_requests_export():
+    return lambda_stmt(
+        lambda: select(
+            SupportRequest.id,
+            SupportRequest.message,
+            SupportRequest.screenshot_path,
+            SupportRequest.status,
+            SupportRequest.response,
+            User.telegram_id,
+            User.full_name,
+        )
+        .outerjoin(User, User.id == SupportRequest.user_id)
+        .order_by(SupportRequest.id)
+    )
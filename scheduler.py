@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from cache import user_cache, MISSING
+from config import UPDATE_MAX_CONCURRENCY, UPDATE_STAFF_RESERVED, CHIEF_ADMIN_IDS, TECH_SPECIALIST_ID
+from database import Role
+
+# Классы приоритета — от высшего к низшему
+PRIORITY_STAFF = "staff"              # админы и тех. специалист
+PRIORITY_ORGANIZER = "organizer"
+PRIORITY_PARTICIPANT = "participant"  # участники, незнакомые пользователи, апдейты без пользователя
+PRIORITY_CLASSES = (PRIORITY_STAFF, PRIORITY_ORGANIZER, PRIORITY_PARTICIPANT)
+
+_ROLE_PRIORITY = {
+    Role.CHIEF_TECH.value: PRIORITY_STAFF,
+    Role.CHIEF_ADMIN.value: PRIORITY_STAFF,
+    Role.ADMIN.value: PRIORITY_STAFF,
+    Role.ORGANIZER.value: PRIORITY_ORGANIZER,
+}
+
+
+def update_user_id(update: Update) -> int | None:
+    event = update.event
+    user = getattr(event, "from_user", None)
+    return user.id if user else None
+
+
+def update_priority(user_id: int | None) -> str:
+    # Роль берётся только из кэша: до middleware в БД не ходим. Пользователь с истёкшей записью
+    # один апдейт проходит как участник — дальше DbSessionMiddleware снова положит его в кэш
+    if user_id is None:
+        return PRIORITY_PARTICIPANT
+    if user_id == TECH_SPECIALIST_ID or user_id in CHIEF_ADMIN_IDS:
+        return PRIORITY_STAFF
+    record = user_cache.peek(user_id)
+    if record is MISSING or record is None:
+        return PRIORITY_PARTICIPANT
+    return _ROLE_PRIORITY.get(record.role, PRIORITY_PARTICIPANT)
+
+
+# Очередь одного пользователя: lock + счётчик апдейтов, которые его держат или ждут
+class _UserSlot:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+# Очередь и счётчики одного класса приоритета
+class _PriorityClass:
+    __slots__ = ("limit", "waiters", "active", "processed", "total_wait", "max_wait")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.waiters: deque[asyncio.Future] = deque()
+        self.active = 0
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+# Параллельная обработка апдейтов:
+#  * апдейты одного пользователя — строго по очереди (FSM-анкеты не гоняются сами с собой);
+#  * разных пользователей — параллельно, но не больше max_concurrency одновременно.
+# Порядок держится тем, что до захвата lock'а пользователя нет ни одного await:
+# задачи стартуют в порядке поступления апдейтов и в том же порядке встают в очередь lock'а.
+# Слот пользователя удаляется, как только его апдейты закончились — память не растёт.
+#
+# Освободившийся слот получает первый ждущий апдейт самого приоритетного класса
+# (staff → organizer → participant), внутри класса — по порядку поступления.
+# Участникам доступно не больше max_concurrency - staff_reserved слотов: даже когда
+# анкеты заняли всё, что им можно, апдейт админа или организатора стартует сразу.
+class UpdateScheduler:
+    def __init__(self, max_concurrency: int, staff_reserved: int = 0):
+        self.max_concurrency = max_concurrency
+        self.staff_reserved = min(staff_reserved, max_concurrency - 1)
+        self._classes = {
+            PRIORITY_STAFF: _PriorityClass(max_concurrency),
+            PRIORITY_ORGANIZER: _PriorityClass(max_concurrency),
+            PRIORITY_PARTICIPANT: _PriorityClass(max_concurrency - self.staff_reserved),
+        }
+        self._users: dict[int, _UserSlot] = {}
+        self._inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Выставляется при остановке: долгие хендлеры (рассылки) сворачиваются в ближайшей безопасной точке
+        self.closing = False
+        self.active = 0
+        self.waiting = 0
+        self.processed = 0
+        self.max_wait = 0.0
+
+    async def run(self, user_id: int | None, process, priority: str = PRIORITY_PARTICIPANT):
+        self._inflight += 1
+        self._idle.clear()
+        try:
+            if user_id is None:
+                return await self._run_limited(process, priority)
+            return await self._run_ordered(user_id, process, priority)
+        finally:
+            self._inflight -= 1
+            if not self._inflight:
+                self._idle.set()
+
+    async def _run_ordered(self, user_id: int, process, priority: str):
+        slot = self._users.get(user_id)
+        if slot is None:
+            slot = self._users[user_id] = _UserSlot()
+        slot.refs += 1
+        try:
+            async with slot.lock:
+                return await self._run_limited(process, priority)
+        finally:
+            slot.refs -= 1
+            if not slot.refs:
+                del self._users[user_id]
+
+    async def _run_limited(self, process, priority: str):
+        cls = self._classes[priority]
+        started = time.monotonic()
+        await self._acquire(priority, cls)
+        waited = time.monotonic() - started
+        cls.total_wait += waited
+        cls.max_wait = max(cls.max_wait, waited)
+        self.max_wait = max(self.max_wait, waited)
+        try:
+            return await process()
+        finally:
+            cls.active -= 1
+            cls.processed += 1
+            self.active -= 1
+            self.processed += 1
+            self._wake()
+
+    def _can_start(self, cls: _PriorityClass) -> bool:
+        return self.active < self.max_concurrency and cls.active < cls.limit
+
+    def _take(self, cls: _PriorityClass):
+        cls.active += 1
+        self.active += 1
+
+    async def _acquire(self, priority: str, cls: _PriorityClass):
+        # Без очереди — только если никто равного или более высокого приоритета не ждёт
+        ahead = any(self._classes[name].waiters for name in PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority) + 1])
+        if not ahead and self._can_start(cls):
+            self._take(cls)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        cls.waiters.append(waiter)
+        self.waiting += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже выдан, а задачу отменили — возвращаем его следующему
+                cls.active -= 1
+                self.active -= 1
+                self._wake()
+            elif waiter in cls.waiters:
+                cls.waiters.remove(waiter)
+            raise
+        finally:
+            self.waiting -= 1
+
+    def _wake(self):
+        # Раздаём свободные слоты: сначала старшим классам, внутри класса — по очереди
+        for name in PRIORITY_CLASSES:
+            cls = self._classes[name]
+            while cls.waiters and self._can_start(cls):
+                waiter = cls.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._take(cls)
+                waiter.set_result(None)
+            if self.active >= self.max_concurrency:
+                return
+
+    async def drain(self, timeout: float) -> bool:
+        # Ждём, пока доработают все принятые апдейты (и те, что ещё стоят в очереди).
+        # Новые апдейты к этому моменту уже не поступают — приём останавливается раньше
+        self.closing = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "users": len(self._users),
+            "processed": self.processed,
+            "max_wait": self.max_wait,
+            "staff_reserved": self.staff_reserved,
+            "classes": {
+                name: {
+                    "waiting": len(cls.waiters),
+                    "active": cls.active,
+                    "limit": cls.limit,
+                    "processed": cls.processed,
+                    "avg_wait": cls.total_wait / cls.processed if cls.processed else 0.0,
+                    "max_wait": cls.max_wait,
+                }
+                for name, cls in self._classes.items()
+            },
+        }
+
+
+update_scheduler = UpdateScheduler(UPDATE_MAX_CONCURRENCY, UPDATE_STAFF_RESERVED)
+
+
+# Dispatcher, пропускающий каждый апдейт через update_scheduler.
+# Polling (handle_as_tasks) и webhook и так создают задачу на апдейт — здесь они упорядочиваются и ограничиваются
+class ScheduledDispatcher(Dispatcher):
+    async def feed_update(self, bot: Bot, update: Update, **kwargs):
+        user_id = update_user_id(update)
+        return await update_scheduler.run(
+            user_id,
+            lambda: super(ScheduledDispatcher, self).feed_update(bot, update, **kwargs),
+            update_priority(user_id),
+        )
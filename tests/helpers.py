@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+import itertools
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update, Message, Chat, User as TgUser, CallbackQuery
+
+_ids = itertools.count(1)
+
+
+# Bot API без сети: запросы копятся в calls, ответ — правдоподобная заглушка.
+# hook(method) может вернуть свой ответ или бросить исключение Telegram; delay — задержка сети
+class FakeSession(BaseSession):
+    def __init__(self, hook=None, delay: float = 0.0):
+        super().__init__()
+        self.calls = []
+        self.hook = hook
+        self.delay = delay
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(method)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.hook:
+            result = await self.hook(method)
+            if result is not None:
+                return result
+        name = type(method).__name__
+        if name in ("SendMessage", "SendPhoto", "SendDocument", "EditMessageText"):
+            return Message(
+                message_id=next(_ids), date=datetime.datetime.now(),
+                chat=Chat(id=getattr(method, "chat_id", None) or 1, type="private"),
+                text=getattr(method, "text", None),
+            )
+        if name == "GetMe":
+            return TgUser(id=42, is_bot=True, first_name="bot", username="bot")
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    def texts(self) -> list[str]:
+        return [getattr(call, "text", None) or type(call).__name__ for call in self.calls]
+
+
+def fake_bot(hook=None) -> Bot:
+    return Bot("42:TEST", session=FakeSession(hook))
+
+
+def message_update(user_id: int, text: str) -> Update:
+    update_id = next(_ids)
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=TgUser(id=user_id, is_bot=False, first_name="Test"), text=text,
+    ))
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    update_id = next(_ids)
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), chat_instance="test", data=data,
+        from_user=TgUser(id=user_id, is_bot=False, first_name="Test"),
+        message=Message(
+            message_id=update_id, date=datetime.datetime.now(),
+            chat=Chat(id=user_id, type="private"), text="menu",
+        ),
+    ))
@@ -0,0 +1,200 @@
+import asyncio
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+from aiogram import Dispatcher
+from aiogram.exceptions import TelegramForbiddenError
+from sqlalchemy import select, func, update
+
+import bot as bot_module
+from bot import dp, MAIN_MENU, send_daily_reminders
+from config import DB_READ_POOL_SIZE, TECH_SPECIALIST_ID
+from database import AsyncSessionLocal, engine, read_engine, User, Conference, Application, Role, set_bot_paused, get_or_create_user
+from middlewares import db_session
+from middlewares.db_session import DbSessionMiddleware, DbSessionReleaseMiddleware
+from middlewares.load_shedding import load_shedder, BUSY_TEXT
+from middlewares.throttling import message_limiter
+from scheduler import update_scheduler
+from tests.helpers import fake_bot, message_update
+
+
+# Тесты меню шлют много сообщений от одного пользователя — антиспам им не нужен
+@pytest.fixture
+def no_throttling(monkeypatch):
+    monkeypatch.setattr(message_limiter, "rate", 1e9)
+    monkeypatch.setattr(message_limiter, "burst", 1e9)
+
+
+async def test_throttled_updates_skip_db_session(db, monkeypatch):
+    opened = []
+
+    def counting_session():
+        opened.append(1)
+        return AsyncSessionLocal()
+
+    monkeypatch.setattr(db_session, "AsyncSessionLocal", counting_session)
+    bot = fake_bot()
+    for _ in range(10):
+        await dp.feed_update(bot, message_update(5001, "/start"))
+
+    assert len(opened) == message_limiter.burst
+    assert bot.session.texts().count("⏳ Не спамьте, подождите секунду...") == 1
+
+
+# На паузе апдейт обрывается до сессии БД; уведомление — одно на окно, Тех Специалист проходит
+async def test_paused_bot_stops_updates_before_db_session(db, monkeypatch):
+    opened = []
+
+    def counting_session():
+        opened.append(1)
+        return AsyncSessionLocal()
+
+    monkeypatch.setattr(db_session, "AsyncSessionLocal", counting_session)
+    await set_bot_paused(True, "Обновление", TECH_SPECIALIST_ID)
+    try:
+        bot = fake_bot()
+        await dp.feed_update(bot, message_update(5101, "/start"))
+        await dp.feed_update(bot, message_update(5101, "/start"))
+        assert opened == []
+        assert bot.session.texts() == ["🛑 Бот приостановлен\nПричина: Обновление"]
+
+        await dp.feed_update(bot, message_update(TECH_SPECIALIST_ID, "/start"))
+        assert opened == [1]
+    finally:
+        await set_bot_paused(False, None, TECH_SPECIALIST_ID)
+
+
+# Параллельных апдейтов втрое больше, чем соединений: хендлер читает, пишет и ждёт Telegram.
+# Соединения отдаются перед запросом к Bot API, поэтому все апдейты ждут Telegram одновременно
+async def test_more_concurrent_updates_than_pool_connections(db):
+    updates = 3 * (DB_READ_POOL_SIZE + 1)
+    in_flight = peak = 0
+
+    async def slow_telegram(method):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.2)
+        in_flight -= 1
+
+    bot = fake_bot(slow_telegram)
+    bot.session.middleware(DbSessionReleaseMiddleware())
+    dispatcher = Dispatcher()
+    dispatcher.update.outer_middleware(DbSessionMiddleware())
+
+    @dispatcher.message()
+    async def handler(message, session):
+        await session.scalar(select(func.count(User.id)))
+        session.add(User(telegram_id=message.from_user.id, full_name="Параллельный"))
+        await message.answer("ok")
+        await session.commit()
+
+    await asyncio.gather(*(dispatcher.feed_update(bot, message_update(6000 + i, "x")) for i in range(updates)))
+
+    assert peak == updates
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(select(func.count(User.id))) == updates
+
+
+async def test_main_menu_buttons_reach_their_handlers(db, no_throttling, monkeypatch):
+    reached = []
+    for text, button in MAIN_MENU.items():
+        async def record(message, *args, _text=text, **data):
+            reached.append(_text)
+        monkeypatch.setattr(button, "call", record)
+
+    bot = fake_bot()
+    for text in MAIN_MENU:
+        await dp.feed_update(bot, message_update(7001, text))
+    assert reached == list(MAIN_MENU)
+
+
+# Права проверяют сами хендлеры кнопок — через общий main_menu_button они получают тот же db_user
+async def test_main_menu_keeps_role_checks(db, no_throttling):
+    await get_or_create_user(7002, "Участник")
+    bot = fake_bot()
+    await dp.feed_update(bot, message_update(7002, "📊 Статистика"))
+    await dp.feed_update(bot, message_update(7002, "📋 Мои конференции"))
+    await dp.feed_update(bot, message_update(TECH_SPECIALIST_ID, "📊 Статистика"))
+
+    texts = bot.session.texts()
+    assert texts[:2] == ["Доступ запрещён.", "🚫 Доступ запрещён: вы заблокированы или не являетесь Организатором."]
+    assert texts[2].startswith("<b>Статистика бота:</b>")
+
+
+# Флаг deferrable у кнопок меню проверяет main_menu_button: middleware видит только его собственные флаги
+async def test_main_menu_sheds_deferrable_buttons(db, no_throttling, monkeypatch):
+    monkeypatch.setattr(update_scheduler, "waiting", load_shedder.queue_depth)
+    bot = fake_bot()
+    await dp.feed_update(bot, message_update(TECH_SPECIALIST_ID, "📊 Статистика"))
+    await dp.feed_update(bot, message_update(TECH_SPECIALIST_ID, "🗃 Архив заявок"))
+    await dp.feed_update(bot, message_update(TECH_SPECIALIST_ID, "🔍 Просмотр конференций"))
+
+    texts = bot.session.texts()
+    assert texts[:2] == [BUSY_TEXT, BUSY_TEXT]
+    assert texts[2].startswith("😔 Пока нет актуальных конференций.")
+
+
+# Выгрузки собираются в памяти (utils.dataframe_document) — в рабочем каталоге файлов не остаётся
+async def test_banned_list_export_stays_in_memory(db, no_throttling):
+    await get_or_create_user(TECH_SPECIALIST_ID, "Тех")
+    await get_or_create_user(7003, "Нарушитель")
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(User).where(User.telegram_id == 7003).values(is_banned=True, ban_reason="спам"))
+        await session.commit()
+
+    before = set(os.listdir())
+    bot = fake_bot()
+    await dp.feed_update(bot, message_update(TECH_SPECIALIST_ID, "🚫 Список забаненных пользователей"))
+
+    [document] = [call for call in bot.session.calls if type(call).__name__ == "SendDocument"]
+    assert document.document.filename == "banned_users.csv"
+    assert "7003" in document.document.data.decode("utf-8-sig")
+    assert set(os.listdir()) == before
+
+
+async def test_daily_reminders_skip_unreachable(db, monkeypatch):
+    tomorrow = date.today() + timedelta(days=1)
+    async with AsyncSessionLocal() as session:
+        organizer = User(telegram_id=8001, full_name="Организатор", role=Role.ORGANIZER.value)
+        gone_organizer = User(telegram_id=8002, full_name="Ушёл", role=Role.ORGANIZER.value, unreachable_at=datetime.now())
+        participants = {
+            8011: dict(status="confirmed"),
+            8012: dict(status="link_sent", unreachable_at=datetime.now()),
+            8013: dict(status="confirmed", is_banned=True),
+            8014: dict(status="confirmed"),  # заблокировал бота — узнаем при отправке
+            8015: dict(status="pending"),
+        }
+        conference = Conference(name="Завтра", date=tomorrow, organizer=organizer)
+        orphan = Conference(name="Без организатора", date=tomorrow, organizer=gone_organizer)
+        session.add_all([organizer, gone_organizer, conference, orphan])
+        for telegram_id, fields in participants.items():
+            user = User(
+                telegram_id=telegram_id, full_name=str(telegram_id), role=Role.PARTICIPANT.value,
+                is_banned=fields.get("is_banned", False), unreachable_at=fields.get("unreachable_at"),
+            )
+            session.add(Application(user=user, conference=conference, status=fields["status"]))
+        await session.commit()
+
+    pools = {engine.pool, read_engine.pool}
+    held = []
+
+    async def hook(method):
+        # Списки прочитаны заранее: во время отправки соединения пула свободны
+        held.append(sum(pool.checkedout() for pool in pools))
+        if method.chat_id == 8014:
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+
+    fake = fake_bot(hook)
+    monkeypatch.setattr(bot_module, "bot", fake)
+    await send_daily_reminders()
+
+    sent = {call.chat_id: call.text for call in fake.session.calls}
+    assert set(sent) == {8011, 8014, 8001}
+    assert held == [0, 0, 0]
+    assert f"Завтра ({tomorrow.strftime('%d.%m.%Y')}) состоится конференция" in sent[8011]
+    assert "Участников подтверждено: 4" in sent[8001]
+    async with AsyncSessionLocal() as session:
+        blocked = await session.scalar(select(User.unreachable_at).where(User.telegram_id == 8014))
+    assert blocked is not None
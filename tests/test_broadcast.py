@@ -0,0 +1,178 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramServerError, TelegramNetworkError,
+)
+from aiogram.methods import SendMessage
+
+import broadcast
+from broadcast import Broadcaster, broadcast_jobs, is_unreachable, SENT, FAILED, UNREACHABLE
+from database import AsyncSessionLocal, BroadcastJob, BroadcastRecipient
+from tests.helpers import fake_bot
+
+METHOD = SendMessage(chat_id=1, text="test")
+
+
+def fast_broadcaster(**overrides) -> Broadcaster:
+    params = dict(rate=1000, workers=4, chat_interval=0, max_attempts=3, backoff=0.05)
+    return Broadcaster(**(params | overrides))
+
+
+# Stub Bot API: errors[chat_id] — что бросить на очередных попытках, дальше — успешная отправка
+def scripted_bot(errors: dict[int, list[Exception]]):
+    attempts = []
+
+    async def hook(method):
+        attempts.append((method.chat_id, time.monotonic()))
+        pending = errors.get(method.chat_id)
+        if pending:
+            raise pending.pop(0)
+
+    return fake_bot(hook), attempts
+
+
+def recorder(outcomes: dict):
+    async def on_result(chat_id: int, outcome: str):
+        outcomes[chat_id] = outcome
+    return on_result
+
+
+def test_is_unreachable():
+    assert is_unreachable(TelegramForbiddenError(METHOD, "Forbidden: bot was blocked by the user"))
+    assert is_unreachable(TelegramForbiddenError(METHOD, "Forbidden: user is deactivated"))
+    assert is_unreachable(TelegramBadRequest(METHOD, "Bad Request: chat not found"))
+    assert not is_unreachable(TelegramBadRequest(METHOD, "Bad Request: message is too long"))
+    assert not is_unreachable(TelegramServerError(METHOD, "Bad Gateway"))
+    assert not is_unreachable(TelegramRetryAfter(METHOD, "Too Many Requests", 1))
+
+
+async def test_retry_after_holds_every_worker():
+    bot, attempts = scripted_bot({1: [TelegramRetryAfter(METHOD, "Too Many Requests", 1)]})
+    engine = fast_broadcaster()
+
+    result = await engine.run(range(1, 9), lambda chat_id: bot.send_message(chat_id, "hi"))
+
+    assert (result.sent, result.failed, result.retries) == (8, 0, 1)
+    assert engine.stats()["flood_waits"] == 1
+    # Первая попытка — RetryAfter; до конца паузы ни один воркер ничего не отправляет
+    (first_chat, flood_at), later = attempts[0], attempts[1:]
+    assert first_chat == 1
+    assert min(at for _, at in later) - flood_at >= 0.99
+    assert sorted(chat_id for chat_id, _ in later) == list(range(1, 9))
+
+
+async def test_transient_errors_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(broadcast.random, "uniform", lambda low, high: 1.0)
+    bot, attempts = scripted_bot({
+        1: [TelegramServerError(METHOD, "Bad Gateway"), TelegramServerError(METHOD, "Bad Gateway")],
+        2: [TelegramNetworkError(METHOD, "timeout")] * 3,
+    })
+    outcomes = {}
+    engine = fast_broadcaster()
+
+    result = await engine.run([1, 2], lambda chat_id: bot.send_message(chat_id, "hi"),
+                              on_result=recorder(outcomes))
+
+    assert outcomes == {1: SENT, 2: FAILED}
+    assert (result.sent, result.failed, result.retries) == (1, 1, 4)
+    for chat_id in (1, 2):
+        times = [at for chat, at in attempts if chat == chat_id]
+        assert len(times) == 3
+        # Пауза удваивается: backoff, затем 2 * backoff
+        assert times[1] - times[0] >= 0.05
+        assert times[2] - times[1] >= 0.1
+
+
+async def test_unreachable_recipients_reported_separately():
+    bot, attempts = scripted_bot({
+        2: [TelegramForbiddenError(METHOD, "Forbidden: bot was blocked by the user")],
+        3: [TelegramBadRequest(METHOD, "Bad Request: chat not found")],
+        4: [TelegramBadRequest(METHOD, "Bad Request: message is too long")],
+    })
+    outcomes = {}
+    engine = fast_broadcaster()
+
+    result = await engine.run([1, 2, 3, 4, 2], lambda chat_id: bot.send_message(chat_id, "hi"),
+                              on_result=recorder(outcomes))
+
+    assert outcomes == {1: SENT, 2: UNREACHABLE, 3: UNREACHABLE, 4: FAILED}
+    assert (result.total, result.sent, result.failed, result.unreachable, result.retries) == (4, 1, 3, 2, 0)
+    # Ошибки 4xx не повторяются, повторный chat_id в списке получает одно сообщение
+    assert len(attempts) == 4
+
+
+# Процесс с рассылкой: после KILL_AFTER доставок следующие отправки «зависают»,
+# и через полсекунды процесс убивают SIGKILL — без finally и последних записей
+_KILLED_RUN = """
+import asyncio, os, signal, sys
+from aiogram.methods import SendMessage
+from broadcast import broadcast_jobs
+from database import write_queue
+from tests.helpers import fake_bot
+
+KILL_AFTER = int(sys.argv[1])
+delivered = 0
+
+async def hook(method):
+    global delivered
+    if not isinstance(method, SendMessage):
+        return
+    if delivered >= KILL_AFTER:
+        if delivered == KILL_AFTER:
+            delivered += 1
+            asyncio.get_running_loop().call_later(0.5, os.kill, os.getpid(), signal.SIGKILL)
+        await asyncio.Event().wait()
+    delivered += 1
+    print(method.chat_id, flush=True)
+
+async def main():
+    write_queue.start()
+    await broadcast_jobs.resume_all(fake_bot(hook))
+    await asyncio.sleep(30)
+
+asyncio.run(main())
+"""
+
+
+async def test_killed_job_resumes_without_duplicates(db):
+    recipients = list(range(1, 21))
+    async with AsyncSessionLocal() as session:
+        job = BroadcastJob(
+            owner_telegram_id=1000, title="тест", content={"type": "text", "text": "hi"},
+            total=len(recipients), created_at=datetime.now(),
+        )
+        session.add(job)
+        await session.flush()
+        session.add_all(BroadcastRecipient(job_id=job.id, telegram_id=telegram_id) for telegram_id in recipients)
+        await session.commit()
+        job_id = job.id
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = subprocess.run(
+        [sys.executable, "-c", _KILLED_RUN, "5"], capture_output=True, text=True, timeout=60,
+        env=os.environ | {"PYTHONPATH": root},
+    )
+    assert child.returncode == -signal.SIGKILL, child.stderr
+    before = [int(line) for line in child.stdout.split()]
+    assert len(before) == 5
+
+    after = []
+
+    async def hook(method):
+        if isinstance(method, SendMessage) and method.chat_id in recipients:
+            after.append(method.chat_id)
+
+    assert await broadcast_jobs.resume_all(fake_bot(hook)) == 1
+    assert await broadcast_jobs.wait_stopped(30)
+
+    # Каждый получатель — ровно одно сообщение на оба запуска
+    assert sorted(before + after) == recipients
+    async with AsyncSessionLocal() as session:
+        job = await session.get(BroadcastJob, job_id)
+        assert (job.status, job.sent, job.failed) == ("done", 20, 0)
@@ -0,0 +1,48 @@
+from datetime import date
+
+from sqlalchemy import select
+
+from bot import dp
+from callbacks import ApplicationCallback, ApplicationPage, ConferenceCallback, RequestCallback, parse_callback_data
+from database import AsyncSessionLocal, User, Conference, Application, Role
+from tests.helpers import fake_bot, callback_update, message_update
+
+
+def test_parse_new_and_legacy_formats():
+    packed = ConferenceCallback(action="export", id=7).pack()
+    assert packed == "cf:export:7"
+    assert parse_callback_data(packed) == ConferenceCallback(action="export", id=7)
+    # Кнопки старых сообщений разбираются в те же объекты
+    assert parse_callback_data("export_conf_7") == ConferenceCallback(action="export", id=7)
+    assert parse_callback_data("admin_delete_conf_7") == ConferenceCallback(action="admin_delete", id=7)
+    assert parse_callback_data("conf_appeal_reject_3") == RequestCallback(kind="appeal", action="reject", id=3)
+    assert parse_callback_data("nav_org_archive_2") == ApplicationPage(mode="archive", index=2)
+    for junk in (None, "", "reject_abc", "cf:export", "zz:1:2", "unknown_5"):
+        assert parse_callback_data(junk) is None
+
+
+# Отклонение заявки: кнопка нового и старого формата ведёт в один хендлер, дальше — FSM с причиной
+async def test_reject_button_new_and_legacy_format(db):
+    async with AsyncSessionLocal() as session:
+        organizer = User(telegram_id=8101, full_name="Орг", role=Role.ORGANIZER.value)
+        participant = User(telegram_id=8102, full_name="Участник", role=Role.PARTICIPANT.value)
+        conf = Conference(name="Конференция", date=date(2026, 12, 1), organizer=organizer)
+        first = Application(user=participant, conference=conf, committee="UNSC", status="pending")
+        second = Application(user=participant, conference=conf, committee="UNGA", status="pending")
+        session.add_all([organizer, participant, conf, first, second])
+        await session.commit()
+
+    bot = fake_bot()
+    for data, reason in ((ApplicationCallback(action="reject", id=first.id).pack(), "Нет мест"),
+                         (f"reject_{second.id}", "Поздно")):
+        await dp.feed_update(bot, callback_update(8101, data))
+        await dp.feed_update(bot, message_update(8101, reason))
+
+    texts = bot.session.texts()
+    assert texts.count("📝 Введите причину отклонения:") == 2
+    assert sum("отклонена" in text and "Конференция" in text for text in texts) == 2
+    async with AsyncSessionLocal() as session:
+        stored = (await session.execute(
+            select(Application.status, Application.reject_reason).order_by(Application.id)
+        )).all()
+    assert stored == [("rejected", "Нет мест"), ("rejected", "Поздно")]
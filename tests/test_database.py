@@ -0,0 +1,183 @@
+import asyncio
+from datetime import date
+
+import sqlalchemy as sa
+from sqlalchemy import select, func
+
+import database
+from cache import CachedUser, MISSING, user_cache
+from database import (
+    AsyncSessionLocal, engine, read_engine, init_db, DB_ENGINE_MODE, IS_SQLITE, MIGRATIONS,
+    User, Role, Conference, BroadcastJob, SchemaVersion, get_or_create_user, write_queue
+)
+from config import TECH_SPECIALIST_ID
+
+
+async def test_session_routes_only_selects_to_readers(db):
+    async with AsyncSessionLocal() as session:
+        get_bind = session.sync_session.get_bind
+        expected_reader = engine.sync_engine if DB_ENGINE_MODE == "single" else read_engine.sync_engine
+        assert get_bind(clause=select(User)) is expected_reader
+        # text() может оказаться записью — только писатель, и сессия на нём остаётся
+        assert get_bind(clause=sa.text("DELETE FROM users")) is engine.sync_engine
+        assert get_bind(clause=select(User)) is engine.sync_engine
+
+    async with AsyncSessionLocal() as session:
+        assert session.sync_session.get_bind(clause=select(User)) is expected_reader
+
+
+async def test_text_and_from_statement_writes_reach_writer(db):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            sa.text("INSERT INTO users (telegram_id, role, is_banned) VALUES (:telegram_id, 'Участник', false)"),
+            {"telegram_id": 2001},
+        )
+        stmt = select(User).from_statement(
+            sa.text("INSERT INTO users (telegram_id, role, is_banned) VALUES (:telegram_id, 'Участник', false) RETURNING *")
+        )
+        created = (await session.execute(stmt, {"telegram_id": 2002})).scalar_one()
+        await session.commit()
+    assert created.telegram_id == 2002
+
+    async with AsyncSessionLocal() as session:
+        stored = (await session.scalars(select(User.telegram_id).order_by(User.telegram_id))).all()
+    assert stored == [2001, 2002]
+
+
+async def count_users(telegram_id: int) -> int:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count(User.id)).where(User.telegram_id == telegram_id))
+
+
+async def test_get_or_create_user_inserts_then_updates(db):
+    user = await get_or_create_user(1001, "Первое Имя", "first")
+    assert (user.full_name, user.username, user.role) == ("Первое Имя", "first", Role.PARTICIPANT.value)
+
+    again = await get_or_create_user(1001, "Второе Имя")
+    assert again.id == user.id
+    assert (again.full_name, again.username) == ("Второе Имя", "first")
+    assert await count_users(1001) == 1
+
+    async with AsyncSessionLocal() as session:
+        stored = await session.scalar(select(User).where(User.telegram_id == 1001))
+    assert stored.full_name == "Второе Имя"
+
+
+async def test_get_or_create_user_without_name(db):
+    user = await get_or_create_user(1002)
+    assert user.full_name == "Не указано"
+    assert (await get_or_create_user(1002)).id == user.id
+    assert await count_users(1002) == 1
+
+
+async def test_get_or_create_user_assigns_privileged_role(db):
+    user = await get_or_create_user(TECH_SPECIALIST_ID, "Тех")
+    assert user.role == Role.CHIEF_TECH.value
+    assert (await get_or_create_user(TECH_SPECIALIST_ID, "Тех")).role == Role.CHIEF_TECH.value
+    assert await count_users(TECH_SPECIALIST_ID) == 1
+
+
+# Групповой коммит включён: смена имени уходит в очередь, функция её не ждёт
+async def test_get_or_create_user_queues_rename(db, monkeypatch):
+    monkeypatch.setattr(write_queue, "enabled", True)
+    await get_or_create_user(1003, "Старое Имя")
+    write_queue.start()
+    try:
+        assert (await get_or_create_user(1003, "Новое Имя")).full_name == "Новое Имя"
+    finally:
+        await write_queue.stop()
+
+    async with AsyncSessionLocal() as session:
+        stored = await session.scalar(select(User).where(User.telegram_id == 1003))
+    assert stored.full_name == "Новое Имя"
+
+
+async def test_failed_queued_rename_is_logged_and_uncached(db, monkeypatch, caplog):
+    monkeypatch.setattr(write_queue, "enabled", True)
+    user = await get_or_create_user(1004, "Старое Имя")
+    user_cache.put(1004, CachedUser(user.id, 1004, user.role, False))
+
+    failed = asyncio.get_running_loop().create_future()
+    failed.set_exception(RuntimeError("database is locked"))
+    monkeypatch.setattr(database, "queued_update", lambda obj, **values: failed)
+    write_queue.start()
+    try:
+        await get_or_create_user(1004, "Новое Имя")
+        await asyncio.sleep(0)
+    finally:
+        await write_queue.stop()
+
+    assert "Не удалось обновить пользователя 1004: database is locked" in caplog.text
+    assert user_cache.get(1004) is MISSING
+
+
+async def schema_version() -> int:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(SchemaVersion.version))
+
+
+def inspect_table(connection, table: str) -> tuple[dict, set]:
+    inspector = sa.inspect(connection)
+    columns = {col["name"]: col["type"] for col in inspector.get_columns(table)}
+    return columns, {index["name"] for index in inspector.get_indexes(table)}
+
+
+async def test_init_db_reaches_latest_version(db):
+    assert await schema_version() == MIGRATIONS[-1][0]
+    # Повторный запуск ничего не меняет
+    await init_db()
+    assert await schema_version() == MIGRATIONS[-1][0]
+
+
+# Схема до всех миграций: дата конференции строкой, без индексов по горячим фильтрам
+async def test_migrations_upgrade_legacy_schema(db):
+    async with engine.begin() as conn:
+        if IS_SQLITE:
+            await conn.execute(sa.text("DROP TABLE conferences"))
+            await conn.execute(sa.text(
+                "CREATE TABLE conferences (id INTEGER PRIMARY KEY, name VARCHAR(200), description TEXT, "
+                "city VARCHAR(100), date VARCHAR(20), is_active BOOLEAN, fee FLOAT, qr_code_path VARCHAR(500), "
+                "poster_path VARCHAR(500), committee_chats JSON, organizer_id INTEGER REFERENCES users(id))"
+            ))
+        else:
+            await conn.execute(sa.text("ALTER TABLE conferences ALTER COLUMN date TYPE VARCHAR(20) USING date::text"))
+            await conn.execute(sa.text("DROP INDEX ix_conferences_is_active_date"))
+        await conn.execute(sa.text("DROP INDEX ix_users_role"))
+        await conn.execute(sa.text("DROP INDEX ix_users_unreachable_at"))
+        await conn.execute(sa.text("ALTER TABLE users DROP COLUMN unreachable_at"))
+        await conn.execute(sa.text(
+            "INSERT INTO users (id, telegram_id, full_name, role, is_banned) VALUES (1, 2001, 'Орг', 'Организатор', false)"
+        ))
+        await conn.execute(sa.text(
+            "INSERT INTO conferences (id, name, date, is_active, fee, organizer_id) "
+            "VALUES (1, 'Старая', '25.12.2026', true, 0, 1), (2, 'ISO', '2026-12-26', true, 0, 1)"
+        ))
+        for column in ("retries", "elapsed", "status_chat_id", "status_message_id"):
+            await conn.execute(sa.text(f"ALTER TABLE broadcast_jobs DROP COLUMN {column}"))
+        await conn.execute(sa.text(
+            "INSERT INTO broadcast_jobs (id, owner_telegram_id, title, content, status, total, sent, failed, created_at) "
+            "VALUES (1, 2001, 'Старая', '{}', 'done', 0, 0, 0, '2026-01-01 00:00:00')"
+        ))
+        await conn.execute(sa.text("UPDATE schema_version SET version = 0"))
+
+    await init_db()
+
+    assert await schema_version() == MIGRATIONS[-1][0]
+    async with engine.connect() as conn:
+        _, users_indexes = await conn.run_sync(inspect_table, "users")
+        conf_columns, conf_indexes = await conn.run_sync(inspect_table, "conferences")
+    assert "ix_users_role" in users_indexes
+    assert "ix_users_unreachable_at" in users_indexes
+    assert isinstance(conf_columns["date"], sa.Date)
+    assert "ix_conferences_is_active_date" in conf_indexes
+
+    async with AsyncSessionLocal() as session:
+        dates = (await session.execute(select(Conference.id, Conference.date).order_by(Conference.id))).all()
+    assert dates == [(1, date(2026, 12, 25)), (2, date(2026, 12, 26))]
+
+    async with AsyncSessionLocal() as session:
+        job = await session.get(BroadcastJob, 1)
+    assert (job.retries, job.elapsed, job.status_message_id) == (0, 0.0, None)
+
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(select(User.unreachable_at).where(User.telegram_id == 2001)) is None
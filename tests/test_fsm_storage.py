@@ -0,0 +1,64 @@
+import json
+import logging
+
+import sqlalchemy as sa
+from aiogram.fsm.storage.base import StorageKey
+
+from database import AsyncSessionLocal, FsmRecord
+from fsm_storage import DatabaseStorage, _encode_key
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+async def _table() -> dict[str, tuple[str | None, dict]]:
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(sa.select(FsmRecord.storage_key, FsmRecord.state, FsmRecord.data))).all()
+    return {storage_key: (state, json.loads(data)) for storage_key, state, data in rows}
+
+
+async def test_flush_and_load_round_trip(db):
+    storage = DatabaseStorage(ttl=3600, flush_interval=60)
+    await storage.set_state(_key(1), "Form:name")
+    await storage.set_data(_key(1), {"name": "Анна"})
+    await storage.set_state(_key(2), "Form:name")
+    await storage.flush()
+    # Ключ без состояния и данных из таблицы удаляется
+    await storage.set_state(_key(2), None)
+    await storage.flush()
+
+    assert await _table() == {_encode_key(_key(1)): ("Form:name", {"name": "Анна"})}
+
+    restored = DatabaseStorage(ttl=3600, flush_interval=60)
+    assert await restored.load() == 1
+    assert await restored.get_state(_key(1)) == "Form:name"
+    assert await restored.get_data(_key(1)) == {"name": "Анна"}
+
+
+async def test_unserializable_key_skipped_and_logged(db, caplog):
+    storage = DatabaseStorage(ttl=3600, flush_interval=60)
+    await storage.set_state(_key(1), "Form:name")
+    await storage.set_data(_key(1), {"name": "old"})
+    await storage.flush()
+
+    await storage.set_data(_key(1), {"name": object()})
+    await storage.set_state(_key(2), "Form:email")
+    await storage.set_data(_key(2), {"email": "a@b.c"})
+    with caplog.at_level(logging.ERROR):
+        await storage.flush()
+
+    # Плохой ключ не мешает остальным; в таблице у него остаётся прежняя запись
+    assert await _table() == {
+        _encode_key(_key(1)): ("Form:name", {"name": "old"}),
+        _encode_key(_key(2)): ("Form:email", {"email": "a@b.c"}),
+    }
+    assert _encode_key(_key(1)) in caplog.text
+    stats = storage.stats()
+    assert stats["errors"] == 1
+    assert stats["dirty"] == 0
+
+    # Следующая запись в ключ снова отправляет его в таблицу
+    await storage.set_data(_key(1), {"name": "new"})
+    await storage.flush()
+    assert (await _table())[_encode_key(_key(1))] == ("Form:name", {"name": "new"})
@@ -0,0 +1,23 @@
+from middlewares.load_shedding import LoadShedder
+from scheduler import update_scheduler
+
+
+def test_stats_do_not_change_counters(monkeypatch):
+    shedder = LoadShedder(queue_depth=10, write_wait_ms=0)
+    monkeypatch.setattr(update_scheduler, "waiting", 10)
+
+    for _ in range(3):
+        assert shedder.stats()["overloaded"]
+    assert (shedder.episodes, shedder.overloaded) == (0, False)
+
+    # Эпизод считает только проверка на пути апдейта — один раз на вход в перегрузку
+    assert shedder.check() and shedder.check()
+    assert shedder.stats()["episodes"] == 1
+
+    monkeypatch.setattr(update_scheduler, "waiting", 0)
+    assert not shedder.stats()["overloaded"]
+    assert shedder.overloaded
+    assert not shedder.check()
+    assert shedder.stats() | {"write_wait_ms": 0, "write_wait_max_ms": 0} == {
+        "overloaded": False, "waiting": 0, "write_wait_ms": 0, "write_wait_max_ms": 0, "shed": 0, "episodes": 1,
+    }
@@ -0,0 +1,88 @@
+from datetime import date, timedelta
+
+import queries
+from database import AsyncSessionLocal, User, Conference, Application, Role, DeletedConference, SupportRequest
+
+TODAY = date(2026, 10, 17)
+
+
+# Организатор, два участника (один забанен) и три конференции: завтра, послезавтра и неактивная
+async def seed():
+    async with AsyncSessionLocal() as session:
+        organizer = User(telegram_id=3001, full_name="Организатор", role=Role.ORGANIZER.value)
+        alice = User(telegram_id=3002, full_name="Алиса", role=Role.PARTICIPANT.value, email="a@example.com")
+        bob = User(telegram_id=3003, full_name="Боб", role=Role.PARTICIPANT.value, is_banned=True, ban_reason="спам")
+        tomorrow = Conference(name="Завтра", city="Бишкек", date=TODAY + timedelta(days=1), fee=100, organizer=organizer)
+        later = Conference(name="Позже", date=TODAY + timedelta(days=2), fee=0, organizer=organizer)
+        inactive = Conference(name="Закрыта", date=TODAY + timedelta(days=1), is_active=False, organizer=organizer)
+        session.add_all([
+            organizer, alice, bob, tomorrow, later, inactive,
+            Application(user=alice, conference=tomorrow, committee="UNSC", status="confirmed"),
+            Application(user=bob, conference=tomorrow, committee="UNGA", status="rejected", reject_reason="нет мест"),
+            SupportRequest(user=alice, message="Не приходит ссылка", status="pending"),
+            DeletedConference(
+                conference_name="Удалённая", organizer_telegram_id=3001, deleted_by_telegram_id=3004,
+                reason="дубль", deleted_at="2026-10-01 12:00",
+            ),
+        ])
+        await session.commit()
+        return {"organizer": organizer.id, "tomorrow": tomorrow.id}
+
+
+async def test_hot_queries(db):
+    await seed()
+    async with AsyncSessionLocal() as session:
+        record = (await session.execute(queries.user_record_by_telegram_id(3003))).first()
+        assert tuple(record) == (record[0], 3003, Role.PARTICIPANT.value, True, False)
+        assert (await session.execute(queries.user_record_by_telegram_id(9999))).first() is None
+        assert (await session.execute(queries.user_by_telegram_id(3002))).scalar_one().full_name == "Алиса"
+        assert (await session.execute(queries.banned_telegram_ids())).scalars().all() == [3003]
+        assert (await session.execute(queries.active_conferences_count())).scalar_one() == 2
+
+        on_date = (await session.execute(queries.conferences_on_date(TODAY + timedelta(days=1)))).all()
+        assert [(conf.name, conf.organizer.telegram_id, confirmed) for conf, confirmed in on_date] == [("Завтра", 3001, 1)]
+        recipients = (await session.execute(queries.reminder_recipients(TODAY + timedelta(days=1)))).all()
+        assert [tuple(row) for row in recipients] == [(on_date[0][0].id, 3002, False)]
+
+        upcoming = (await session.execute(queries.upcoming_conferences(TODAY + timedelta(days=2)))).all()
+        assert [row.name for row in upcoming] == ["Позже"]
+
+
+# Списки и экспорт отдают Row-кортежи: хендлеры читают у них те же атрибуты, что читали у ORM-объектов
+async def test_row_queries_expose_handler_attributes(db):
+    ids = await seed()
+    async with AsyncSessionLocal() as session:
+        conferences = (await session.execute(queries.active_conferences())).all()
+        assert [(row.name, row.organizer_name, row.organizer_telegram_id) for row in conferences] == [
+            ("Завтра", "Организатор", 3001), ("Позже", "Организатор", 3001),
+        ]
+        first = conferences[0]
+        assert (first.id, first.city, first.date, first.fee, first.description, first.poster_path) == (
+            ids["tomorrow"], "Бишкек", TODAY + timedelta(days=1), 100, None, None,
+        )
+
+        users = {row.telegram_id: row for row in (await session.execute(queries.users_export())).all()}
+        assert (users[3003].full_name, users[3003].role, users[3003].is_banned, users[3003].ban_reason) == (
+            "Боб", Role.PARTICIPANT.value, True, "спам",
+        )
+        assert users[3002].username is None and users[3002].ban_reason is None
+
+        deleted = (await session.execute(queries.deleted_conferences_export())).one()
+        assert (deleted.conference_name, deleted.organizer_telegram_id, deleted.deleted_by_telegram_id,
+                deleted.reason, deleted.deleted_at) == ("Удалённая", 3001, 3004, "дубль", "2026-10-01 12:00")
+
+        support = (await session.execute(queries.support_requests_export())).one()
+        assert (support.message, support.status, support.response, support.screenshot_path,
+                support.telegram_id, support.full_name) == ("Не приходит ссылка", "pending", None, None, 3002, "Алиса")
+
+        current = (await session.execute(queries.organizer_applications(ids["organizer"], "current"))).all()
+        archive = (await session.execute(queries.organizer_applications(ids["organizer"], "archive"))).all()
+        assert [(row.full_name, row.committee, row.status) for row in current] == [("Алиса", "UNSC", "confirmed")]
+        assert [(row.full_name, row.reject_reason) for row in archive] == [("Боб", "нет мест")]
+        app = current[0]
+        assert (app.conference_name, app.email, app.age, app.institution, app.experience, app.payment_screenshot) == (
+            "Завтра", "a@example.com", None, None, None, None,
+        )
+
+        participants = (await session.execute(queries.conference_applications(ids["tomorrow"]))).all()
+        assert [row.full_name for row in participants] == ["Алиса", "Боб"]
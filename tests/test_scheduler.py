@@ -0,0 +1,76 @@
+import asyncio
+
+from scheduler import UpdateScheduler, PRIORITY_STAFF, PRIORITY_PARTICIPANT
+
+
+# Апдейты одного пользователя — по очереди и в порядке поступления, разных — параллельно
+async def test_same_user_in_order_other_users_in_parallel():
+    scheduler = UpdateScheduler(max_concurrency=10)
+    log = []
+
+    def process(user_id: int, n: int):
+        async def handle():
+            log.append(("start", user_id, n))
+            await asyncio.sleep(0.01)
+            log.append(("end", user_id, n))
+        return handle
+
+    await asyncio.gather(*(scheduler.run(user_id, process(user_id, n)) for n in range(3) for user_id in (1, 2)))
+
+    for user_id in (1, 2):
+        own = [(event, n) for event, uid, n in log if uid == user_id]
+        assert own == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    # Второй пользователь стартует, не дожидаясь первого
+    assert log[:2] == [("start", 1, 0), ("start", 2, 0)]
+    assert scheduler.stats()["users"] == 0
+
+
+async def test_concurrency_is_capped():
+    scheduler = UpdateScheduler(max_concurrency=2)
+    running = peak = 0
+
+    async def handle():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await asyncio.gather(*(scheduler.run(user_id, handle) for user_id in range(8)))
+
+    assert peak == 2
+    assert scheduler.stats()["processed"] == 8
+
+
+# Участники не занимают резерв персонала, а освободившийся слот первым получает ждущий персонал
+async def test_staff_reserve_and_priority():
+    scheduler = UpdateScheduler(max_concurrency=3, staff_reserved=1)
+    release = asyncio.Event()
+    started = []
+
+    def process(name: str):
+        async def handle():
+            started.append(name)
+            await release.wait()
+        return handle
+
+    participants = [
+        asyncio.create_task(scheduler.run(user_id, process(f"p{user_id}"), PRIORITY_PARTICIPANT))
+        for user_id in range(4)
+    ]
+    await asyncio.sleep(0)
+    assert started == ["p0", "p1"]
+
+    staff = [
+        asyncio.create_task(scheduler.run(100 + n, process(f"s{n}"), PRIORITY_STAFF))
+        for n in range(2)
+    ]
+    await asyncio.sleep(0)
+    # Резервный слот — сразу, второй админ ждёт, но впереди участников
+    assert started == ["p0", "p1", "s0"]
+    assert scheduler.stats()["classes"][PRIORITY_STAFF]["waiting"] == 1
+
+    release.set()
+    await asyncio.gather(*participants, *staff)
+    assert started[3] == "s1"
+    assert sorted(started[4:]) == ["p2", "p3"]
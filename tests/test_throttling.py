@@ -0,0 +1,51 @@
+import tracemalloc
+
+from utils import RateLimiter
+
+USERS = 100_000
+
+
+def test_buckets_stay_within_cap():
+    limiter = RateLimiter(rate=2, burst=4, max_keys=10_000, warn_window=10)
+    # Все пользователи в одно мгновение: простаивающих вёдер нет, срабатывает только предел
+    for user_id in range(USERS):
+        assert limiter.hit(user_id, now=1000.0)
+
+    stats = limiter.stats()
+    assert stats["size"] == 10_000
+    assert stats["evictions"] == USERS - 10_000
+    # Вытесняются самые давно активные: свежие пользователи по-прежнему ограничены своим ведром
+    assert not limiter.should_warn(0, now=1000.0)
+    for _ in range(3):
+        assert limiter.hit(USERS - 1, now=1000.0)
+    assert not limiter.hit(USERS - 1, now=1000.0)
+
+
+def test_idle_buckets_dropped_before_cap():
+    limiter = RateLimiter(rate=2, burst=4, max_keys=10_000, warn_window=10)
+    # Поток новых пользователей, 500 в секунду: ведро старше warn_window уже ничего не помнит,
+    # и его удаление не считается вытеснением
+    for user_id in range(USERS):
+        limiter.hit(user_id, now=user_id / 500)
+
+    stats = limiter.stats()
+    assert stats["size"] <= 10 * 500 + 1
+    assert stats["evictions"] == 0
+
+
+def test_memory_bounded_after_cap():
+    limiter = RateLimiter(rate=2, burst=4, max_keys=10_000, warn_window=10)
+    tracemalloc.start()
+    try:
+        for user_id in range(USERS):
+            limiter.hit(user_id, now=1000.0)
+        filled = tracemalloc.get_traced_memory()[0]
+        for user_id in range(USERS, 2 * USERS):
+            limiter.hit(user_id, now=1000.0)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    assert limiter.stats()["size"] == 10_000
+    # Вдвое больше пользователей — а память та же: растёт только счётчик вытеснений
+    assert after - filled < filled * 0.1
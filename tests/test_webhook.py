@@ -0,0 +1,33 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook
+from bot import dp
+from config import WEBHOOK_PATH
+from tests.helpers import fake_bot, message_update
+
+
+async def post_update(client: TestClient, secret: str | None):
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    body = message_update(6001, "/start").model_dump_json(exclude_none=True)
+    return await client.post(WEBHOOK_PATH, data=body, headers=headers)
+
+
+async def test_webhook_checks_secret_token(db, monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", "s3cret")
+    bot = fake_bot()
+    async with TestClient(TestServer(webhook.build_webhook_app(dp, bot))) as client:
+        assert (await post_update(client, "wrong")).status == 401
+        assert (await post_update(client, None)).status == 401
+        assert bot.session.calls == []
+
+        assert (await post_update(client, "s3cret")).status == 200
+        # Ответ 200 уходит сразу, апдейт обрабатывается в фоне
+        for _ in range(100):
+            if any(type(call).__name__ == "SendMessage" for call in bot.session.calls):
+                break
+            await asyncio.sleep(0.05)
+        assert [call.chat_id for call in bot.session.calls if type(call).__name__ == "SendMessage"] == [6001]
@@ -0,0 +1,125 @@
+import io
+import time
+from collections import OrderedDict
+
+from aiogram.types import BufferedInputFile
+
+
+# Состояние одного ведра: токены на момент updated_at и время последнего предупреждения
+class _Bucket:
+    __slots__ = ("tokens", "updated_at", "warned_at")
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.warned_at = float("-inf")
+
+
+# Token bucket по ключу (telegram_id): до burst событий подряд, дальше rate событий в секунду.
+# Память ограничена: ведро, которое успело наполниться до burst, ничем не отличается от нового —
+# такие вёдра выбрасываются с головы LRU; сверх max_keys вытесняются самые давние.
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int, warn_window: float):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.warn_window = warn_window
+        # Через столько секунд простоя ведро гарантированно полное
+        self._idle_after = burst / rate
+        self._buckets: OrderedDict[int, _Bucket] = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
+
+    def hit(self, key: int, now: float | None = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(self.burst, now)
+            self._buckets[key] = bucket
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+            self._buckets.move_to_end(key)
+
+        self._evict(now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.allowed += 1
+            return True
+        self.limited += 1
+        return False
+
+    def should_warn(self, key: int, now: float | None = None) -> bool:
+        # Не чаще одного предупреждения за warn_window — само предупреждение тоже запрос к API
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None or now - bucket.warned_at < self.warn_window:
+            return False
+        bucket.warned_at = now
+        return True
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        # Голова LRU — самые давно активные; пока они уже наполнились, удаление ничего не меняет.
+        # Ведро с непросроченным предупреждением держим, иначе окно предупреждений сбросится
+        idle_before = now - max(self._idle_after, self.warn_window)
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if oldest.updated_at > idle_before:
+                break
+            buckets.popitem(last=False)
+        while len(buckets) > self.max_keys:
+            buckets.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._buckets),
+            "max_keys": self.max_keys,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "evictions": self.evictions,
+        }
+
+
+# Среднее недавних наблюдений: вес наблюдения уменьшается вдвое каждые half_life секунд.
+# Пока наблюдений нет, значение затухает к нулю — старый всплеск не висит бесконечно
+class DecayingAverage:
+    def __init__(self, half_life: float):
+        self.half_life = half_life
+        self._sum = 0.0
+        self._weight = 0.0
+        self._updated_at = time.monotonic()
+        self.max = 0.0
+
+    def _decay(self, now: float):
+        factor = 0.5 ** ((now - self._updated_at) / self.half_life)
+        self._sum *= factor
+        self._weight *= factor
+        self._updated_at = now
+
+    def observe(self, value: float, now: float | None = None):
+        self._decay(time.monotonic() if now is None else now)
+        self._sum += value
+        self._weight += 1
+        self.max = max(self.max, value)
+
+    def value(self, now: float | None = None) -> float:
+        self._decay(time.monotonic() if now is None else now)
+        return self._sum / max(self._weight, 1.0)
+
+
+# Выгрузка DataFrame сразу в память: на диске не остаётся файлов (в том числе недописанных
+# при остановке бота), а одновременные экспорты не перезаписывают файлы друг друга
+def dataframe_document(df, filename: str) -> BufferedInputFile:
+    buffer = io.BytesIO()
+    if filename.endswith(".csv"):
+        df.to_csv(buffer, index=False, encoding="utf-8-sig")
+    else:
+        df.to_excel(buffer, index=False)
+    return BufferedInputFile(buffer.getvalue(), filename=filename)
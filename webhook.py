@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_HOST, WEBHOOK_PORT
+)
+
+
+# Ответ Telegram — сразу 200 (handle_in_background), обработка — в фоне.
+# Сколько апдейтов идёт одновременно и в каком порядке, решает ScheduledDispatcher
+class WebhookRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, **data):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+
+    async def _background_feed_update(self, bot: Bot, update: dict) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка обработки апдейта из webhook: {e}")
+
+    async def close(self) -> None:
+        # Сессию бота закрывает bot.main — после того, как доработают принятые апдейты
+        pass
+
+
+def build_webhook_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    app = web.Application()
+    handler = WebhookRequestHandler(dispatcher, bot, WEBHOOK_SECRET)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    app = build_webhook_app(dispatcher, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logging.info(f"Webhook: слушаем {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, адрес для Telegram — {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    # Работаем до SIGTERM/SIGINT. Webhook у Telegram не снимаем: пока бот перезапускается,
+    # апдейты копятся на стороне Telegram и придут следующему процессу
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    with suppress(NotImplementedError):  # Windows: сигналы через loop не поддерживаются
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+
+    try:
+        await stop.wait()
+        logging.info("Webhook: получен сигнал остановки, прекращаем приём апдейтов")
+    finally:
+        # Сервер перестаёт принимать запросы; уже принятые апдейты дорабатывают в update_scheduler
+        await runner.cleanup()